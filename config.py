@@ -18,6 +18,10 @@ finally:
 # Load environment variables
 load_dotenv()
 
+api_keys = {
+    "finnhub": os.getenv(key="FINNHUB_API_KEY", default="No Key Found"),
+}
+
 # ETFs (Index Funds)
 etf_list = ['SPY', 'QQQ', 'AGG']
 
@@ -33,4 +37,41 @@ db_credentials = {
     "port": os.getenv(key="PSQL_PORT", default="No Key Found"),
     "database": os.getenv(key="DB_NAME", default="No Key Found"),
     "timeout": os.getenv(key="CONNECTION_TIMEOUT", default="No Key Found"),
-}
\ No newline at end of file
+    # size of the connection pool shared by the setup, the loaders and the reads (src/db/connection.py)
+    "pool_min_size": int(os.getenv(key="DB_POOL_MIN_SIZE") or 1),
+    "pool_max_size": int(os.getenv(key="DB_POOL_MAX_SIZE") or 4),
+}
+
+# Number of worker processes used by the Monte Carlo stage (defaults to every core)
+monte_carlo_workers = int(os.getenv(key="MONTE_CARLO_WORKERS") or os.cpu_count() or 1)
+
+# Seed and result cache for the Monte Carlo stage; with a seed set, reruns on unchanged prices reuse the cached result
+monte_carlo_seed = int(os.getenv(key="MONTE_CARLO_SEED")) if os.getenv(key="MONTE_CARLO_SEED") else None
+monte_carlo_cache_dir = os.getenv(key="MONTE_CARLO_CACHE_DIR") or '.sim_cache'
+
+# File of the running per-ticker return statistics the simulation reads its parameters from
+return_stats_path = os.getenv(key="RETURN_STATS_PATH") or '.return_stats.json'
+
+# Float type of the stock_data price columns in memory ('float64' or 'float32', which halves them)
+price_float_dtype = os.getenv(key="PRICE_FLOAT_DTYPE") or 'float64'
+
+# Local cache of yfinance bars (only missing days are downloaded); offline mode never touches the network
+yfinance_cache_dir = os.getenv(key="YFINANCE_CACHE_DIR") or '.yfinance_cache'
+yfinance_offline = os.getenv(key="YFINANCE_OFFLINE", default="").lower() in ('1', 'true', 'yes')
+
+# Download the tickers in batches of this size on a pool of worker processes (unset = one download for all tickers)
+yfinance_batch_size = int(os.getenv(key="YFINANCE_BATCH_SIZE")) if os.getenv(key="YFINANCE_BATCH_SIZE") else None
+yfinance_workers = int(os.getenv(key="YFINANCE_WORKERS") or 4)
+
+# Extract source: 'yfinance' or 'finnhub', prefixed with 'record:' to save the raw responses or 'replay:' to run from them offline
+data_source = os.getenv(key="DATA_SOURCE") or 'yfinance'
+recording_dir = os.getenv(key="RECORDING_DIR") or '.recordings'
+
+# stock_data load: 'upsert' merges on (ticker, date) so reruns are safe, 'append' only inserts
+load_mode = os.getenv(key="LOAD_MODE") or 'upsert'
+
+# Number of simulation runs kept in the database, older run partitions are dropped after a load (unset = keep all)
+simulation_keep_runs = int(os.getenv(key="SIMULATION_KEEP_RUNS")) if os.getenv(key="SIMULATION_KEEP_RUNS") else None
+
+# Simulation storage layout: 'rows' (one row per path and year) or 'paths' (one row per path with yearly arrays)
+simulation_storage = os.getenv(key="SIMULATION_STORAGE") or 'rows'
@@ -1,11 +1,11 @@
 #The code here will pull in the connections to the API and leverage the ETL modules in the src directory.
 import pandas as pd
 from src.main import compile_ETL_data
-from config import db_credentials, ticker_list
+from config import api_keys, db_credentials, ticker_list, monte_carlo_workers, monte_carlo_seed, monte_carlo_cache_dir, return_stats_path, price_float_dtype, yfinance_cache_dir, yfinance_offline, yfinance_batch_size, yfinance_workers, data_source, recording_dir, load_mode, simulation_keep_runs, simulation_storage
 
 def main() -> None:
     """Main entry point for the ETL pipeline."""
-    etl_data = compile_ETL_data(db_credentials=db_credentials, tickers=ticker_list, time_period='max')
+    etl_data = compile_ETL_data(api_1=api_keys['finnhub'], db_credentials=db_credentials, source=data_source, tickers=ticker_list, time_period='max', n_workers=monte_carlo_workers, seed=monte_carlo_seed, cache_dir=monte_carlo_cache_dir, return_stats_path=return_stats_path, price_float_dtype=price_float_dtype, yfinance_cache_dir=yfinance_cache_dir, offline=yfinance_offline, yfinance_batch_size=yfinance_batch_size, yfinance_workers=yfinance_workers, recording_dir=recording_dir, load_mode=load_mode, keep_runs=simulation_keep_runs, simulation_storage=simulation_storage)
     if type(etl_data) is pd.DataFrame:
         print("ETL Data Compiled:", etl_data.head())
     print("ETL Data Compiled:", etl_data)
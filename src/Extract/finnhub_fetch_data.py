@@ -0,0 +1,185 @@
+"""
+Finnhub extractor.
+
+Requests for several symbols run on a small thread pool over one requests.Session, so the
+HTTPS connections are kept alive and reused instead of being opened per call. A token
+bucket shared by all threads keeps the client under the plan's rate limit (free tier: 60
+calls/minute), and throttled (429), server error (5xx) and connection failures are retried
+with exponential backoff.
+
+The candle frames have the columns transform_finnhub_data expects:
+symbol, datetime, open, high, low, close, volume
+"""
+
+import threading
+import time
+import pandas as pd
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+FINNHUB_BASE_URL = 'https://finnhub.io/api/v1'
+
+CANDLE_COLUMNS = ['symbol', 'datetime', 'open', 'high', 'low', 'close', 'volume']
+
+# status codes worth another try, everything else (401, 403, ...) fails right away
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket: `rate` tokens per second, at most `capacity` saved up.
+    https://en.wikipedia.org/wiki/Token_bucket
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Take one token, sleeping until there is one."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FinnhubClient:
+    """
+    Rate limited Finnhub REST client.
+
+    Args:
+        api_key: Finnhub API token
+        base_url: API root, point it at a local stub server for tests
+        calls_per_minute: Rate limit of the plan
+        burst: Calls that may go out back to back before the rate applies (1 never exceeds
+            calls_per_minute + 1 in any minute)
+        max_workers: Concurrent requests (also the size of the connection pool)
+        max_retries: Retries of a throttled or failed call before giving up
+        backoff: First retry delay in seconds, doubled on every further retry
+        timeout: Seconds to wait for a response
+    """
+
+    def __init__(self, api_key: str, base_url: str = FINNHUB_BASE_URL, calls_per_minute: int = 60, burst: int = 1, max_workers: int = 4, max_retries: int = 3, backoff: float = 1.0, timeout: float = 10):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.bucket = TokenBucket(calls_per_minute / 60, burst)
+        self.session = requests.Session()
+        # one keep-alive connection per worker thread
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> 'FinnhubClient':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _get(self, path: str, params: dict) -> dict:
+        """GET one endpoint and return its JSON, retrying throttled and failed calls."""
+        url = f'{self.base_url}/{path}'
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            delay = self.backoff * 2 ** attempt
+            try:
+                response = self.session.get(url, params={**params, 'token': self.api_key}, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    response.raise_for_status()
+                    return response.json()
+                # a throttled response says how long to wait
+                retry_after = response.headers.get('Retry-After')
+                if retry_after is not None and retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            time.sleep(delay)
+
+    def quote(self, symbol: str) -> dict:
+        """
+        Latest quote of one symbol: c = current price, d = change from prev close, dp = percent change
+        from prev close, h = high, l = low, o = open price, pc = previous close, plus symbol and datetime.
+        """
+        data = self._get('quote', {'symbol': symbol})
+        data['symbol'] = symbol
+        data['datetime'] = pd.to_datetime(data.pop('t', None), unit='s')
+        return data
+
+    def candles(self, symbol: str, start: pd.Timestamp, end: pd.Timestamp, resolution: str = 'D') -> pd.DataFrame:
+        """
+        Price candles of one symbol between start and end (empty frame if there are none or the
+        plan has no access to them).
+        """
+        try:
+            data = self._get('stock/candle', {
+                'symbol': symbol, 'resolution': resolution,
+                'from': int(pd.Timestamp(start).timestamp()), 'to': int(pd.Timestamp(end).timestamp())
+            })
+        except requests.HTTPError as error:
+            # the free tier answers candle requests with 403, a bad key (401) still fails the extract
+            if error.response is None or error.response.status_code != 403:
+                raise
+            print(f"Warning: the Finnhub plan has no access to candles, skipping {symbol}")
+            return pd.DataFrame(columns=CANDLE_COLUMNS)
+        if data.get('s') != 'ok':
+            if data.get('s') != 'no_data':
+                print(f"Warning: No historical data for {symbol} or API error")
+                print("Returned data:", data)
+            return pd.DataFrame(columns=CANDLE_COLUMNS)
+        return pd.DataFrame({
+            'symbol': symbol,
+            'datetime': pd.to_datetime(data['t'], unit='s'),
+            'open': data['o'],
+            'high': data['h'],
+            'low': data['l'],
+            'close': data['c'],
+            'volume': data['v']
+        })
+
+    def fetch_quotes(self, symbols: list[str]) -> pd.DataFrame:
+        """Quotes of every symbol, requested concurrently."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return pd.DataFrame(list(executor.map(self.quote, symbols)))
+
+    def fetch_candles(self, symbols: list[str], start: pd.Timestamp, end: pd.Timestamp, resolution: str = 'D') -> pd.DataFrame:
+        """Candles of every symbol, requested concurrently, as one frame for transform_finnhub_data."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            frames = list(executor.map(lambda symbol: self.candles(symbol, start, end, resolution), symbols))
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=CANDLE_COLUMNS)
+        return pd.concat(frames, ignore_index=True)
+
+
+def fetch_finnhub_data(tickers_list: list[str], api_key: str, start: pd.Timestamp, end: pd.Timestamp = None, base_url: str = FINNHUB_BASE_URL) -> pd.DataFrame:
+    """
+    Fetch daily candles from Finnhub for the given tickers.
+
+    Args:
+        tickers_list: List of stock ticker symbols.
+        api_key: Finnhub API token.
+        start: First day to fetch.
+        end: Last day to fetch, defaults to now.
+        base_url: API root (for a local stub server in tests).
+    """
+    end = pd.Timestamp.now() if end is None else end
+    with FinnhubClient(api_key, base_url=base_url) as client:
+        return client.fetch_candles(tickers_list, start, end)
@@ -1,26 +1,63 @@
 #here we will do the extraction
-from src.Extract.yfinance_fetch_data import fetch_yfinance_data
+import pandas as pd
+from src.Extract.yfinance_fetch_data import fetch_yfinance_data, YFinanceBatchDownloader
+from src.Extract.finnhub_fetch_data import fetch_finnhub_data
+from src.Extract.yfinance_cache import period_start
+from src.Extract.recording import DEFAULT_RECORDING_DIR, RECORDING_APIS, split_source, save_recording, load_recording
 
 
-def compile_extracted_data(api_key: str, tickers: list[str], time_period: str) -> dict:
+def compile_extracted_data(api_key: str, tickers: list[str], time_period: str, cache_dir: str = None, offline: bool = False, source: str = 'yfinance', batch_size: int = None, max_workers: int = 4, recording_dir: str = DEFAULT_RECORDING_DIR) -> dict:
     """
-    Extract stock data from Yahoo Finance.
+    Extract stock data from Yahoo Finance or Finnhub.
     
     Args:
-        api_key: Unused, kept for compatibility
+        api_key: Finnhub API key (unused for yfinance)
         tickers: List of stock ticker symbols
         time_period: Time period for data (e.g., '5d', '1mo', 'ytd')
+        cache_dir: Local yfinance cache directory, only missing days are downloaded (None = no cache)
+        offline: Serve everything from the cache without network access
+        source: 'yfinance' or 'finnhub', prefixed with 'record:' to save the raw response to
+            `recording_dir` or 'replay:' to serve a saved one without network access
+        batch_size: Download yfinance tickers in batches of this size on `max_workers` processes.
+            The batches are then returned lazily, as an iterator of wide frames under
+            'yfinance_batches', so each one can be transformed as soon as it arrives;
+            'yfinance_failed' is filled with the tickers that could not be downloaded.
+            Recordings always hold the whole frame, so record/replay ignore it.
+        max_workers: Batches downloaded in parallel
+        recording_dir: Directory of the recorded responses
     
     Returns:
-        Dictionary containing yfinance DataFrame
+        Dictionary containing the yfinance or finnhub DataFrame (or the yfinance batches)
     """
-    data = {
-        "yfinance_data": fetch_yfinance_data(tickers_list=tickers, time_period=time_period)
-    }
+    mode, api = split_source(source)
+    if api not in RECORDING_APIS:
+        raise ValueError(f"Unknown data source: {source}. Supported sources: {RECORDING_APIS}")
+
+    if mode == 'replay':
+        return {
+            f"{api}_data": load_recording(recording_dir, api, tickers, time_period)
+        }
+    if api == 'finnhub':
+        today = pd.Timestamp.now()
+        # 'max' has no start date on Finnhub, ask from the epoch
+        start = period_start(time_period, today.normalize()) or pd.Timestamp(0)
+        data = {
+            "finnhub_data": fetch_finnhub_data(tickers_list=tickers, api_key=api_key, start=start, end=today)
+        }
+    elif batch_size is not None and mode == 'live':
+        downloader = YFinanceBatchDownloader(batch_size=batch_size, max_workers=max_workers, cache_dir=cache_dir, offline=offline)
+        return {
+            "yfinance_batches": downloader.iter_batches(tickers, time_period),
+            "yfinance_failed": downloader.failed
+        }
+    else:
+        data = {
+            "yfinance_data": fetch_yfinance_data(tickers_list=tickers, time_period=time_period, cache_dir=cache_dir, offline=offline)
+        }
+    if mode == 'record':
+        save_recording(data[f"{api}_data"], recording_dir, api, tickers, time_period)
     return data
 
 
 if __name__ == "__main__":
     print("Extract module loaded successfully")
-
- 
\ No newline at end of file
@@ -0,0 +1,60 @@
+"""
+Record and replay of raw extract responses.
+
+`source='record:yfinance'` (or 'record:finnhub') extracts from the live API as usual and
+saves the raw frame to `recording_dir`; `source='replay:yfinance'` serves the saved frame
+without any network access, so pipeline runs and tests are fast and repeatable and work on
+machines without internet. A recording is identified by the API, the tickers and the time
+period it was made for.
+"""
+
+import hashlib
+import json
+import os
+import pandas as pd
+
+DEFAULT_RECORDING_DIR = '.recordings'
+
+RECORDING_MODES = ['live', 'record', 'replay']
+RECORDING_APIS = ['yfinance', 'finnhub']
+
+
+def split_source(source: str) -> tuple[str, str]:
+    """
+    Split a source into (mode, api): 'yfinance' -> ('live', 'yfinance'),
+    'replay:finnhub' -> ('replay', 'finnhub').
+    """
+    mode, _, api = source.lower().rpartition(':')
+    mode = mode or 'live'
+    if mode not in RECORDING_MODES:
+        raise ValueError(f"Unknown source mode: {mode}. Supported modes: {RECORDING_MODES}")
+    return mode, api
+
+
+def recording_path(recording_dir: str, api: str, tickers: list[str], time_period: str) -> str:
+    """File of the recording of one extract (tickers are order independent)."""
+    key = json.dumps({'api': api, 'tickers': sorted(tickers), 'time_period': time_period}, sort_keys=True)
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return os.path.join(recording_dir, f'{api}_{time_period}_{digest}.parquet')
+
+
+def save_recording(data: pd.DataFrame, recording_dir: str, api: str, tickers: list[str], time_period: str) -> str:
+    """Save a raw extract frame; returns its path."""
+    os.makedirs(recording_dir, exist_ok=True)
+    path = recording_path(recording_dir, api, tickers, time_period)
+    # temporary file first so a crash never leaves a half written recording
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    data.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_recording(recording_dir: str, api: str, tickers: list[str], time_period: str) -> pd.DataFrame:
+    """Read a recorded raw extract frame."""
+    path = recording_path(recording_dir, api, tickers, time_period)
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"No {api} recording for {sorted(tickers)} over '{time_period}' in {recording_dir}; "
+            f"run once with source='record:{api}' first"
+        )
+    return pd.read_parquet(path)
@@ -0,0 +1,265 @@
+"""
+On-disk cache of yfinance daily bars.
+
+Every ticker's bars are kept in one parquet file in `cache_dir`, and a JSON file next to
+it records which date ranges have been downloaded for it. Nothing is shared between
+tickers, so batches of different tickers can fill the cache in parallel processes. A request only downloads the parts of its
+date range that no earlier request covered (usually just the days since the last run) and
+returns the cached and new bars merged, in the same wide layout as yf.download.
+
+Close and Adj Close are adjusted retroactively by yfinance after every split (and Adj Close
+after every dividend), so bars cached before one are on another scale than bars downloaded
+after it. Every download therefore overlaps at least one settled cached bar, and a ticker
+whose overlapping bars changed is dropped from the cache and downloaded again as a whole.
+
+In offline mode nothing is downloaded, the cached bars are returned as they are, so
+benchmarks and tests see the same data on every run.
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+DEFAULT_CACHE_DIR = '.yfinance_cache'
+
+PRICE_FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+# fields yfinance rewrites for past bars after a split or dividend
+ADJUSTED_FIELDS = ['Close', 'Adj Close']
+
+ONE_DAY = pd.Timedelta(days=1)
+
+
+def period_start(time_period: str, today: pd.Timestamp) -> pd.Timestamp:
+    """
+    First day of a yfinance `period` ('5d', '1mo', '1y', 'ytd', 'max', ...) ending today.
+    None for 'max', i.e. from the first day the ticker traded.
+    """
+    if time_period == 'max':
+        return None
+    if time_period == 'ytd':
+        return pd.Timestamp(year=today.year, month=1, day=1)
+    for suffix, offset in [('mo', lambda n: pd.DateOffset(months=n)), ('d', lambda n: pd.DateOffset(days=n)), ('y', lambda n: pd.DateOffset(years=n))]:
+        if time_period.endswith(suffix) and time_period[:-len(suffix)].isdigit():
+            return today - offset(int(time_period[:-len(suffix)]))
+    raise ValueError(f"Unsupported time period: {time_period}")
+
+
+def missing_ranges(covered: list[list], start: pd.Timestamp, end: pd.Timestamp) -> list[tuple]:
+    """
+    Parts of [start, end] (inclusive days, start None = since the first trading day) that the
+    covered ranges do not contain.
+
+    Args:
+        covered: Sorted, non-overlapping [start, end] ranges, a None start means from the beginning
+        start: First requested day or None
+        end: Last requested day
+
+    Returns:
+        List of (start, end) gaps, start None for a gap before the first covered range
+    """
+    gaps = []
+    cursor = start
+    for range_start, range_end in covered:
+        range_start = None if range_start is None else pd.Timestamp(range_start)
+        range_end = pd.Timestamp(range_end)
+        if cursor is not None and range_end < cursor:
+            continue
+        if range_start is not None and range_start > end:
+            break
+        if range_start is not None and (cursor is None or range_start > cursor):
+            gaps.append((cursor, range_start - ONE_DAY))
+        cursor = range_end + ONE_DAY
+        if cursor > end:
+            return gaps
+    gaps.append((cursor, end))
+    return gaps
+
+
+def _add_range(covered: list[list], start: pd.Timestamp, end: pd.Timestamp) -> list[list]:
+    """Insert [start, end] into the covered ranges, merging ranges that overlap or touch."""
+    ranges = sorted(
+        [(None if s is None else pd.Timestamp(s), pd.Timestamp(e)) for s, e in covered] + [(start, end)],
+        key=lambda r: pd.Timestamp.min if r[0] is None else r[0]
+    )
+    merged = []
+    for range_start, range_end in ranges:
+        if merged and (range_start is None or range_start <= merged[-1][1] + ONE_DAY):
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return [[None if s is None else s.date().isoformat(), e.date().isoformat()] for s, e in merged]
+
+
+def overlap_gap(gap: tuple, settled: pd.DatetimeIndex) -> tuple:
+    """
+    Widen a missing (start, end) range to the nearest settled cached bar, so the download
+    can be checked against the cache: back to the last bar before it, or for a gap in
+    front of the cache forward to the first bar after it.
+    """
+    gap_start, gap_end = gap
+    if gap_start is not None and (settled <= gap_start).any():
+        return settled[settled <= gap_start].max().normalize(), gap_end
+    if (settled >= gap_end).any():
+        return gap_start, settled[settled >= gap_end].min().normalize()
+    return gap
+
+
+class YFinanceCache:
+    """
+    Parquet file of daily bars per ticker plus its downloaded date ranges in <ticker>.json.
+
+    Use fetch() in place of yf.download(tickers, period=...).
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, offline: bool = False):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, ticker: str) -> str:
+        return os.path.join(self.cache_dir, f'{ticker}.parquet')
+
+    def coverage(self, ticker: str) -> list[list]:
+        """Downloaded [start, end] ranges of one ticker (ISO dates, a None start means from the beginning)."""
+        try:
+            with open(os.path.join(self.cache_dir, f'{ticker}.json'), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def read(self, ticker: str) -> pd.DataFrame:
+        """Cached bars of one ticker (empty frame if there are none)."""
+        try:
+            return pd.read_parquet(self._path(ticker))
+        except (OSError, ValueError):
+            return pd.DataFrame(columns=PRICE_FIELDS, index=pd.DatetimeIndex([], name='Date'))
+
+    def settled_dates(self, ticker: str) -> pd.DatetimeIndex:
+        """Dates of the cached bars inside a covered range, i.e. without unfinished bars of the day they were fetched."""
+        dates = self.read(ticker).index
+        settled = np.zeros(len(dates), dtype=bool)
+        for range_start, range_end in self.coverage(ticker):
+            settled |= (dates <= pd.Timestamp(range_end)) & (range_start is None or dates >= pd.Timestamp(range_start))
+        return dates[settled]
+
+    def matches(self, ticker: str, bars: pd.DataFrame) -> bool:
+        """Whether downloaded bars agree with the settled cached bars on the days they share."""
+        settled = self.settled_dates(ticker)
+        overlap = settled.intersection(bars.index)
+        if overlap.empty:
+            return True
+        cached = self.read(ticker).loc[overlap, ADJUSTED_FIELDS].to_numpy(dtype=float)
+        return np.allclose(cached, bars.loc[overlap, ADJUSTED_FIELDS].to_numpy(dtype=float), rtol=1e-6, equal_nan=True)
+
+    def clear(self, ticker: str) -> None:
+        """Drop the cached bars and covered ranges of one ticker."""
+        for path in [self._path(ticker), os.path.join(self.cache_dir, f'{ticker}.json')]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def write(self, ticker: str, bars: pd.DataFrame, start: pd.Timestamp, end: pd.Timestamp) -> None:
+        """
+        Merge downloaded bars into the ticker's file (new bars win) and mark [start, end] as
+        covered (nothing is marked if `end` is None).
+        """
+        cached = self.read(ticker)
+        merged = pd.concat([cached, bars[PRICE_FIELDS]]) if not cached.empty else bars[PRICE_FIELDS]
+        merged = merged[~merged.index.duplicated(keep='last')].sort_index()
+        # temporary file first so a crash never leaves a half written entry
+        tmp_path = f'{self._path(ticker)}.{os.getpid()}.tmp'
+        merged.to_parquet(tmp_path)
+        os.replace(tmp_path, self._path(ticker))
+        if end is not None:
+            # the bars are written first, a crash in between only means the range is downloaded again
+            coverage_path = os.path.join(self.cache_dir, f'{ticker}.json')
+            with open(f'{coverage_path}.{os.getpid()}.tmp', 'w') as f:
+                json.dump(_add_range(self.coverage(ticker), start, end), f)
+            os.replace(f'{coverage_path}.{os.getpid()}.tmp', coverage_path)
+
+    def _download(self, tickers: list[str], start: pd.Timestamp, end: pd.Timestamp) -> dict[str, pd.DataFrame]:
+        """Download [start, end] for tickers that share the same gap, one frame per ticker."""
+        if start is None:
+            data = yf.download(tickers, period='max', auto_adjust=False, group_by='ticker', progress=False)
+        else:
+            # yfinance's end date is exclusive
+            data = yf.download(tickers, start=start.date().isoformat(), end=(end + ONE_DAY).date().isoformat(),
+                               auto_adjust=False, group_by='ticker', progress=False)
+        if data is None or data.empty:
+            return {}
+        if not isinstance(data.columns, pd.MultiIndex):
+            data = pd.concat({tickers[0]: data}, axis=1)
+        if data.index.tz is not None:
+            data.index = data.index.tz_localize(None)
+        data = data[data.index.normalize() <= end]
+        frames = {}
+        for ticker in tickers:
+            if ticker in data.columns.get_level_values(0):
+                bars = data[ticker].dropna(how='all')
+                if not bars.empty and all(field in bars.columns for field in PRICE_FIELDS):
+                    frames[ticker] = bars
+        return frames
+
+    def _store(self, ticker: str, bars: pd.DataFrame, gap_start: pd.Timestamp, today: pd.Timestamp) -> None:
+        covered_end = min(bars.index.max().normalize(), today - ONE_DAY)
+        self.write(ticker, bars, gap_start, covered_end if gap_start is None or covered_end >= gap_start else None)
+
+    def fetch(self, tickers: list[str], time_period: str, today: pd.Timestamp = None) -> pd.DataFrame:
+        """
+        Bars of `tickers` over `time_period`, downloading only the uncovered parts of the range.
+
+        A range counts as covered up to the last bar the download returned, and never past
+        yesterday, so today's unfinished bar and days a ticker did not trade are asked for
+        again on the next run instead of being recorded as empty. Downloads overlap the
+        cache by a bar; if a split or dividend changed the overlapping bars, the ticker's
+        cache is dropped and its whole range downloaded again.
+
+        Args:
+            tickers: Ticker symbols
+            time_period: yfinance period ('5d', '1mo', 'ytd', 'max', ...)
+            today: Reference day, defaults to the current date
+
+        Returns:
+            Wide frame with (ticker, price field) MultiIndex columns and a Date index, like yf.download
+        """
+        today = pd.Timestamp.today().normalize() if today is None else pd.Timestamp(today).normalize()
+        start = period_start(time_period, today)
+
+        if not self.offline:
+            # tickers with the same gaps are downloaded together, usually everyone needs the same few days
+            gap_tickers = {}
+            for ticker in tickers:
+                settled = self.settled_dates(ticker)
+                for gap in missing_ranges(self.coverage(ticker), start, today):
+                    gap_tickers.setdefault(overlap_gap(gap, settled), []).append(ticker)
+            adjusted = []
+            for (gap_start, gap_end), gap_group in gap_tickers.items():
+                for ticker, bars in self._download(gap_group, gap_start, gap_end).items():
+                    if ticker in adjusted:
+                        continue
+                    if not self.matches(ticker, bars):
+                        print(f"Warning: cached {ticker} bars were adjusted since (split or dividend), downloading them again")
+                        self.clear(ticker)
+                        adjusted.append(ticker)
+                        continue
+                    self._store(ticker, bars, gap_start, today)
+            if adjusted:
+                for ticker, bars in self._download(adjusted, start, today).items():
+                    self._store(ticker, bars, start, today)
+
+        frames = {}
+        for ticker in tickers:
+            bars = self.read(ticker)
+            if start is not None:
+                bars = bars[bars.index >= start]
+            if bars.empty:
+                print(f"Warning: no {'cached ' if self.offline else ''}data for {ticker}, skipping")
+                continue
+            frames[ticker] = bars[PRICE_FIELDS]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, axis=1).sort_index()
@@ -1,14 +1,178 @@
+import math
+import time
+import pandas as pd
 import yfinance as yf
+from concurrent.futures import ProcessPoolExecutor, TimeoutError, as_completed
+from typing import Iterator
+from src.Extract.yfinance_cache import YFinanceCache
 
 
-def fetch_yfinance_data(tickers_list: list[str], time_period: str) -> dict:
+def _split_batch(data: pd.DataFrame, tickers: list[str]) -> tuple[pd.DataFrame, list[str]]:
+    """
+    Separate the tickers of a downloaded batch that came back with prices from the ones that did not.
+
+    Returns:
+        (wide frame of the tickers with data in (ticker, price field) columns, tickers without data)
+    """
+    if data is None or data.empty:
+        return pd.DataFrame(), list(tickers)
+    if not isinstance(data.columns, pd.MultiIndex):
+        data = pd.concat({tickers[0]: data}, axis=1)
+    level0 = set(data.columns.get_level_values(0))
+    good = [ticker for ticker in tickers if ticker in level0 and data[ticker]['Close'].notna().any()]
+    missing = [ticker for ticker in tickers if ticker not in good]
+    if not good:
+        return pd.DataFrame(), missing
+    return data[good].dropna(how='all'), missing
+
+
+def _fetch_batch(tickers: list[str], time_period: str, timeout: float, max_retries: int, backoff: float, cache_dir: str = None, offline: bool = False) -> tuple[pd.DataFrame, dict[str, str]]:
+    """
+    Download one batch of tickers, retrying the ones that failed (module level so worker
+    processes can run it).
+
+    `timeout` is the batch's time budget: it bounds every HTTP request and no retry is
+    started after it has run out.
+
+    Returns:
+        (wide frame of the tickers that succeeded, {failed ticker: reason})
+    """
+    started = time.monotonic()
+    frames = []
+    pending = list(tickers)
+    failed = {}
+    for attempt in range(max_retries + 1):
+        try:
+            if cache_dir is not None or offline:
+                data = YFinanceCache(cache_dir or '.yfinance_cache', offline=offline).fetch(pending, time_period)
+            else:
+                # threads=False: the worker pool already bounds the concurrency
+                data = yf.download(pending, period=time_period, auto_adjust=False, group_by='ticker',
+                                   threads=False, progress=False, timeout=timeout)
+        except Exception as e:  # yfinance raises anything from JSON to HTTP errors for a bad symbol
+            failed = {ticker: f'{type(e).__name__}: {e}' for ticker in pending}
+        else:
+            good, missing = _split_batch(data, pending)
+            if not good.empty:
+                frames.append(good)
+            failed = {ticker: 'no data returned' for ticker in missing}
+        pending = list(failed)
+        if not pending or offline:
+            break
+        if time.monotonic() - started + backoff * 2 ** attempt > timeout:
+            failed = {ticker: f'{reason} (batch timed out)' for ticker, reason in failed.items()}
+            break
+        if attempt < max_retries:
+            time.sleep(backoff * 2 ** attempt)
+    return (pd.concat(frames, axis=1) if frames else pd.DataFrame()), failed
+
+
+class YFinanceBatchDownloader:
+    """
+    Download a large ticker list in batches on a bounded process pool.
+
+    A slow or failing symbol only affects its own batch: failed tickers are retried with
+    backoff, then recorded in `failed` (ticker -> reason) instead of failing the run.
+    Batches are yielded as soon as they finish, so the transform can start on the first
+    batch while the others are still downloading.
+
+    yf.download keeps module level state and is not safe to call from several threads at
+    once, so the batches run in processes (one yfinance per process). A batch's `timeout`
+    is only checked between its retries, so the pool also has a hard deadline: batches
+    that haven't returned by then (e.g. a download that hangs) are recorded as failed and
+    their worker processes are stopped.
+
+    Args:
+        batch_size: Tickers per yf.download call
+        max_workers: Batches downloaded at the same time (1 downloads them one after another in this process)
+        timeout: Time budget of one batch in seconds, also the timeout of every request. With worker
+            processes, every wave of `max_workers` batches gets this budget plus one more as a hard deadline
+        max_retries: Retries of the failed tickers of a batch
+        backoff: First retry delay in seconds, doubled on every further retry
+        cache_dir: Local yfinance cache (see yfinance_cache.py), None downloads the whole period
+        offline: Only read the cache
+    """
+
+    def __init__(self, batch_size: int = 50, max_workers: int = 4, timeout: float = 60, max_retries: int = 2, backoff: float = 1.0, cache_dir: str = None, offline: bool = False):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.batch_args = dict(timeout=timeout, max_retries=max_retries, backoff=backoff, cache_dir=cache_dir, offline=offline)
+        self.failed = {}
+
+    def iter_batches(self, tickers: list[str], time_period: str) -> Iterator[pd.DataFrame]:
+        """
+        Yield one wide (ticker, price field) frame per batch, in the order the batches finish.
+        Tickers that failed are collected in `self.failed` and reported once at the end.
+        """
+        # sorted so every batch covers an alphabetical range of tickers
+        tickers = sorted(dict.fromkeys(tickers))
+        batches = [tickers[i:i + self.batch_size] for i in range(0, len(tickers), self.batch_size)]
+        self.failed.clear()
+
+        if self.max_workers <= 1 or len(batches) <= 1:
+            results = (_fetch_batch(batch, time_period, **self.batch_args) for batch in batches)
+            yield from self._collect(results)
+        else:
+            yield from self._collect(self._run_pool(batches, time_period))
+
+        if self.failed:
+            print(f"Warning: {len(self.failed)} of {len(tickers)} tickers could not be downloaded:")
+            for ticker, reason in self.failed.items():
+                print(f"  {ticker}: {reason}")
+
+    def _run_pool(self, batches: list[list[str]], time_period: str) -> Iterator[tuple[pd.DataFrame, dict]]:
+        """Batch results from the worker processes as they finish, until every batch is in or the deadline passes."""
+        workers = min(self.max_workers, len(batches))
+        deadline = self.timeout * (math.ceil(len(batches) / workers) + 1)
+        executor = ProcessPoolExecutor(max_workers=workers)
+        futures = {executor.submit(_fetch_batch, batch, time_period, **self.batch_args): batch for batch in batches}
+        try:
+            for future in as_completed(futures, timeout=deadline):
+                yield future.result()
+        except TimeoutError:
+            stuck = [batch for future, batch in futures.items() if not future.done()]
+            yield pd.DataFrame(), {ticker: f'batch did not finish within {deadline:g}s' for batch in stuck for ticker in batch}
+            # a hung download never returns, so its process is stopped instead of waited for
+            # (the executor has no public way to stop busy workers before Python 3.14's terminate_workers)
+            processes = list((executor._processes or {}).values())
+            executor.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                process.terminate()
+        else:
+            executor.shutdown()
+
+    def _collect(self, results: Iterator[tuple[pd.DataFrame, dict]]) -> Iterator[pd.DataFrame]:
+        for data, failed in results:
+            self.failed.update(failed)
+            if not data.empty:
+                yield data
+
+
+def fetch_yfinance_data(tickers_list: list[str], time_period: str, cache_dir: str = None, offline: bool = False, batch_size: int = None, max_workers: int = 4) -> dict:
     """
     Fetch historical stock data from Yahoo Finance for the given tickers.
-    
+
     Args:
         tickers: List of stock ticker symbols.
         time_period: Time period for which to fetch data (e.g., '5d', '1mo', 'ytd') default is 'ytd'.
+        cache_dir: Directory of the local parquet cache; only the days it does not hold yet are
+            downloaded. None downloads the whole period every time.
+        offline: Only read the cache, never touch the network (needs cache_dir)
+        batch_size: Download in batches of this many tickers on `max_workers` processes, failed
+            tickers are skipped with a warning (None = one call for every ticker)
+        max_workers: Batches downloaded in parallel
     """
+    if batch_size is not None:
+        downloader = YFinanceBatchDownloader(batch_size=batch_size, max_workers=max_workers, cache_dir=cache_dir, offline=offline)
+        frames = list(downloader.iter_batches(tickers_list, time_period))
+        return pd.concat(frames, axis=1) if frames else pd.DataFrame()
+
+    if cache_dir is not None or offline:
+        return YFinanceCache(cache_dir or '.yfinance_cache', offline=offline).fetch(tickers_list, time_period)
+
     data = yf.download(tickers_list, period=time_period, auto_adjust=False)
 
-    return data
\ No newline at end of file
+    return data
@@ -12,9 +12,69 @@ This module handles:
 import pandas as pd
 import numpy as np
 from typing import Dict, List, Optional, Union
+from src.Transform.schema import STOCK_DATA_COLUMNS, empty_stock_data, enforce_stock_data_schema
 
 
-def transform_yfinance_data(data: pd.DataFrame) -> pd.DataFrame:
+def _stack_yfinance_columns(data: pd.DataFrame, tickers: list) -> pd.DataFrame:
+    """
+    Reshape a wide yfinance frame (MultiIndex columns of ticker and price field, in either
+    level order) into long rows: ticker, date, open, high, low, close, adj_close, volume.
+
+    The ticker level is found once, then each price field is gathered for all tickers as a
+    single (dates x tickers) block and flattened column by column, so rows come out grouped
+    by ticker in the same order as the old one-ticker-at-a-time loop. Tickers that can't be
+    found or lack a required column are skipped with a warning, like before.
+    """
+    level0_values = data.columns.get_level_values(0)
+    level1_values = data.columns.get_level_values(1)
+    # the level the tickers live on; the old loop looked in level 0 first
+    ticker_level = 0 if any(ticker in level0_values for ticker in tickers) else 1
+    ticker_values, field_values = (level0_values, level1_values) if ticker_level == 0 else (level1_values, level0_values)
+
+    # column position of every (ticker, lowercase field) pair
+    positions = {}
+    for position, (ticker, field) in enumerate(zip(ticker_values, field_values)):
+        positions.setdefault(ticker, {}).setdefault(str(field).lower(), position)
+
+    # Handle date column - yfinance uses 'Date' as the index name
+    if str(data.index.name).lower() == 'date' or pd.api.types.is_datetime64_any_dtype(data.index):
+        dates = data.index
+    else:
+        dates = pd.RangeIndex(len(data))
+
+    required_cols = ['open', 'high', 'low', 'close', 'volume']
+    kept_tickers, field_positions = [], {col: [] for col in required_cols + ['adj_close']}
+    for ticker in tickers:
+        ticker_fields = positions.get(ticker)
+        if ticker_fields is None:
+            print(f"Warning: Error processing ticker {ticker}: Could not extract data for ticker {ticker}")
+            continue
+        missing_cols = [col for col in required_cols if col not in ticker_fields]
+        if missing_cols:
+            print(f"Warning: Error processing ticker {ticker}: Missing required columns {missing_cols} for ticker {ticker}. Available columns: {['date'] + list(ticker_fields)}")
+            continue
+        for col in required_cols:
+            field_positions[col].append(ticker_fields[col])
+        # Handle adj_close, use close as fallback (common when auto_adjust=True)
+        adj_close_name = next((name for name in ['adj_close', 'adj close', 'adjclose'] if name in ticker_fields), 'close')
+        field_positions['adj_close'].append(ticker_fields[adj_close_name])
+        kept_tickers.append(ticker)
+
+    if not kept_tickers:
+        return empty_stock_data()
+
+    n_dates = len(data)
+    long_data = {
+        'ticker': np.repeat(np.asarray(kept_tickers, dtype=object), n_dates),
+        'date': dates.take(np.tile(np.arange(n_dates), len(kept_tickers))),
+    }
+    for col in ['open', 'high', 'low', 'close', 'adj_close', 'volume']:
+        # Fortran order flattens the block one ticker column after another
+        long_data[col] = data.iloc[:, field_positions[col]].to_numpy().ravel(order='F')
+    return pd.DataFrame(long_data)
+
+
+def transform_yfinance_data(data: pd.DataFrame, float_dtype: str = None) -> pd.DataFrame:
     """
     Transform Yahoo Finance data to match our data model.
     
@@ -25,12 +85,14 @@ def transform_yfinance_data(data: pd.DataFrame) -> pd.DataFrame:
     
     Args:
         data: MultiIndex DataFrame from yfinance.download()
+        float_dtype: Float type of the price columns, 'float64' (default) or 'float32'
         
     Returns:
         DataFrame with columns: ticker, date, open, high, low, close, adj_close, volume
+        (canonical dtypes, see src/Transform/schema.py)
     """
     if data.empty:
-        return pd.DataFrame(columns=['ticker', 'date', 'open', 'high', 'low', 'close', 'adj_close', 'volume'])
+        return empty_stock_data(float_dtype)
     
     transformed_rows = []
     
@@ -81,97 +143,8 @@ def transform_yfinance_data(data: pd.DataFrame) -> pd.DataFrame:
             else:
                 tickers = ['UNKNOWN']
         
-        # Check if Adj Close exists
-        all_level1 = data.columns.get_level_values(1).unique()
-        has_adj_close = any('Adj' in str(val) or 'adj' in str(val).lower() for val in all_level1)
-        
-        for ticker in tickers:
-            try:
-                # Access ticker data - try both level 0 and level 1
-                ticker_data = None
-                if ticker in data.columns.get_level_values(0):
-                    ticker_data = data[ticker].copy()
-                elif ticker in data.columns.get_level_values(1):
-                    # Ticker might be in level 1, need to transpose or filter differently
-                    # Filter columns where level 1 matches ticker
-                    mask = data.columns.get_level_values(1) == ticker
-                    ticker_data = data.loc[:, mask].copy()
-                    # The columns will still have MultiIndex, need to flatten
-                    if isinstance(ticker_data.columns, pd.MultiIndex):
-                        # Flatten by taking level 0 (price types)
-                        ticker_data.columns = ticker_data.columns.get_level_values(0)
-                else:
-                    # Ticker not found in either level - might be single ticker case
-                    # Use all columns and extract ticker from structure
-                    ticker_data = data.copy()
-                    if isinstance(data.columns[0], tuple):
-                        # Extract ticker from first column tuple
-                        first_col = data.columns[0]
-                        if len(first_col) >= 1:
-                            # Try to find which element is the ticker
-                            for elem in first_col:
-                                if str(elem) not in price_keywords:
-                                    ticker = elem
-                                    break
-                
-                if ticker_data is None:
-                    raise ValueError(f"Could not extract data for ticker {ticker}")
-                
-                # Reset index to get date as a column
-                ticker_data = ticker_data.reset_index()
-                
-                # Standardize column names to lowercase
-                ticker_data.columns = ticker_data.columns.str.lower()
-                
-                # Handle date column - yfinance uses 'Date' as index name
-                if 'date' not in ticker_data.columns:
-                    # Check if index was reset and first column is date
-                    if len(ticker_data.columns) > 0:
-                        first_col = ticker_data.columns[0]
-                        if pd.api.types.is_datetime64_any_dtype(ticker_data[first_col]):
-                            ticker_data.rename(columns={first_col: 'date'}, inplace=True)
-                        else:
-                            # Date might be in index name
-                            ticker_data.insert(0, 'date', ticker_data.index if hasattr(ticker_data, 'index') else pd.date_range('2024-01-01', periods=len(ticker_data)))
-                
-                # Ensure date column exists
-                if 'date' not in ticker_data.columns:
-                    ticker_data.insert(0, 'date', ticker_data.index)
-                
-                # Map common column name variations
-                column_mapping = {
-                    'adj close': 'adj_close',
-                    'adjclose': 'adj_close',
-                }
-                for old_name, new_name in column_mapping.items():
-                    if old_name in ticker_data.columns and new_name not in ticker_data.columns:
-                        ticker_data[new_name] = ticker_data[old_name]
-                
-                # Ensure we have all required columns
-                required_cols = ['open', 'high', 'low', 'close', 'volume']
-                missing_cols = [col for col in required_cols if col not in ticker_data.columns]
-                if missing_cols:
-                    raise ValueError(f"Missing required columns {missing_cols} for ticker {ticker}. Available columns: {list(ticker_data.columns)}")
-                
-                # Handle adj_close
-                if 'adj_close' not in ticker_data.columns:
-                    if 'adj close' in ticker_data.columns:
-                        ticker_data['adj_close'] = ticker_data['adj close']
-                    else:
-                        # Use close as fallback (common when auto_adjust=True)
-                        ticker_data['adj_close'] = ticker_data['close']
-                
-                # Add ticker column
-                ticker_data['ticker'] = ticker
-                
-                # Select and reorder columns to match data model
-                ticker_data = ticker_data[['ticker', 'date', 'open', 'high', 'low', 'close', 'adj_close', 'volume']]
-                
-                transformed_rows.append(ticker_data)
-            except Exception as e:
-                # Skip this ticker if there's an error, but log it
-                print(f"Warning: Error processing ticker {ticker}: {e}")
-                continue
+        # Read every price field as one (dates x tickers) block instead of copying each ticker out
+        transformed_rows.append(_stack_yfinance_columns(data, tickers))
     else:
         # Flat columns case - single ticker with non-MultiIndex columns
         data_reset = data.reset_index()
@@ -206,12 +179,12 @@ def transform_yfinance_data(data: pd.DataFrame) -> pd.DataFrame:
     result_df = pd.concat(transformed_rows, ignore_index=True)
     
     # Clean and validate data
-    result_df = clean_stock_data(result_df)
+    result_df = clean_stock_data(result_df, float_dtype)
     
     return result_df
 
 
-def transform_finnhub_data(data: pd.DataFrame) -> pd.DataFrame:
+def transform_finnhub_data(data: pd.DataFrame, float_dtype: str = None) -> pd.DataFrame:
     """
     Transform Finnhub API data to match our data model.
     
@@ -220,12 +193,14 @@ def transform_finnhub_data(data: pd.DataFrame) -> pd.DataFrame:
     
     Args:
         data: DataFrame from Finnhub API
+        float_dtype: Float type of the price columns, 'float64' (default) or 'float32'
         
     Returns:
         DataFrame with columns: ticker, date, open, high, low, close, adj_close, volume
+        (canonical dtypes, see src/Transform/schema.py)
     """
     if data.empty:
-        return pd.DataFrame(columns=['ticker', 'date', 'open', 'high', 'low', 'close', 'adj_close', 'volume'])
+        return empty_stock_data(float_dtype)
     
     df = data.copy()
     
@@ -249,21 +224,20 @@ def transform_finnhub_data(data: pd.DataFrame) -> pd.DataFrame:
         df['adj_close'] = df['close']
     
     # Ensure all required columns exist
-    required_cols = ['ticker', 'date', 'open', 'high', 'low', 'close', 'adj_close', 'volume']
-    missing_cols = [col for col in required_cols if col not in df.columns]
+    missing_cols = [col for col in STOCK_DATA_COLUMNS if col not in df.columns]
     if missing_cols:
         raise ValueError(f"Missing required columns: {missing_cols}")
     
     # Select and reorder columns
-    df = df[required_cols]
+    df = df[STOCK_DATA_COLUMNS]
     
     # Clean and validate data
-    df = clean_stock_data(df)
+    df = clean_stock_data(df, float_dtype)
     
     return df
 
 
-def clean_stock_data(df: pd.DataFrame) -> pd.DataFrame:
+def clean_stock_data(df: pd.DataFrame, float_dtype: str = None) -> pd.DataFrame:
     """
     Clean and validate stock data.
     
@@ -274,66 +248,167 @@ def clean_stock_data(df: pd.DataFrame) -> pd.DataFrame:
     - Remove duplicates
     - Sort by ticker and date
     
+    All validation rules are evaluated into one boolean mask, deduplication and sorting
+    share one stable ordering of the (ticker, date) keys, and the frame is gathered once at
+    the end. The result has the canonical stock_data dtypes (categorical ticker,
+    datetime64[s] date without time of day, `float_dtype` prices, int64 volume, see
+    src/Transform/schema.py). The number of rows each rule
+    removed is stored in `result.attrs['rejected_rows']`; a row is counted under the first
+    rule it fails, in the order missing_price, non_positive_price, inconsistent_ohlc,
+    negative_volume, duplicate.
+    
     Args:
         df: DataFrame with stock data
+        float_dtype: Float type of the price columns, 'float64' (default) or 'float32'
         
     Returns:
         Cleaned DataFrame
     """
     if df.empty:
-        return df
-    
-    df = df.copy()
-    
-    # Convert date to datetime if it's not already
-    if 'date' in df.columns:
-        df['date'] = pd.to_datetime(df['date'])
-        # Extract just the date part (remove time if present)
-        df['date'] = df['date'].dt.date
-    
-    # Ensure ticker is string
-    if 'ticker' in df.columns:
-        df['ticker'] = df['ticker'].astype(str).str.upper()
+        return enforce_stock_data_schema(df.copy(), float_dtype)
     
     # Remove rows where critical price data is missing
     price_cols = ['open', 'high', 'low', 'close', 'adj_close']
-    df = df.dropna(subset=price_cols)
+    missing = df[price_cols].isna().any(axis=1).to_numpy()
     
     # Validate prices are positive
-    for col in price_cols:
-        df = df[df[col] > 0]
+    positive = np.logical_and.reduce([(df[col] > 0).to_numpy(dtype=bool, na_value=False) for col in price_cols])
     
     # Validate high >= low, high >= open, high >= close, low <= open, low <= close
-    df = df[
+    consistent = (
         (df['high'] >= df['low']) &
         (df['high'] >= df['open']) &
         (df['high'] >= df['close']) &
         (df['low'] <= df['open']) &
         (df['low'] <= df['close'])
-    ]
+    ).to_numpy(dtype=bool, na_value=False)
     
-    # Ensure volume is non-negative integer
+    # Ensure volume is non-negative (missing volume counts as 0)
     if 'volume' in df.columns:
-        df['volume'] = df['volume'].fillna(0)
-        df['volume'] = df['volume'].astype(int)
-        df = df[df['volume'] >= 0]
-    
-    # Remove duplicates (same ticker and date)
-    df = df.drop_duplicates(subset=['ticker', 'date'], keep='first')
-    
-    # Sort by ticker and date
-    df = df.sort_values(['ticker', 'date']).reset_index(drop=True)
+        volume_ok = (df['volume'].fillna(0) >= 0).to_numpy(dtype=bool, na_value=False)
+    else:
+        volume_ok = np.ones(len(df), dtype=bool)
+    
+    valid = ~missing & positive & consistent & volume_ok
+    rejected = {
+        'missing_price': int(missing.sum()),
+        'non_positive_price': int((~missing & ~positive).sum()),
+        'inconsistent_ohlc': int((~missing & positive & ~consistent).sum()),
+        'negative_volume': int((~missing & positive & consistent & ~volume_ok).sum()),
+    }
     
-    return df
+    if not valid.any():
+        rejected['duplicate'] = 0
+        result = enforce_stock_data_schema(df.iloc[0:0].reset_index(drop=True), float_dtype)
+        result.attrs['rejected_rows'] = rejected
+        return result
+    
+    # Only the sort keys of the valid rows are converted: upper case tickers, dates without time.
+    # Tickers are upper-cased once per distinct value and sorted as integer ranks.
+    valid_rows = np.flatnonzero(valid)
+    ticker_codes, ticker_values = pd.factorize(df['ticker'].iloc[valid_rows], use_na_sentinel=False)
+    ticker_names, ticker_rank = np.unique(pd.Index(ticker_values).astype(str).str.upper().to_numpy(dtype=object), return_inverse=True)
+    ticker_rank = ticker_rank[ticker_codes].astype(np.int64)
+    dates = pd.to_datetime(df['date'].iloc[valid_rows])
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    dates = dates.dt.normalize().to_numpy()
+    
+    # Day number of every row; missing dates sort last, like before
+    days = dates.astype('datetime64[D]').view(np.int64).copy()
+    no_date = np.isnat(dates)
+    if no_date.all():
+        days[:] = 0
+    else:
+        days -= days[~no_date].min()
+        days[no_date] = days[~no_date].max() + 1
+    
+    # One stable sort by ticker and date on a single integer key, so input that is already
+    # in order sorts in linear time. Duplicates are then neighbours and the first one in the
+    # original order is kept.
+    sort_key = ticker_rank * (days.max() + 1) + days
+    order = np.argsort(sort_key, kind='stable')
+    sort_key = sort_key[order]
+    duplicate = np.zeros(len(order), dtype=bool)
+    duplicate[1:] = sort_key[1:] == sort_key[:-1]
+    rejected['duplicate'] = int(duplicate.sum())
+    kept = order[~duplicate]
+    
+    # The only copy of the full frame
+    result = df.take(valid_rows[kept]).reset_index(drop=True)
+    # np.unique gave the names sorted, so the ranks are the codes of an alphabetical categorical
+    result['ticker'] = pd.Categorical.from_codes(ticker_rank[kept], categories=ticker_names)
+    result['date'] = dates[kept]
+    if 'volume' in result.columns:
+        result['volume'] = result['volume'].fillna(0)
+    result = enforce_stock_data_schema(result, float_dtype)
+    result.attrs['rejected_rows'] = rejected
+    
+    return result
+
+
+def _trim_extracted_rows(data: pd.DataFrame, since: pd.Timestamp) -> pd.DataFrame:
+    """Drop raw rows dated on or before `since` (yfinance: date index, finnhub: date column)."""
+    if isinstance(data.index, pd.DatetimeIndex):
+        dates = data.index
+    else:
+        date_col = next((col for col in ['date', 'datetime', 'Date'] if col in data.columns), None)
+        if date_col is None:
+            return data
+        dates = pd.DatetimeIndex(pd.to_datetime(data[date_col]))
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    return data[dates.normalize() > pd.Timestamp(since)]
+
+
+def filter_new_rows(df: pd.DataFrame, watermarks: Dict[str, pd.Timestamp]) -> pd.DataFrame:
+    """
+    Keep only the stock_data rows dated after their ticker's high-water mark.
+
+    Args:
+        df: Transformed stock_data frame
+        watermarks: Latest date already stored per ticker; tickers without one keep every row
+
+    Returns:
+        The rows that are not loaded yet
+    """
+    if df.empty or not watermarks:
+        return df
+    tickers = df['ticker'].astype('category') if not isinstance(df['ticker'].dtype, pd.CategoricalDtype) else df['ticker']
+    # one mark per category, then spread to the rows through the category codes
+    marks = pd.to_datetime(pd.Series(watermarks, dtype=object)).reindex(tickers.cat.categories)
+    row_marks = marks.to_numpy(dtype='datetime64[s]')[tickers.cat.codes.to_numpy()]
+    dates = df['date'].to_numpy(dtype='datetime64[s]')
+    return df[np.isnat(row_marks) | (dates > row_marks)].reset_index(drop=True)
 
 
-def transform_extracted_data(extracted_data: Union[Dict, pd.DataFrame], source: str = 'yfinance') -> pd.DataFrame:
+def concat_stock_data(frames: List[pd.DataFrame], float_dtype: str = None) -> pd.DataFrame:
+    """
+    Combine transformed stock_data frames of disjoint tickers (e.g. download batches) into
+    one frame sorted by ticker and date, with the canonical dtypes.
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return empty_stock_data(float_dtype)
+    # every frame has its own ticker categories, concat falls back to strings and the schema
+    # turns them into one categorical again
+    result = enforce_stock_data_schema(pd.concat(frames, ignore_index=True), float_dtype)
+    codes = result['ticker'].cat.codes.to_numpy()
+    if (np.diff(codes) < 0).any():
+        # each frame is sorted already, a stable sort by ticker keeps the dates in order
+        result = result.take(np.argsort(codes, kind='stable')).reset_index(drop=True)
+    return result
+
+
+def transform_extracted_data(extracted_data: Union[Dict, pd.DataFrame], source: str = 'yfinance', float_dtype: str = None, since: pd.Timestamp = None) -> pd.DataFrame:
     """
     Main transformation function that routes to appropriate transformer based on source.
     
     Args:
         extracted_data: Raw data from Extract module (dict or DataFrame)
         source: Data source identifier ('yfinance', 'finnhub', etc.)
+        float_dtype: Float type of the price columns, 'float64' (default) or 'float32'
+        since: Only transform rows dated after this day (incremental runs), None for everything
         
     Returns:
         Transformed and cleaned DataFrame ready for database insertion
@@ -343,7 +418,7 @@ def transform_extracted_data(extracted_data: Union[Dict, pd.DataFrame], source:
         # This handles the current placeholder structure
         if 'api_1_data' in extracted_data or 'api_2_data' in extracted_data:
             # Placeholder data - return empty DataFrame with correct structure
-            return pd.DataFrame(columns=['ticker', 'date', 'open', 'high', 'low', 'close', 'adj_close', 'volume'])
+            return empty_stock_data(float_dtype)
         else:
             # Try to find DataFrame in dict
             for key, value in extracted_data.items():
@@ -356,11 +431,14 @@ def transform_extracted_data(extracted_data: Union[Dict, pd.DataFrame], source:
     if not isinstance(extracted_data, pd.DataFrame):
         raise TypeError(f"extracted_data must be DataFrame or dict containing DataFrame, got {type(extracted_data)}")
     
+    if since is not None:
+        extracted_data = _trim_extracted_rows(extracted_data, since)
+    
     # Route to appropriate transformer
     if source.lower() == 'yfinance':
-        return transform_yfinance_data(extracted_data)
+        return transform_yfinance_data(extracted_data, float_dtype)
     elif source.lower() == 'finnhub':
-        return transform_finnhub_data(extracted_data)
+        return transform_finnhub_data(extracted_data, float_dtype)
     else:
         raise ValueError(f"Unknown data source: {source}. Supported sources: 'yfinance', 'finnhub'")
 
@@ -1,5 +1,705 @@
 import pandas as pd
 import numpy as np
+import time
+import warnings
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+from statistics import NormalDist
+from typing import Callable, Iterable, Iterator
+from src.Transform.sim_summary import SimulationSummary, SUMMARY_COLUMNS
+from src.Transform.sim_cache import SimulationCache, simulation_cache_key
+from src.Transform.return_stats import ReturnStatsStore
+from src.Transform.schema import SIMULATION_COLUMNS, SIMULATION_DTYPES, empty_simulation_data
+
+TRADING_DAYS_PER_YEAR = 252
+
+# ticker label of the portfolio total rows in portfolio mode
+PORTFOLIO_TICKER = 'PORTFOLIO'
+
+# random number sampling schemes supported by the engine
+SAMPLING_METHODS = ['pseudo', 'antithetic', 'sobol']
+
+# time steps the engine can simulate with
+STEP_MODES = ['daily', 'yearly']
+
+# return models: parametric geometric brownian motion or resampled historical returns
+SIMULATION_MODELS = ['gbm', 'bootstrap']
+
+
+def _ticker_return_params(df: pd.DataFrame, tickers: list[str]) -> tuple[list[str], np.ndarray, np.ndarray, list[np.ndarray]]:
+    """
+    Compute the mean and standard deviation of daily log returns for each ticker.
+
+    The price history is sorted and grouped once, instead of once per simulation.
+    Tickers with fewer than two prices are skipped (same as before).
+
+    Returns:
+        (simulated tickers, mean daily log return per ticker, std of daily log return per ticker,
+         daily log return series per ticker)
+    """
+    prices_by_ticker = df.sort_values('date', kind='stable').groupby('ticker', sort=False)['adj_close']
+    available = set(prices_by_ticker.groups)
+
+    sim_tickers, means, stds, return_series = [], [], [], []
+    for ticker in tickers:
+        if ticker not in available:
+            continue
+        prices = prices_by_ticker.get_group(ticker).to_numpy(dtype=float)
+        if len(prices) < 2:
+            continue  # skip tickers with insufficient data
+
+        # Compute daily log returns from cleaned prices
+        daily_returns = np.log(prices[1:] / prices[:-1])
+        sim_tickers.append(ticker)
+        means.append(daily_returns.mean())
+        stds.append(daily_returns.std())
+        return_series.append(daily_returns)
+
+    return sim_tickers, np.array(means), np.array(stds), return_series
+
+
+def _portfolio_return_params(df: pd.DataFrame, tickers: list[str]) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Estimate the joint distribution of daily log returns across tickers.
+
+    Prices are aligned on the dates where every simulated ticker has a price, the mean
+    vector and covariance matrix are computed once, and the covariance is factored with
+    a Cholesky decomposition so correlated returns can be drawn as Z @ L.T.
+
+    Returns:
+        (simulated tickers, mean daily log return per ticker, lower-triangular Cholesky factor,
+         aligned daily log returns with shape (dates, tickers))
+    """
+    prices = df[df['ticker'].isin(tickers)].drop_duplicates(subset=['ticker', 'date'], keep='first')
+    prices = prices.pivot(index='date', columns='ticker', values='adj_close').sort_index()
+    sim_tickers = [ticker for ticker in tickers if ticker in prices.columns and prices[ticker].count() >= 2]
+    if not sim_tickers:
+        return [], np.array([]), np.empty((0, 0)), np.empty((0, 0))
+
+    # only dates where every ticker traded, so each return row is one joint observation
+    aligned = prices[sim_tickers].dropna().to_numpy(dtype=float)
+    daily_returns = np.log(aligned[1:] / aligned[:-1])
+    if len(daily_returns) < 2:
+        raise ValueError("Not enough overlapping price history to estimate the return covariance")
+
+    mean_return = daily_returns.mean(axis=0)
+    cov = np.atleast_2d(np.cov(daily_returns, rowvar=False, bias=True))
+
+    return sim_tickers, mean_return, _cholesky_factor(cov), daily_returns
+
+
+def _cholesky_factor(cov: np.ndarray) -> np.ndarray:
+    """Lower-triangular Cholesky factor of a return covariance matrix."""
+    # nudge the diagonal if the sample covariance is only positive semi-definite
+    jitter = 0.0
+    for _ in range(10):
+        try:
+            return np.linalg.cholesky(cov + jitter * np.eye(len(cov)))
+        except np.linalg.LinAlgError:
+            jitter = max(jitter * 10, 1e-12 * np.trace(cov) / len(cov))
+    raise ValueError("Return covariance matrix is not positive definite")
+
+
+def _build_model(df: pd.DataFrame, tickers: list[str], portfolio_value: float, years: int, portfolio: bool = False, sampling: str = 'pseudo', step: str = 'daily', simulation_model: str = 'gbm', block_size: int = 1, return_stats: ReturnStatsStore = None) -> dict:
+    """
+    Collect everything a shard needs to simulate paths into one picklable dict.
+
+    The same dict is handed to every shard (and every worker process), so the return
+    parameters are only estimated once per run. Returns None if no ticker has enough data.
+    With `return_stats`, the GBM parameters are read from the store instead of `df`.
+    """
+    use_stats = return_stats is not None and simulation_model == 'gbm'
+
+    # Ensure dataframe has required columns
+    if not use_stats:
+        if df is None:
+            raise ValueError("A price history DataFrame is needed unless GBM parameters come from return_stats")
+        required_cols = ['ticker', 'date', 'adj_close']
+        for col in required_cols:
+            if col not in df.columns:
+                raise ValueError(f"DataFrame must contain '{col}' column")
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method: {sampling}. Supported methods: {SAMPLING_METHODS}")
+    if step not in STEP_MODES:
+        raise ValueError(f"Unknown step mode: {step}. Supported modes: {STEP_MODES}")
+    if simulation_model not in SIMULATION_MODELS:
+        raise ValueError(f"Unknown simulation model: {simulation_model}. Supported models: {SIMULATION_MODELS}")
+    if simulation_model == 'bootstrap' and (step != 'daily' or sampling != 'pseudo'):
+        raise ValueError("The bootstrap model resamples daily returns and needs step='daily' and sampling='pseudo'")
+    if block_size < 1:
+        raise ValueError("block_size must be at least 1")
+
+    return_series = None
+    if use_stats and portfolio:
+        sim_tickers, mean_return, cov = return_stats.portfolio_params(tickers)
+        cov_factor = _cholesky_factor(cov) if sim_tickers else None
+        std_return = np.sqrt((cov_factor ** 2).sum(axis=1)) if sim_tickers else None
+    elif use_stats:
+        sim_tickers, mean_return, std_return = return_stats.ticker_params(tickers)
+        cov_factor = None
+    elif portfolio:
+        sim_tickers, mean_return, cov_factor, aligned_returns = _portfolio_return_params(df, tickers)
+        std_return = np.sqrt((cov_factor ** 2).sum(axis=1))
+        return_series = list(aligned_returns.T)
+    else:
+        sim_tickers, mean_return, std_return, return_series = _ticker_return_params(df, tickers)
+        cov_factor = None
+    if not sim_tickers:
+        return None
+
+    return_history, history_lengths = None, None
+    if simulation_model == 'bootstrap':
+        # one padded (tickers x longest history) array so indices can be gathered in one go
+        history_lengths = np.array([len(series) for series in return_series])
+        return_history = np.zeros((len(return_series), history_lengths.max()))
+        for i, series in enumerate(return_series):
+            return_history[i, :len(series)] = series
+
+    return {
+        "tickers": sim_tickers + ([PORTFOLIO_TICKER] if portfolio else []),
+        "ticker_categories": sorted(sim_tickers + ([PORTFOLIO_TICKER] if portfolio else [])),
+        "mean_return": mean_return,
+        "std_return": std_return,
+        "cov_factor": cov_factor,
+        "starting_val": portfolio_value / len(tickers),
+        "years": years,
+        "portfolio": portfolio,
+        "sampling": sampling,
+        "step": step,
+        "simulation_model": simulation_model,
+        "block_size": block_size,
+        "return_history": return_history,
+        "history_lengths": history_lengths
+    }
+
+
+def _standard_normals(rng: np.random.Generator, model: dict, n_sims: int, sim_offset: int) -> np.ndarray:
+    """
+    Draw the block of standard normal shocks for a shard: (n_sims, tickers, years, days)
+    in daily-step mode, (n_sims, tickers, years) in yearly-step mode.
+
+    - 'pseudo': plain pseudo-random draws
+    - 'antithetic': the second half of the shard mirrors the first half (z, -z)
+    - 'sobol': the yearly shock of every (ticker, year) comes from one point of a scrambled
+      Sobol sequence. In daily-step mode the days inside the year are filled in with
+      pseudo-random noise that has the right conditional distribution (a Brownian bridge
+      over the year). Ending values only depend on the yearly sums, so they get the
+      quasi-random accuracy while the sequence dimension stays tickers x years instead of
+      tickers x days. Shards take consecutive points of the same sequence.
+    """
+    n_tickers, years = len(model["mean_return"]), model["years"]
+    daily_step = model["step"] == 'daily'
+    shape = (n_sims, n_tickers, years) + ((TRADING_DAYS_PER_YEAR,) if daily_step else ())
+    sampling = model["sampling"]
+
+    if sampling == 'antithetic':
+        half = rng.standard_normal(size=((n_sims + 1) // 2,) + shape[1:])
+        return np.concatenate([half, -half])[:n_sims]
+
+    if sampling == 'pseudo':
+        return rng.standard_normal(size=shape)
+
+    # scipy is only needed for quasi-random sampling
+    from scipy.stats import qmc
+    from scipy.special import ndtri
+
+    shocks = rng.standard_normal(size=shape) if daily_step else None
+    engine = qmc.Sobol(d=n_tickers * years, scramble=True, seed=model["qmc_seed"])
+    if sim_offset:
+        engine.fast_forward(sim_offset)
+    with warnings.catch_warnings():
+        # scipy warns when n is not a power of 2; use a power of 2 batch_size for the best balance
+        warnings.simplefilter('ignore', UserWarning)
+        points = engine.random(n_sims)
+    points = np.clip(points, 1e-12, 1 - 1e-12)
+    yearly_shocks = ndtri(points).reshape(n_sims, n_tickers, years)
+    if not daily_step:
+        return yearly_shocks
+
+    # keep each day's deviation from the yearly mean, replace the mean itself
+    yearly_sums = yearly_shocks * np.sqrt(TRADING_DAYS_PER_YEAR)
+    shocks += (yearly_sums / TRADING_DAYS_PER_YEAR - shocks.mean(axis=-1))[..., None]
+    return shocks
+
+
+def _bootstrap_returns(rng: np.random.Generator, model: dict, n_sims: int) -> np.ndarray:
+    """
+    Resample historical daily log returns into a (n_sims, tickers, years, days) block.
+
+    Indices into each ticker's return history are drawn as whole arrays and gathered from
+    the padded history in one fancy-indexing step. With `block_size` > 1 consecutive days
+    are taken together (circular block bootstrap) to keep short-range autocorrelation.
+    In portfolio mode all tickers share the same dates so their co-movement is kept.
+    """
+    history, lengths = model["return_history"], model["history_lengths"]
+    n_tickers, history_len = history.shape
+    days = model["years"] * TRADING_DAYS_PER_YEAR
+    block_size = model["block_size"]
+    n_blocks = -(-days // block_size)
+
+    if model["portfolio"]:
+        # aligned history: every ticker has the same length, draw one set of dates per path
+        lengths = lengths[:1]
+    starts = rng.integers(0, lengths[None, :, None], size=(n_sims, len(lengths), n_blocks))
+    index = (starts[..., None] + np.arange(block_size)).reshape(n_sims, len(lengths), -1)[..., :days]
+    index %= lengths[None, :, None]
+
+    flat_index = index + (np.arange(n_tickers) * history_len)[None, :, None]
+    return history.ravel()[flat_index].reshape(n_sims, n_tickers, model["years"], TRADING_DAYS_PER_YEAR)
+
+
+def _daily_step(rng: np.random.Generator, model: dict, n_sims: int, sim_offset: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Draw every trading day of every path and reduce it to yearly log growth and daily std.
+
+    Returns:
+        (yearly log growth, std of the daily log returns within the year, initial value per row),
+        the first two with shape (n_sims, rows, years)
+    """
+    mean_return, std_return = model["mean_return"], model["std_return"]
+    starting_val, years = model["starting_val"], model["years"]
+    n_tickers = len(mean_return)
+
+    if model["simulation_model"] == 'bootstrap':
+        simulated_returns = _bootstrap_returns(rng, model, n_sims)
+    elif model["cov_factor"] is None:
+        simulated_returns = _standard_normals(rng, model, n_sims, sim_offset)
+        simulated_returns *= std_return[None, :, None, None]
+        simulated_returns += mean_return[None, :, None, None]
+    else:
+        # one batched matrix multiply turns independent draws into correlated returns
+        simulated_returns = _standard_normals(rng, model, n_sims, sim_offset)
+        correlated = simulated_returns.transpose(0, 2, 3, 1) @ model["cov_factor"].T
+        correlated += mean_return
+        simulated_returns = np.ascontiguousarray(correlated.transpose(0, 3, 1, 2))
+
+    # Sum of daily log returns == log of the product of daily growth factors
+    yearly_log_growth = simulated_returns.sum(axis=-1)
+    daily_std = simulated_returns.std(axis=-1)
+    initial_val = np.full(n_tickers, starting_val)
+
+    if model["portfolio"]:
+        # portfolio value per day is the sum of the ticker values on that day
+        daily_values = starting_val * np.exp(np.cumsum(simulated_returns.reshape(n_sims, n_tickers, -1), axis=-1)).sum(axis=1)
+        portfolio_initial = starting_val * n_tickers
+        log_values = np.log(np.concatenate([np.full((n_sims, 1), portfolio_initial), daily_values], axis=1))
+        portfolio_returns = np.diff(log_values, axis=1).reshape(n_sims, 1, years, TRADING_DAYS_PER_YEAR)
+        yearly_log_growth = np.concatenate([yearly_log_growth, portfolio_returns.sum(axis=-1)], axis=1)
+        daily_std = np.concatenate([daily_std, portfolio_returns.std(axis=-1)], axis=1)
+        initial_val = np.append(initial_val, portfolio_initial)
+
+    return yearly_log_growth, daily_std, initial_val
+
+
+def _yearly_step(rng: np.random.Generator, model: dict, n_sims: int, sim_offset: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sample the yearly quantities directly instead of every trading day.
+
+    Under GBM the sum of n = 252 i.i.d. N(mu, sigma^2) daily log returns is N(n*mu, n*sigma^2),
+    and n * (population variance of those returns) / sigma^2 is chi-square with n - 1
+    degrees of freedom, independent of the sum. So one normal and one chi-square draw per
+    (path, ticker, year) replace 252 normal draws, with the same distribution.
+
+    In portfolio mode the ticker sums are correlated through the Cholesky factor. The
+    portfolio volatility uses the holdings' weights at the start of each year (the realized
+    variance of a fixed-weight portfolio), which ignores the drift of the weights within
+    the year; use daily steps when that matters.
+
+    Returns:
+        Same as _daily_step
+    """
+    mean_return, std_return = model["mean_return"], model["std_return"]
+    starting_val, years = model["starting_val"], model["years"]
+    n_tickers = len(mean_return)
+    days = TRADING_DAYS_PER_YEAR
+
+    shocks = _standard_normals(rng, model, n_sims, sim_offset)
+    if model["cov_factor"] is None:
+        shocks *= std_return[None, :, None]
+    else:
+        shocks = (shocks.transpose(0, 2, 1) @ model["cov_factor"].T).transpose(0, 2, 1)
+    yearly_log_growth = days * mean_return[None, :, None] + np.sqrt(days) * shocks
+
+    daily_std = std_return[None, :, None] * np.sqrt(rng.chisquare(days - 1, size=(n_sims, n_tickers, years)) / days)
+    initial_val = np.full(n_tickers, starting_val)
+
+    if model["portfolio"]:
+        values_end = starting_val * np.exp(np.cumsum(yearly_log_growth, axis=-1))
+        values_start = np.concatenate([np.full((n_sims, n_tickers, 1), starting_val), values_end[..., :-1]], axis=-1)
+        portfolio_growth = np.log(values_end.sum(axis=1) / values_start.sum(axis=1))
+        weights = (values_start / values_start.sum(axis=1, keepdims=True)).transpose(0, 2, 1)
+        cov = model["cov_factor"] @ model["cov_factor"].T
+        portfolio_var = np.einsum('nyi,ij,nyj->ny', weights, cov, weights)
+        portfolio_std = np.sqrt(portfolio_var * rng.chisquare(days - 1, size=(n_sims, years)) / days)
+        yearly_log_growth = np.concatenate([yearly_log_growth, portfolio_growth[:, None, :]], axis=1)
+        daily_std = np.concatenate([daily_std, portfolio_std[:, None, :]], axis=1)
+        initial_val = np.append(initial_val, starting_val * n_tickers)
+
+    return yearly_log_growth, daily_std, initial_val
+
+
+def _simulate_batch(rng: np.random.Generator, model: dict, n_sims: int, sim_offset: int = 0) -> dict[str, np.ndarray]:
+    """
+    Simulate one batch of paths for every ticker at once.
+
+    Draws a single (n_sims x tickers x days) block of daily log returns (or, in yearly-step
+    mode, one draw per year) and reduces it to yearly values with array operations. Every
+    returned array has the shape (n_sims, tickers, years), with one extra row along the
+    ticker axis for the portfolio total when the model is a portfolio model.
+    """
+    step = _daily_step if model["step"] == 'daily' else _yearly_step
+    yearly_log_growth, daily_std, initial_val = step(rng, model, n_sims, sim_offset)
+
+    cumulative_log_growth = np.cumsum(yearly_log_growth, axis=-1)
+    initial_val = initial_val[None, :, None]
+
+    ending_val = initial_val * np.exp(cumulative_log_growth)
+    year_start_val = np.empty_like(ending_val)
+    year_start_val[..., 0] = initial_val[..., 0]
+    year_start_val[..., 1:] = ending_val[..., :-1]
+
+    return {
+        "starting_value": year_start_val,
+        "ending_value": ending_val,
+        "annual_return": np.expm1(yearly_log_growth),
+        "cumulative_return": np.expm1(cumulative_log_growth),
+        "volatility": daily_std * np.sqrt(TRADING_DAYS_PER_YEAR),
+        "probability": ending_val > initial_val
+    }
+
+
+def _ticker_layout(model: dict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Order the model's tickers alphabetically for the ticker-major row layout.
+
+    Returns:
+        (position of each output ticker block in the model's ticker axis, its categorical code)
+    """
+    order = np.argsort(model["tickers"], kind='stable')
+    codes = np.searchsorted(model["ticker_categories"], np.asarray(model["tickers"])[order])
+    return order, codes
+
+
+def _allocate_columns(model: dict, num_simulations: int) -> dict[str, np.ndarray]:
+    """
+    Preallocate typed (tickers, simulations, years) arrays for every simulated value column.
+    Filled shard by shard with _fill_columns; C order makes them ticker-major once flattened.
+    """
+    shape = (len(model["tickers"]), num_simulations, model["years"])
+    return {col: np.empty(shape, dtype=SIMULATION_DTYPES[col]) for col in SIMULATION_COLUMNS[3:]}
+
+
+def _fill_columns(columns: dict[str, np.ndarray], batch: dict[str, np.ndarray], order: np.ndarray, sim_offset: int) -> None:
+    """Copy a (sims, tickers, years) batch into its slice of the preallocated columns."""
+    n_sims = batch["ending_value"].shape[0]
+    for col, values in columns.items():
+        # the assignment casts to the column type without an intermediate copy
+        values[:, sim_offset:sim_offset + n_sims, :] = batch[col][:, order, :].transpose(1, 0, 2)
+
+
+def _columns_to_frame(columns: dict[str, np.ndarray], model: dict, codes: np.ndarray, sim_offset: int = 0) -> pd.DataFrame:
+    """
+    Wrap filled (tickers, sims, years) columns in a simulation frame ordered by ticker,
+    simulation and year, without copying the value arrays.
+    """
+    n_tickers, n_sims, years = columns["ending_value"].shape
+    frame = {
+        "simulation_num": np.tile(np.repeat(np.arange(sim_offset, sim_offset + n_sims, dtype=np.int32), years), n_tickers),
+        "ticker": pd.Categorical.from_codes(np.repeat(codes, n_sims * years), categories=model["ticker_categories"]),
+        "year": np.tile(np.arange(1, years + 1, dtype=np.int32), n_sims * n_tickers),
+    }
+    for col in SIMULATION_COLUMNS[3:]:
+        frame[col] = columns[col].reshape(-1)
+    return pd.DataFrame(frame, columns=SIMULATION_COLUMNS, copy=False)
+
+
+def _batch_to_frame(batch: dict[str, np.ndarray], model: dict, sim_offset: int) -> pd.DataFrame:
+    """
+    Flatten a (sims, tickers, years) batch into typed simulation rows ordered by ticker, simulation and year.
+    """
+    order, codes = _ticker_layout(model)
+    columns = _allocate_columns(dict(model, years=batch["ending_value"].shape[2]), batch["ending_value"].shape[0])
+    _fill_columns(columns, batch, order, 0)
+    return _columns_to_frame(columns, model, codes, sim_offset)
+
+
+def _simulate_shard_batch(sim_offset: int, n_sims: int, seed_seq: np.random.SeedSequence, model: dict) -> dict[str, np.ndarray]:
+    """
+    Simulate one shard of paths and return its (sims, tickers, years) value arrays,
+    already cast to the compact column types so less data is sent back from workers.
+    """
+    rng = np.random.default_rng(seed_seq)
+    batch = _simulate_batch(rng, model, n_sims, sim_offset)
+    return {col: batch[col].astype(SIMULATION_DTYPES[col]) for col in SIMULATION_COLUMNS[3:]}
+
+
+def _simulate_shard(sim_offset: int, n_sims: int, seed_seq: np.random.SeedSequence, model: dict) -> pd.DataFrame:
+    """
+    Simulate one shard of paths with its own random stream.
+
+    Kept at module level so it can be pickled and sent to worker processes.
+    """
+    return _batch_to_frame(_simulate_shard_batch(sim_offset, n_sims, seed_seq, model), model, sim_offset)
+
+
+def _summarize_shard(sim_offset: int, n_sims: int, seed_seq: np.random.SeedSequence, model: dict) -> SimulationSummary:
+    """
+    Simulate one shard of paths and keep only its running statistics.
+    Draws exactly the same paths as _simulate_shard for the same shard.
+    """
+    rng = np.random.default_rng(seed_seq)
+    batch = _simulate_batch(rng, model, n_sims, sim_offset)
+    summary = SimulationSummary(model["tickers"], model["years"])
+    summary.update(batch["ending_value"], batch["starting_value"][0, :, 0])
+    return summary
+
+
+def _shard_plan(num_simulations: int, batch_size: int, seed_seq: np.random.SeedSequence) -> tuple[list[int], list[int], list[np.random.SeedSequence]]:
+    """
+    Split the simulations into fixed-size shards and spawn one independent random stream per shard.
+
+    The plan only depends on `num_simulations`, `batch_size` and the seed, so the same seed
+    gives the same paths no matter how many workers run the shards.
+    """
+    offsets = list(range(0, num_simulations, batch_size))
+    sizes = [min(batch_size, num_simulations - offset) for offset in offsets]
+    #https://numpy.org/doc/stable/reference/random/parallel.html#seedsequence-spawning
+    seed_seqs = seed_seq.spawn(len(offsets))
+    return offsets, sizes, seed_seqs
+
+
+def _run_shards(
+    shard_fn: Callable,
+    model: dict,
+    num_simulations: int,
+    seed: int,
+    batch_size: int,
+    n_workers: int
+) -> Iterator:
+    """
+    Run `shard_fn` over every shard of the simulation plan and yield the results in shard order.
+
+    With `n_workers` > 1 the shards run in a process pool and at most two shards per
+    worker are in flight at a time.
+    """
+    if model is None or num_simulations <= 0:
+        return
+
+    root_seq = np.random.SeedSequence(seed)
+    # every shard scrambles the quasi-random sequence the same way
+    model["qmc_seed"] = int(root_seq.generate_state(1)[0])
+    offsets, sizes, seed_seqs = _shard_plan(num_simulations, batch_size, root_seq)
+    run_shard = partial(shard_fn, model=model)
+    shards = zip(offsets, sizes, seed_seqs)
+
+    if n_workers <= 1 or len(offsets) <= 1:
+        for shard in shards:
+            yield run_shard(*shard)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(offsets))) as executor:
+        # submit shards through a bounded window and yield them in shard order,
+        # so finished-but-unconsumed shards cannot pile up in memory
+        pending = deque()
+        for shard in islice(shards, 2 * n_workers):
+            pending.append(executor.submit(run_shard, *shard))
+        while pending:
+            result = pending.popleft().result()
+            next_shard = next(shards, None)
+            if next_shard is not None:
+                pending.append(executor.submit(run_shard, *next_shard))
+            yield result
+
+
+def iter_monte_carlo(
+    df: pd.DataFrame,
+    tickers: list[str],
+    portfolio_value: float = 250000,
+    years: int = 10,
+    num_simulations: int = 10000,
+    seed: int = None,
+    batch_size: int = 250,
+    n_workers: int = 1,
+    portfolio: bool = False,
+    sampling: str = 'pseudo',
+    step: str = 'daily',
+    simulation_model: str = 'gbm',
+    block_size: int = 1,
+    return_stats: ReturnStatsStore = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Streaming version of run_monte_carlo.
+
+    Yields one DataFrame of simulation rows per shard of `batch_size` simulations, in
+    simulation order, so memory stays bounded by the shard size instead of growing with
+    `num_simulations`.
+    """
+    model = _build_model(
+        df, tickers, portfolio_value, years, portfolio=portfolio, sampling=sampling, step=step,
+        simulation_model=simulation_model, block_size=block_size, return_stats=return_stats
+    )
+    yield from _run_shards(_simulate_shard, model, num_simulations, seed, batch_size, n_workers)
+
+
+def summarize_monte_carlo(
+    df: pd.DataFrame,
+    tickers: list[str],
+    portfolio_value: float = 250000,
+    years: int = 10,
+    num_simulations: int = 10000,
+    seed: int = None,
+    batch_size: int = 250,
+    n_workers: int = 1,
+    portfolio: bool = False,
+    sampling: str = 'pseudo',
+    step: str = 'daily',
+    simulation_model: str = 'gbm',
+    block_size: int = 1,
+    return_stats: ReturnStatsStore = None
+) -> pd.DataFrame:
+    """
+    Summary-only Monte Carlo: simulate the same paths as run_monte_carlo but keep only
+    streaming statistics per (ticker, year) instead of one row per path.
+
+    Each shard builds a SimulationSummary (mean, variance, quantile sketch and gain/loss
+    counts of the ending value) which is merged into the running total, so memory does
+    not depend on `num_simulations`.
+
+    Returns:
+        DataFrame with columns: ticker, year, num_paths, mean_ending_value, std_ending_value,
+        p5/p25/p50/p75/p95_ending_value, probability_of_gain, probability_of_loss
+    """
+    model = _build_model(
+        df, tickers, portfolio_value, years, portfolio=portfolio, sampling=sampling, step=step,
+        simulation_model=simulation_model, block_size=block_size, return_stats=return_stats
+    )
+    total = None
+    for summary in _run_shards(_summarize_shard, model, num_simulations, seed, batch_size, n_workers):
+        if total is None:
+            total = summary
+        else:
+            total.merge(summary)
+
+    if total is None:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    return total.to_frame()
+
+
+def _has_converged(final_values: np.ndarray, target_se: float = None, target_ci_width: float = None, ci_quantile: float = 0.05) -> bool:
+    """
+    Check the convergence targets on the final-year ending values simulated so far.
+
+    - target_se: standard error of the mean ending value, relative to the mean
+    - target_ci_width: width of the 95% confidence interval of the `ci_quantile` percentile,
+      relative to the percentile (distribution-free order-statistic interval)
+    """
+    n = len(final_values)
+    if target_se is not None:
+        if final_values.std(ddof=1) / np.sqrt(n) > target_se * abs(final_values.mean()):
+            return False
+    if target_ci_width is not None:
+        sorted_values = np.sort(final_values)
+        half_width = 1.96 * np.sqrt(n * ci_quantile * (1 - ci_quantile))
+        low = int(np.floor(n * ci_quantile - half_width))
+        high = int(np.ceil(n * ci_quantile + half_width))
+        if low < 0 or high >= n:
+            return False
+        estimate = sorted_values[min(int(n * ci_quantile), n - 1)]
+        if sorted_values[high] - sorted_values[low] > target_ci_width * abs(estimate):
+            return False
+    return True
+
+
+def _simulate_ticker_adaptive(
+    ticker_index: int,
+    seed_seq: np.random.SeedSequence,
+    model: dict,
+    num_simulations: int,
+    batch_size: int,
+    target_se: float,
+    target_ci_width: float,
+    ci_quantile: float
+) -> pd.DataFrame:
+    """
+    Simulate one ticker shard by shard until its estimates converge or `num_simulations` is reached.
+
+    Every ticker has its own random stream, so its paths and stopping point do not depend
+    on the other tickers or on which worker runs it. Kept at module level for pickling.
+    """
+    ticker_model = dict(
+        model,
+        tickers=[model["tickers"][ticker_index]],
+        mean_return=model["mean_return"][ticker_index:ticker_index + 1],
+        std_return=model["std_return"][ticker_index:ticker_index + 1],
+        qmc_seed=int(seed_seq.generate_state(1)[0])
+    )
+    if model["return_history"] is not None:
+        ticker_model["return_history"] = model["return_history"][ticker_index:ticker_index + 1]
+        ticker_model["history_lengths"] = model["history_lengths"][ticker_index:ticker_index + 1]
+    offsets, sizes, seed_seqs = _shard_plan(num_simulations, batch_size, seed_seq)
+
+    frames, final_values = [], np.empty(0)
+    for shard_number, shard in enumerate(zip(offsets, sizes, seed_seqs)):
+        frame = _simulate_shard(*shard, model=ticker_model)
+        frames.append(frame)
+        final_values = np.concatenate([final_values, frame['ending_value'].to_numpy()[model["years"] - 1::model["years"]]])
+        # need at least two shards before the spread estimate is trusted
+        if shard_number >= 1 and _has_converged(final_values, target_se, target_ci_width, ci_quantile):
+            break
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def _run_adaptive(
+    df: pd.DataFrame,
+    tickers: list[str],
+    portfolio_value: float,
+    years: int,
+    num_simulations: int,
+    seed: int,
+    batch_size: int,
+    n_workers: int,
+    target_se: float,
+    target_ci_width: float,
+    ci_quantile: float,
+    **model_options
+) -> pd.DataFrame:
+    """
+    Adaptive-count version of run_monte_carlo: every ticker stops on its own once converged.
+    Tickers run in parallel when `n_workers` > 1.
+    """
+    model = _build_model(df, tickers, portfolio_value, years, **model_options)
+    if model is None or num_simulations <= 0:
+        return empty_simulation_data()
+
+    ticker_seqs = np.random.SeedSequence(seed).spawn(len(model["tickers"]))
+    simulate = partial(
+        _simulate_ticker_adaptive,
+        model=model,
+        num_simulations=num_simulations,
+        batch_size=batch_size,
+        target_se=target_se,
+        target_ci_width=target_ci_width,
+        ci_quantile=ci_quantile
+    )
+    ticker_indexes = range(len(model["tickers"]))
+
+    if n_workers > 1 and len(model["tickers"]) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(model["tickers"]))) as executor:
+            results = list(executor.map(simulate, ticker_indexes, ticker_seqs))
+    else:
+        results = [simulate(index, ticker_seq) for index, ticker_seq in zip(ticker_indexes, ticker_seqs)]
+
+    # tickers are concatenated alphabetically so the result keeps the ticker-major row order
+    results = [results[i] for i in np.argsort(model["tickers"], kind='stable')]
+    result = pd.concat(results, ignore_index=True)
+    paths_per_ticker = {frame['ticker'].iloc[0]: int(frame['simulation_num'].max()) + 1 for frame in results}
+    result.attrs['paths_per_ticker'] = paths_per_ticker
+    return result
+
 
 # Monte Carlo simulation with annual aggregation using previously cleaned DataFrame
 # Can pass any list of tickers, portfolio value, and years
@@ -9,119 +709,247 @@ def run_monte_carlo(
     portfolio_value: float = 250000,
     years: int = 10,
     num_simulations: int = 10000,
-    seed: int = None
+    seed: int = None,
+    batch_size: int = 250,
+    n_workers: int = 1,
+    portfolio: bool = False,
+    sampling: str = 'pseudo',
+    step: str = 'daily',
+    simulation_model: str = 'gbm',
+    block_size: int = 1,
+    return_stats: ReturnStatsStore = None,
+    target_se: float = None,
+    target_ci_width: float = None,
+    ci_quantile: float = 0.05,
+    cache_dir: str = None
 ) -> pd.DataFrame:
     """
     Monte Carlo simulation using pre-cleaned stock data from Transform module.
     Columns: id, ticker, simulation_num, year, starting_value, ending_value,
              annual_return, cumulative_return, volatility, probability
+
+    Simulations are run in batches of `batch_size` paths; each batch draws the returns
+    for all tickers and days in one call, so the cost scales with the array size
+    rather than with the number of Python loop iterations.
+
+    Each batch is a shard with its own generator spawned from `seed`, so shards can run
+    in `n_workers` processes. For a given `seed` and `batch_size` the result is identical
+    for any worker count. Use iter_monte_carlo to consume the shards as they finish.
+
+    With `portfolio=True` the tickers are simulated jointly: the covariance of daily log
+    returns is estimated once on the dates all tickers share, and correlated returns are
+    drawn with a Cholesky factor. Each simulation and year then also gets a 'PORTFOLIO'
+    row with the total value of all holdings.
+
+    `sampling` selects how the random shocks are drawn: 'pseudo' (plain), 'antithetic'
+    (mirrored pairs) or 'sobol' (scrambled quasi-random yearly shocks, needs scipy; a
+    power of 2 `batch_size` keeps the sequence balanced). The variance-reduced methods
+    reach the same percentile accuracy with fewer paths, see compare_sampling_methods.
+
+    `step='yearly'` draws each year's log growth and realized volatility directly from
+    their exact GBM distributions (normal and chi-square) instead of simulating all 252
+    trading days, which needs about 250x fewer random numbers. `step='daily'` (default)
+    simulates every day and is needed by models without a closed form.
+
+    `simulation_model='bootstrap'` replaces the normal returns with historical daily log
+    returns resampled with replacement (in blocks of `block_size` consecutive days to keep
+    autocorrelation), so fat tails in the price history carry over to the simulation.
+    It needs daily steps and pseudo-random sampling.
+
+    Setting `target_se` (standard error of the mean final ending value, relative to the
+    mean) and/or `target_ci_width` (relative width of the 95% confidence interval of the
+    `ci_quantile` percentile) makes the path count adaptive: each ticker is simulated in
+    batches with its own random stream until its final-year estimates meet the targets,
+    with `num_simulations` as the upper limit. The number of paths each ticker needed is
+    stored in `result.attrs['paths_per_ticker']`. Adaptive mode is per ticker, so it
+    cannot be combined with `portfolio=True`.
+
+    With `cache_dir` set, results are memoized on disk (see sim_cache.SimulationCache),
+    keyed by the tickers' return history and every parameter that changes the result.
+    A rerun with the same inputs reads the stored frame instead of simulating. Only
+    seeded runs are cached, since `seed=None` asks for fresh random paths.
+
+    `return_stats` (a return_stats.ReturnStatsStore) supplies the GBM mean, std and
+    covariance from incrementally maintained moments, so the price history does not have
+    to be scanned again; `df` may then be None. The bootstrap model still needs `df`.
     """
+    if (target_se is not None or target_ci_width is not None) and portfolio:
+        raise ValueError("Adaptive simulation counts are per ticker and cannot be used in portfolio mode")
 
-    if seed is not None:
-        np.random.seed(seed)
+    cache = None
+    if cache_dir is not None and seed is not None:
+        cache = SimulationCache(cache_dir)
+        # n_workers is left out on purpose, it does not change the result
+        cache_key = simulation_cache_key(df, tickers, dict(
+            portfolio_value=portfolio_value, years=years, num_simulations=num_simulations, seed=seed,
+            batch_size=batch_size, portfolio=portfolio, sampling=sampling, step=step,
+            simulation_model=simulation_model, block_size=block_size,
+            target_se=target_se, target_ci_width=target_ci_width, ci_quantile=ci_quantile,
+            return_stats=return_stats.fingerprint(tickers) if return_stats is not None else None
+        ))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print("Monte Carlo inputs unchanged, using cached simulation results")
+            return cached
 
-    # Ensure dataframe has required columns
-    required_cols = ['ticker', 'date', 'adj_close']
-    for col in required_cols:
-        if col not in df.columns:
-            raise ValueError(f"DataFrame must contain '{col}' column")
-
-    results = []
-    trading_days_per_year = 252
-    n_tickers = len(tickers)
-
-    for sim in range(num_simulations):
-        for ticker in tickers:
-            # Select ticker's historical prices
-            ticker_data = df[df['ticker'] == ticker].sort_values('date')
-            prices = ticker_data['adj_close'].values
-            if len(prices) < 2:
-                continue  # skip tickers with insufficient data
-
-            # Compute daily log returns from cleaned prices
-            daily_returns = np.log(prices[1:] / prices[:-1])
-
-            # Mean and covariance for univariate simulation
-            mean_return = daily_returns.mean()
-            std_return = daily_returns.std()
-
-            # Simulate daily returns for 'years'
-            total_days = years * trading_days_per_year
-            simulated_returns = np.random.normal(
-                loc=mean_return,
-                scale=std_return,
-                size=total_days
-            )
-            growth_factors = np.exp(simulated_returns)
-
-            starting_val = portfolio_value / n_tickers
-            initial_val = starting_val
-
-            # Track values per year
-            for year in range(1, years + 1):
-                start_idx = (year - 1) * trading_days_per_year
-                end_idx = year * trading_days_per_year
-                yearly_growth = growth_factors[start_idx:end_idx].prod()
-                ending_val = starting_val * yearly_growth
-
-                annual_return = yearly_growth - 1
-                cumulative_return = (ending_val / initial_val) - 1
-                volatility = np.std(
-                    simulated_returns[start_idx:end_idx]
-                ) * np.sqrt(trading_days_per_year)
-                probability = 1.0 if ending_val > initial_val else 0.0
-
-                results.append({
-                    "simulation_num": sim,
-                    "ticker": ticker,
-                    "year": year,
-                    "starting_value": starting_val,
-                    "ending_value": ending_val,
-                    "annual_return": annual_return,
-                    "cumulative_return": cumulative_return,
-                    "volatility": volatility,
-                    "probability": probability
-                })
-
-                starting_val = ending_val
-
-    return pd.DataFrame(results)
+    if target_se is not None or target_ci_width is not None:
+        result = _run_adaptive(
+            df, tickers, portfolio_value, years, num_simulations, seed, batch_size, n_workers,
+            target_se, target_ci_width, ci_quantile, sampling=sampling, step=step,
+            simulation_model=simulation_model, block_size=block_size, return_stats=return_stats
+        )
+    else:
+        model = _build_model(
+            df, tickers, portfolio_value, years, portfolio=portfolio, sampling=sampling, step=step,
+            simulation_model=simulation_model, block_size=block_size, return_stats=return_stats
+        )
+        if model is None or num_simulations <= 0:
+            return empty_simulation_data()
+        # every shard is written straight into its slice of the typed, ticker-major columns
+        order, codes = _ticker_layout(model)
+        columns = _allocate_columns(model, num_simulations)
+        batches = _run_shards(_simulate_shard_batch, model, num_simulations, seed, batch_size, n_workers)
+        for sim_offset, batch in zip(range(0, num_simulations, batch_size), batches):
+            _fill_columns(columns, batch, order, sim_offset)
+        result = _columns_to_frame(columns, model, codes)
+
+    if cache is not None:
+        cache.put(cache_key, result)
+    return result
+
+
+def compare_sampling_methods(
+    df: pd.DataFrame,
+    ticker: str,
+    portfolio_value: float = 250000,
+    years: int = 10,
+    path_counts: list[int] = [256, 1024, 4096],
+    n_repeats: int = 20,
+    methods: list[str] = SAMPLING_METHODS,
+    quantiles: list[float] = [0.05, 0.5, 0.95]
+) -> pd.DataFrame:
+    """
+    Accuracy-vs-cost comparison of the sampling methods on a single ticker.
+
+    Under the GBM model the final-year ending value is lognormal, so its exact percentiles
+    are known from the ticker's daily mean and std. Every method is run `n_repeats` times
+    (seeds 0..n_repeats-1) for every path count.
+
+    Returns:
+        DataFrame with one row per (sampling, num_simulations): mean seconds per run and the
+        relative RMSE of each estimated percentile (rel_rmse_p5, rel_rmse_p50, ...)
+    """
+    _, mean_return, std_return, _ = _ticker_return_params(df, [ticker])
+    if len(mean_return) == 0:
+        raise ValueError(f"Not enough price history for {ticker}")
+
+    days = years * TRADING_DAYS_PER_YEAR
+    exact = {
+        q: portfolio_value * np.exp(days * mean_return[0] + np.sqrt(days) * std_return[0] * NormalDist().inv_cdf(q))
+        for q in quantiles
+    }
+
+    rows = []
+    for method in methods:
+        for n_sims in path_counts:
+            errors = {q: [] for q in quantiles}
+            elapsed = 0.0
+            for repeat in range(n_repeats):
+                start = time.perf_counter()
+                result = run_monte_carlo(
+                    df, [ticker], portfolio_value, years, n_sims, seed=repeat, batch_size=256, sampling=method
+                )
+                elapsed += time.perf_counter() - start
+                final_values = result.loc[result['year'] == years, 'ending_value'].to_numpy()
+                for q in quantiles:
+                    errors[q].append(np.quantile(final_values, q) / exact[q] - 1)
+
+            row = {'sampling': method, 'num_simulations': n_sims, 'seconds_per_run': elapsed / n_repeats}
+            for q in quantiles:
+                row[f'rel_rmse_p{round(q * 100)}'] = np.sqrt(np.mean(np.square(errors[q])))
+            rows.append(row)
+
+    return pd.DataFrame(rows)
 
 
 # Needed to create a different transform function due to different columns from live data
+def _has_simulation_dtypes(df: pd.DataFrame) -> bool:
+    """True if the frame already uses the compact simulation column types (frames built by the engine)."""
+    return isinstance(df['ticker'].dtype, pd.CategoricalDtype) and all(
+        df[col].dtype == dtype for col, dtype in SIMULATION_DTYPES.items()
+    )
+
+
+def _is_simulation_ordered(df: pd.DataFrame) -> bool:
+    """
+    Check in one pass whether rows are already sorted by ticker, simulation_num and year.
+    Ticker order is the categorical code order, which is alphabetical for engine frames.
+    """
+    ticker_step = np.diff(df['ticker'].cat.codes.to_numpy().astype(np.int64))
+    sim_step = np.diff(df['simulation_num'].to_numpy())
+    year_step = np.diff(df['year'].to_numpy())
+    in_order = (ticker_step > 0) | ((ticker_step == 0) & ((sim_step > 0) | ((sim_step == 0) & (year_step >= 0))))
+    return bool(in_order.all())
+
+
 def transform_monte_carlo_data(df: pd.DataFrame) -> pd.DataFrame:
     """
     Transform and validate Monte Carlo simulation results.
     Ensures correct types, fills missing values, and sorts by ticker and simulation.
+
+    Frames from the engine already have the compact column types (SIMULATION_DTYPES) and
+    come out ticker-major, so they are checked and returned as they are instead of being
+    converted and re-sorted; any other frame is converted to the compact types first.
     """
     if df.empty:
-        return pd.DataFrame(columns=[
-            'simulation_num', 'ticker', 'year',
-            'starting_value', 'ending_value', 'annual_return',
-            'cumulative_return', 'volatility', 'probability'
-        ])
-
-    df = df.copy()
-
-    # Ensuring correct data types
-    df['ticker'] = df['ticker'].astype(str).str.upper()
-    df['simulation_num'] = df['simulation_num'].astype(int)
-    df['year'] = df['year'].astype(int)
+        return empty_simulation_data()
+
     numeric_cols = [
         'starting_value', 'ending_value',
         'annual_return', 'cumulative_return',
         'volatility', 'probability'
     ]
-    df[numeric_cols] = df[numeric_cols].apply(
-        pd.to_numeric, errors='coerce'
-    )
+    if not _has_simulation_dtypes(df):
+        df = df.copy()
 
-    # Fill any missing values with 0
-    df[numeric_cols] = df[numeric_cols].fillna(0)
+        # Ensuring correct data types
+        df['ticker'] = df['ticker'].astype(str).str.upper().astype('category')
+        df['simulation_num'] = df['simulation_num'].astype(SIMULATION_DTYPES['simulation_num'])
+        df['year'] = df['year'].astype(SIMULATION_DTYPES['year'])
+        df[numeric_cols] = df[numeric_cols].apply(
+            pd.to_numeric, errors='coerce'
+        )
+
+        # Fill any missing values with 0
+        df[numeric_cols] = df[numeric_cols].fillna(0)
+        df = df.astype({col: SIMULATION_DTYPES[col] for col in numeric_cols})
+    else:
+        categories = df['ticker'].cat.categories
+        if not categories.str.isupper().all():
+            df['ticker'] = df['ticker'].cat.rename_categories(categories.str.upper())
+        if list(df['ticker'].cat.categories) != sorted(df['ticker'].cat.categories):
+            df['ticker'] = df['ticker'].cat.reorder_categories(sorted(df['ticker'].cat.categories))
+        # Fill any missing values with 0 (only columns that actually have some)
+        for col in numeric_cols[:-1]:
+            if np.isnan(df[col].to_numpy()).any():
+                df[col] = df[col].fillna(0)
 
     # Sort by ticker, simulation_num, and year
-    df = df.sort_values(
-        ['ticker', 'simulation_num', 'year']
-    ).reset_index(drop=True)
+    if not _is_simulation_ordered(df):
+        df = df.sort_values(
+            ['ticker', 'simulation_num', 'year']
+        ).reset_index(drop=True)
 
     return df
+
+
+def iter_transform_monte_carlo_data(chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    Apply transform_monte_carlo_data to each streamed block of simulation rows.
+
+    Rows are sorted within each block only (blocks from iter_monte_carlo are already
+    ticker-major), so the stream never has to be held in memory as a whole.
+    """
+    for chunk in chunks:
+        if not chunk.empty:
+            yield transform_monte_carlo_data(chunk)
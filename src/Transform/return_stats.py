@@ -0,0 +1,240 @@
+"""
+Persistent store of daily log return statistics.
+
+The Monte Carlo model only needs the mean and standard deviation of each ticker's daily
+log returns (plus their covariance in portfolio mode). Instead of recomputing them from
+the full price history on every run, this store keeps running moments that are updated
+with only the rows newer than the last date it has seen:
+- per ticker: count, mean and sum of squared deviations (Welford / Chan parallel update)
+- jointly, on the dates every tracked ticker traded: mean vector and co-moment matrix
+
+The moments use the same definitions as the in-memory estimate in monte_carlo.py
+(population std/covariance), so a simulation gets the same parameters either way.
+Rows are assumed to arrive in date order; a row dated on or before a ticker's last seen
+date is ignored. yfinance re-adjusts the whole Adj Close history after a split or dividend,
+so the row of a ticker's last seen date is compared with the price stored for it first; if
+it changed, the ticker (and the joint statistics) are rebuilt from the new prices.
+"""
+
+import hashlib
+import json
+import os
+import pandas as pd
+import numpy as np
+
+DEFAULT_STATS_PATH = '.return_stats.json'
+
+
+def _merge_moments(count: int, mean: np.ndarray, comoment: np.ndarray, returns: np.ndarray) -> tuple[int, np.ndarray, np.ndarray]:
+    """
+    Add a (n, k) block of returns to running (count, mean, co-moment) statistics.
+
+    Chan et al. parallel update, https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+    The co-moment is the sum of products of deviations from the mean; its diagonal is
+    the Welford M2 of each column.
+    """
+    n = len(returns)
+    if n == 0:
+        return count, mean, comoment
+    block_mean = returns.mean(axis=0)
+    deviations = returns - block_mean
+    block_comoment = deviations.T @ deviations
+    total = count + n
+    delta = block_mean - mean
+    mean = mean + delta * n / total
+    comoment = comoment + block_comoment + np.outer(delta, delta) * count * n / total
+    return total, mean, comoment
+
+
+class ReturnStatsStore:
+    """
+    Running daily log return statistics per ticker, saved as JSON at `path`.
+
+    Use update() with new stock_data rows, then ticker_params() / portfolio_params() to
+    read the simulation parameters without touching the price history.
+    """
+
+    def __init__(self, path: str = DEFAULT_STATS_PATH):
+        self.path = path
+        # ticker -> {'count', 'mean', 'm2', 'last_date', 'last_price'}
+        self.tickers = {}
+        # {'tickers', 'count', 'mean', 'comoment', 'last_date', 'last_prices'} or None
+        self.joint = None
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_STATS_PATH) -> 'ReturnStatsStore':
+        """Read a saved store, or start an empty one if `path` does not exist yet."""
+        store = cls(path)
+        try:
+            with open(path, 'r') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return store
+        store.tickers = saved['tickers']
+        store.joint = saved['joint']
+        return store
+
+    def save(self) -> None:
+        """Write the store to `path` (through a temporary file so a crash keeps the old copy)."""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'tickers': self.tickers, 'joint': self.joint}, f)
+        os.replace(tmp_path, self.path)
+
+    def update(self, df: pd.DataFrame, joint_tickers: list[str] = None) -> None:
+        """
+        Absorb new price rows.
+
+        Args:
+            df: stock_data rows with 'ticker', 'date' and 'adj_close' columns; only rows after
+                each ticker's last seen date are used, so passing the full history again is harmless.
+                Tickers whose history was re-adjusted (see readjusted()) are rebuilt from `df`, which
+                then has to hold their full history
+            joint_tickers: Tickers to keep joint (covariance) statistics for. If this differs from
+                the tracked set, the joint statistics are rebuilt from `df`, which then has to
+                hold the full history of these tickers. A tracked ticker that just has no rows in
+                `df` (e.g. its download failed) keeps the joint statistics, only the dates it is
+                missing on are skipped
+        """
+        if df.empty:
+            return
+        prices = df[['ticker', 'date', 'adj_close']].dropna()
+        prices = prices.assign(date=pd.to_datetime(prices['date'])).sort_values('date', kind='stable')
+
+        # re-adjusted tickers start over from `df`, which then has to hold their full history
+        readjusted = self.readjusted(prices)
+        for ticker in readjusted:
+            del self.tickers[ticker]
+        if self.joint is not None and set(readjusted) & set(self.joint['tickers']):
+            joint_tickers = self.joint['tickers'] if joint_tickers is None else joint_tickers
+            self.joint = None
+
+        for ticker, group in prices.groupby('ticker', sort=False):
+            self._update_ticker(ticker, group)
+
+        if joint_tickers is not None:
+            tracked = sorted(set(joint_tickers))
+            if self.joint is None or self.joint['tickers'] != tracked:
+                self.joint = {'tickers': tracked, 'count': 0, 'mean': [0.0] * len(tracked),
+                              'comoment': [[0.0] * len(tracked) for _ in tracked], 'last_date': None, 'last_prices': None}
+        if self.joint is not None and self.joint['tickers']:
+            self._update_joint(prices)
+
+    def readjusted(self, df: pd.DataFrame) -> list[str]:
+        """
+        Tickers whose price on their last seen date is different in `df`, i.e. whose history was
+        re-adjusted (split or dividend) since the store absorbed it. Tickers without a row for
+        that date in `df` can't be checked and are left out.
+        """
+        if not self.tickers or df.empty:
+            return []
+        anchors = pd.DataFrame(
+            [(ticker, pd.Timestamp(state['last_date']), state['last_price']) for ticker, state in self.tickers.items()],
+            columns=['ticker', 'date', 'last_price']
+        )
+        prices = df[['ticker', 'date', 'adj_close']].assign(ticker=df['ticker'].astype(str), date=pd.to_datetime(df['date']))
+        matched = anchors.merge(prices.drop_duplicates(subset=['ticker', 'date'], keep='first'), on=['ticker', 'date'])
+        changed = ~np.isclose(matched['adj_close'].to_numpy(dtype=float), matched['last_price'].to_numpy(dtype=float), rtol=1e-6)
+        return matched.loc[changed, 'ticker'].tolist()
+
+    def _update_ticker(self, ticker: str, group: pd.DataFrame) -> None:
+        state = self.tickers.get(ticker)
+        if state is not None:
+            group = group[group['date'] > pd.Timestamp(state['last_date'])]
+        group = group.drop_duplicates(subset='date', keep='first')
+        if group.empty:
+            return
+        new_prices = group['adj_close'].to_numpy(dtype=float)
+        if state is None:
+            state = {'count': 0, 'mean': 0.0, 'm2': 0.0}
+        else:
+            new_prices = np.concatenate([[state['last_price']], new_prices])
+
+        returns = np.log(new_prices[1:] / new_prices[:-1])[:, None]
+        count, mean, m2 = _merge_moments(state['count'], np.array([state['mean']]), np.array([[state['m2']]]), returns)
+        self.tickers[ticker] = {
+            'count': int(count), 'mean': float(mean[0]), 'm2': float(m2[0, 0]),
+            'last_date': group['date'].iloc[-1].isoformat(), 'last_price': float(new_prices[-1])
+        }
+
+    def _update_joint(self, prices: pd.DataFrame) -> None:
+        joint = self.joint
+        prices = prices[prices['ticker'].isin(joint['tickers'])]
+        if joint['last_date'] is not None:
+            prices = prices[prices['date'] > pd.Timestamp(joint['last_date'])]
+        prices = prices.drop_duplicates(subset=['ticker', 'date'], keep='first')
+        # only dates where every tracked ticker traded, same as the in-memory estimate
+        aligned = prices.pivot(index='date', columns='ticker', values='adj_close').sort_index()
+        aligned = aligned.reindex(columns=joint['tickers']).dropna()
+        if aligned.empty:
+            return
+        new_prices = aligned.to_numpy(dtype=float)
+        if joint['last_prices'] is not None:
+            new_prices = np.vstack([joint['last_prices'], new_prices])
+
+        returns = np.log(new_prices[1:] / new_prices[:-1])
+        count, mean, comoment = _merge_moments(joint['count'], np.array(joint['mean']), np.array(joint['comoment']), returns)
+        joint.update(
+            count=int(count), mean=mean.tolist(), comoment=comoment.tolist(),
+            last_date=aligned.index[-1].isoformat(), last_prices=new_prices[-1].tolist()
+        )
+
+    def ticker_params(self, tickers: list[str]) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """
+        Mean and (population) standard deviation of daily log returns per ticker.
+        Tickers without at least one return are skipped.
+
+        Returns:
+            (simulated tickers, mean daily log return per ticker, std of daily log return per ticker)
+        """
+        sim_tickers = [ticker for ticker in tickers if self.tickers.get(ticker, {}).get('count', 0) > 0]
+        states = [self.tickers[ticker] for ticker in sim_tickers]
+        means = np.array([state['mean'] for state in states])
+        stds = np.sqrt(np.array([state['m2'] / state['count'] for state in states]))
+        return sim_tickers, means, stds
+
+    def portfolio_params(self, tickers: list[str]) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """
+        Mean vector and (population) covariance of daily log returns on the shared dates.
+        The tickers have to be exactly the tracked joint set, since the shared dates depend
+        on which tickers are included.
+
+        Returns:
+            (simulated tickers, mean daily log return per ticker, covariance matrix)
+        """
+        sim_tickers = list(dict.fromkeys(tickers))
+        if not sim_tickers:
+            return [], np.array([]), np.empty((0, 0))
+        if self.joint is None or sorted(sim_tickers) != self.joint['tickers']:
+            raise ValueError(f"Joint return statistics are not tracked for {sim_tickers}; update the store with joint_tickers first")
+        if self.joint['count'] < 2:
+            raise ValueError("Not enough overlapping price history to estimate the return covariance")
+
+        order = [self.joint['tickers'].index(ticker) for ticker in sim_tickers]
+        mean = np.array(self.joint['mean'])[order]
+        cov = np.array(self.joint['comoment'])[np.ix_(order, order)] / self.joint['count']
+        return sim_tickers, mean, cov
+
+    def covered_until(self, tickers: list[str], portfolio: bool = False) -> pd.Timestamp:
+        """
+        Last date up to which the statistics of every ticker are complete, i.e. the earliest
+        date an update still needs rows after. None if a ticker (or, in portfolio mode, the
+        joint set) is not tracked yet and the full history is needed.
+        """
+        states = [self.tickers.get(ticker) for ticker in tickers]
+        if not states or any(state is None for state in states):
+            return None
+        last_dates = [pd.Timestamp(state['last_date']) for state in states]
+        if portfolio:
+            if self.joint is None or self.joint['tickers'] != sorted(set(tickers)) or self.joint['last_date'] is None:
+                return None
+            last_dates.append(pd.Timestamp(self.joint['last_date']))
+        return min(last_dates)
+
+    def fingerprint(self, tickers: list[str]) -> str:
+        """Hash of the statistics the given tickers would be simulated with (for result caching)."""
+        state = {
+            'tickers': {ticker: self.tickers.get(ticker) for ticker in tickers},
+            'joint': self.joint
+        }
+        return hashlib.sha256(json.dumps(state, sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,95 @@
+"""
+Canonical column layout and dtypes of the pipeline's frames.
+
+Every stage hands the same compact types along instead of object strings and Python
+date objects:
+- stock_data: categorical ticker (alphabetical categories), datetime64[s] date (pandas
+  has no day resolution, the time of day is always midnight), prices as float64 by
+  default or float32 to halve their memory, int64 volume
+- simulation: categorical ticker, int32 simulation_num/year, float32 values, uint8 probability
+"""
+
+import pandas as pd
+import numpy as np
+
+STOCK_DATA_COLUMNS = ['ticker', 'date', 'open', 'high', 'low', 'close', 'adj_close', 'volume']
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'adj_close']
+
+DATE_DTYPE = 'datetime64[s]'
+VOLUME_DTYPE = np.int64
+# float width of the price columns, pass float_dtype='float32' to the transforms for the lean version
+DEFAULT_PRICE_DTYPE = 'float64'
+PRICE_DTYPES = ['float64', 'float32']
+
+SIMULATION_COLUMNS = [
+    'simulation_num', 'ticker', 'year',
+    'starting_value', 'ending_value', 'annual_return',
+    'cumulative_return', 'volatility', 'probability'
+]
+
+# compact column types of simulation frames (ticker is a categorical with alphabetical categories)
+# float32 keeps ~7 significant digits, plenty for simulated dollar values and returns
+SIMULATION_DTYPES = {
+    'simulation_num': np.int32,
+    'year': np.int32,
+    'starting_value': np.float32,
+    'ending_value': np.float32,
+    'annual_return': np.float32,
+    'cumulative_return': np.float32,
+    'volatility': np.float32,
+    'probability': np.uint8
+}
+
+
+def _price_dtype(float_dtype: str = None) -> str:
+    float_dtype = float_dtype or DEFAULT_PRICE_DTYPE
+    if float_dtype not in PRICE_DTYPES:
+        raise ValueError(f"Unsupported price float type: {float_dtype}. Supported types: {PRICE_DTYPES}")
+    return float_dtype
+
+
+def empty_stock_data(float_dtype: str = None) -> pd.DataFrame:
+    """Empty stock_data frame with the canonical columns and dtypes."""
+    price_dtype = _price_dtype(float_dtype)
+    return pd.DataFrame({
+        'ticker': pd.Categorical([]),
+        'date': np.array([], dtype=DATE_DTYPE),
+        **{col: np.array([], dtype=price_dtype) for col in PRICE_COLUMNS},
+        'volume': np.array([], dtype=VOLUME_DTYPE)
+    })
+
+
+def empty_simulation_data() -> pd.DataFrame:
+    """Empty simulation frame with the canonical columns and dtypes."""
+    return pd.DataFrame({
+        col: pd.Categorical([]) if col == 'ticker' else np.array([], dtype=SIMULATION_DTYPES[col])
+        for col in SIMULATION_COLUMNS
+    })
+
+
+def enforce_stock_data_schema(df: pd.DataFrame, float_dtype: str = None) -> pd.DataFrame:
+    """
+    Cast a stock_data frame to the canonical dtypes, in place where the dtype is already right.
+
+    Args:
+        df: stock_data frame; tickers are expected to be upper case already and columns
+            that are missing are left alone
+        float_dtype: 'float64' (default) or 'float32' for the price columns
+
+    Returns:
+        The same frame with its columns converted
+    """
+    price_dtype = _price_dtype(float_dtype)
+    if 'ticker' in df.columns:
+        if not isinstance(df['ticker'].dtype, pd.CategoricalDtype):
+            df['ticker'] = df['ticker'].astype('category')
+        elif not df['ticker'].cat.categories.is_monotonic_increasing:
+            df['ticker'] = df['ticker'].cat.reorder_categories(sorted(df['ticker'].cat.categories))
+    if 'date' in df.columns and df['date'].dtype != DATE_DTYPE:
+        df['date'] = pd.to_datetime(df['date']).astype(DATE_DTYPE)
+    for col in PRICE_COLUMNS:
+        if col in df.columns and df[col].dtype != price_dtype:
+            df[col] = df[col].astype(price_dtype)
+    if 'volume' in df.columns and df['volume'].dtype != VOLUME_DTYPE:
+        df['volume'] = df['volume'].astype(VOLUME_DTYPE)
+    return df
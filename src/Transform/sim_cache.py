@@ -0,0 +1,105 @@
+"""
+Disk cache for Monte Carlo results.
+
+A simulation is fully determined by the return history of its tickers and its parameters
+(including the seed), so a rerun with unchanged inputs can read the previous result back
+instead of simulating again. Results are stored as one parquet file per key; when the
+cache grows past `max_bytes` the least recently used files are deleted.
+"""
+
+import hashlib
+import json
+import os
+import pandas as pd
+import numpy as np
+
+# bump this when the simulation engine changes its output for the same inputs
+CACHE_VERSION = 2 # 2: typed columns (float32/int32/uint8, categorical ticker) in ticker-major order
+
+DEFAULT_CACHE_DIR = '.sim_cache'
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+
+def simulation_cache_key(df: pd.DataFrame, tickers: list[str], params: dict) -> str:
+    """
+    Fingerprint of a simulation: the daily log return series of every requested ticker plus
+    the simulation parameters.
+
+    Args:
+        df: Price history with 'ticker', 'date' and 'adj_close' columns, or None when the
+            return statistics come from somewhere else (then they have to be part of `params`)
+        tickers: Tickers that will be simulated
+        params: Every parameter that changes the result (years, seed, sampling, ...)
+
+    Returns:
+        Hex digest used as the cache file name
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps({'version': CACHE_VERSION, **params}, sort_keys=True, default=str).encode())
+
+    for ticker in tickers:
+        digest.update(ticker.encode() + b'\0')
+    if df is None:
+        return digest.hexdigest()
+
+    history = df[df['ticker'].isin(tickers)].sort_values(['ticker', 'date'])
+    groups = dict(list(history.groupby('ticker', sort=False)))
+    for ticker in tickers:
+        group = groups.get(ticker)
+        if group is None:
+            continue
+        # the dates matter too, portfolio mode aligns the tickers on them
+        dates = pd.to_datetime(group['date']).to_numpy(dtype='datetime64[ns]')
+        log_returns = np.diff(np.log(group['adj_close'].to_numpy(dtype=float)))
+        digest.update(ticker.encode() + b'\0')
+        digest.update(dates.tobytes())
+        digest.update(log_returns.tobytes())
+    return digest.hexdigest()
+
+
+class SimulationCache:
+    """
+    Parquet files of simulation results in `cache_dir`, evicted least recently used first
+    once they take more than `max_bytes`. A file's modification time is its last use.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f'{key}.parquet')
+
+    def get(self, key: str) -> pd.DataFrame:
+        """Return the cached result for `key`, or None if there is none."""
+        path = self._path(key)
+        try:
+            result = pd.read_parquet(path)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)  # mark as recently used
+        return result
+
+    def put(self, key: str, result: pd.DataFrame) -> None:
+        """Store a result and evict old entries if the cache is over its size limit."""
+        path = self._path(key)
+        # write to a temporary file first so a crash never leaves a half written entry
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        result.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.parquet'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
@@ -0,0 +1,143 @@
+"""
+Streaming statistics for Monte Carlo results.
+
+Instead of keeping every simulated row, these classes keep a fixed amount of state per
+(ticker, year) cell that can be updated block by block and merged across shards:
+- count, mean and variance of the ending value (Welford / Chan parallel update)
+- a quantile sketch of the ending value with bounded relative error
+- the number of paths that ended above / below the starting value
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Union
+
+SUMMARY_COLUMNS = [
+    'ticker', 'year', 'num_paths',
+    'mean_ending_value', 'std_ending_value',
+    'p5_ending_value', 'p25_ending_value', 'p50_ending_value',
+    'p75_ending_value', 'p95_ending_value',
+    'probability_of_gain', 'probability_of_loss'
+]
+
+SUMMARY_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch for positive values with relative accuracy `alpha`.
+
+    Values are counted in logarithmic buckets (the DDSketch layout,
+    https://arxiv.org/abs/1908.10693), so any quantile estimate is within `alpha`
+    relative error of a value from the data. One sketch holds `n_cells` independent
+    histograms so a whole (tickers x years) grid is updated with a single bincount.
+    Two sketches with the same parameters are merged by adding their counts.
+    """
+
+    def __init__(self, n_cells: int, alpha: float = 0.01, min_value: float = 1e-6, max_value: float = 1e12):
+        self.alpha = alpha
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = np.log(self.gamma)
+        self._min_index = int(np.ceil(np.log(min_value) / self._log_gamma))
+        n_buckets = int(np.ceil(np.log(max_value) / self._log_gamma)) - self._min_index + 1
+        self.counts = np.zeros((n_cells, n_buckets), dtype=np.int64)
+
+    def update(self, values: np.ndarray) -> None:
+        """
+        Add a block of values with shape (n, n_cells); column j goes to cell j.
+        Values outside [min_value, max_value] are clamped into the edge buckets.
+        """
+        n_cells, n_buckets = self.counts.shape
+        values = np.clip(np.asarray(values, dtype=float).reshape(-1, n_cells), self.min_value, self.max_value)
+        buckets = np.ceil(np.log(values) / self._log_gamma).astype(np.int64) - self._min_index
+        np.clip(buckets, 0, n_buckets - 1, out=buckets)
+        flat_index = buckets + np.arange(n_cells) * n_buckets
+        self.counts += np.bincount(flat_index.ravel(), minlength=n_cells * n_buckets).reshape(n_cells, n_buckets)
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """Add the counts of a sketch built with the same parameters."""
+        if self.counts.shape != other.counts.shape or self.alpha != other.alpha or self.min_value != other.min_value:
+            raise ValueError("Can only merge quantile sketches built with the same parameters")
+        self.counts += other.counts
+
+    def quantile(self, q: float) -> np.ndarray:
+        """Estimate quantile `q` (0..1) for every cell; NaN for empty cells."""
+        cumulative = np.cumsum(self.counts, axis=1)
+        totals = cumulative[:, -1]
+        rank = q * (totals - 1)
+        # first bucket whose cumulative count passes the rank
+        bucket = (cumulative <= rank[:, None]).sum(axis=1)
+        index = bucket + self._min_index
+        estimate = 2 * self.gamma ** index / (self.gamma + 1)
+        return np.where(totals > 0, estimate, np.nan)
+
+
+class SimulationSummary:
+    """
+    Running per-(ticker, year) statistics of simulated ending values.
+
+    Built from (n_sims, tickers, years) blocks as they are simulated; summaries from
+    different shards are combined with merge() and turned into a table with to_frame().
+    """
+
+    def __init__(self, tickers: list[str], years: int, alpha: float = 0.01):
+        self.tickers = list(tickers)
+        self.years = years
+        n_cells = len(self.tickers) * years
+        self.count = np.zeros(n_cells, dtype=np.int64)
+        self.mean = np.zeros(n_cells)
+        self.m2 = np.zeros(n_cells)
+        self.gains = np.zeros(n_cells, dtype=np.int64)
+        self.losses = np.zeros(n_cells, dtype=np.int64)
+        self.sketch = QuantileSketch(n_cells, alpha=alpha)
+
+    def _merge_moments(self, count: np.ndarray, mean: np.ndarray, m2: np.ndarray) -> None:
+        # Chan et al. parallel variance update, https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm
+        total = self.count + count
+        safe_total = np.maximum(total, 1)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / safe_total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / safe_total
+        self.count = total
+
+    def update(self, ending_value: np.ndarray, initial_value: Union[float, np.ndarray]) -> None:
+        """
+        Add a (n_sims, tickers, years) block of ending values.
+        `initial_value` is the starting value of every path, or one starting value per ticker.
+        """
+        n_sims = ending_value.shape[0]
+        values = ending_value.reshape(n_sims, -1)
+        initial_value = np.repeat(np.broadcast_to(initial_value, len(self.tickers)), self.years)
+        block_mean = values.mean(axis=0)
+        block_m2 = ((values - block_mean) ** 2).sum(axis=0)
+        self._merge_moments(np.full(values.shape[1], n_sims, dtype=np.int64), block_mean, block_m2)
+        self.gains += (values > initial_value).sum(axis=0)
+        self.losses += (values < initial_value).sum(axis=0)
+        self.sketch.update(values)
+
+    def merge(self, other: 'SimulationSummary') -> None:
+        """Combine with the summary of another shard over the same tickers and years."""
+        if self.tickers != other.tickers or self.years != other.years:
+            raise ValueError("Can only merge summaries over the same tickers and years")
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.gains += other.gains
+        self.losses += other.losses
+        self.sketch.merge(other.sketch)
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per (ticker, year) with the columns in SUMMARY_COLUMNS."""
+        paths = np.maximum(self.count, 1)
+        frame = {
+            'ticker': np.repeat(np.asarray(self.tickers, dtype=object), self.years),
+            'year': np.tile(np.arange(1, self.years + 1), len(self.tickers)),
+            'num_paths': self.count,
+            'mean_ending_value': self.mean,
+            'std_ending_value': np.sqrt(self.m2 / paths),
+        }
+        for q in SUMMARY_QUANTILES:
+            frame[f'p{round(q * 100)}_ending_value'] = self.sketch.quantile(q)
+        frame['probability_of_gain'] = self.gains / paths
+        frame['probability_of_loss'] = self.losses / paths
+        return pd.DataFrame(frame, columns=SUMMARY_COLUMNS)
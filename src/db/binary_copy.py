@@ -0,0 +1,307 @@
+"""
+PostgreSQL binary COPY encoding of stock_data and simulation frames.
+
+A binary COPY stream is a signature, one record per row (int16 field count, then an
+int32 byte length and the big-endian value for every field) and an int16 -1 trailer:
+https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+
+Every field used here has a fixed width, so a whole block of rows is laid out as one
+numpy structured array and turned into bytes in a single call, without building a
+Python object per row or per value. NUMERIC values are written with a fixed number of
+base-10000 digit groups (encode_numeric_column) and the tickers as text, one fixed width
+field per run of rows with the same ticker, so rows can be copied straight into their
+table. Upserts still go through a staging table (see insertion.py), which takes float8
+values and the int2 category code of the ticker, looked up on the server.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Iterator
+
+COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00' + b'\x00\x00\x00\x00' + b'\x00\x00\x00\x00' # signature, flags, header extension length
+COPY_TRAILER = b'\xff\xff'
+
+# PostgreSQL epoch, binary dates are days since 2000-01-01
+PG_EPOCH = np.datetime64('2000-01-01', 'D')
+
+# staging column -> (frame column, big-endian wire type); float32 values are widened to float8
+# since the server's float4 -> numeric cast only keeps 6 significant digits
+STOCK_DATA_STAGE = {
+    'ticker_code': ('ticker', '>i2'),
+    'date': ('date', '>i4'),
+    'open': ('open', '>f8'),
+    'high': ('high', '>f8'),
+    'low': ('low', '>f8'),
+    'close': ('close', '>f8'),
+    'adj_close': ('adj_close', '>f8'),
+    'volume': ('volume', '>i8')
+}
+
+# wire types of the binary NUMERIC format and of the ticker text, see encode_numeric_column / encode_text_column
+NUMERIC = 'numeric'
+TEXT = 'text'
+
+# table column -> wire type for COPY straight into the table (the frame columns have the same names)
+STOCK_DATA_COPY = {
+    'ticker': TEXT,
+    'date': '>i4',
+    'open': NUMERIC,
+    'high': NUMERIC,
+    'low': NUMERIC,
+    'close': NUMERIC,
+    'adj_close': NUMERIC,
+    'volume': '>i8'
+}
+
+SIMULATION_COPY = {
+    'simulation_num': '>i4',
+    'ticker': TEXT,
+    'year': '>i4',
+    'starting_value': NUMERIC,
+    'ending_value': NUMERIC,
+    'annual_return': NUMERIC,
+    'cumulative_return': NUMERIC,
+    'volatility': NUMERIC,
+    'probability': NUMERIC
+}
+
+# SQL type of every wire type for the staging tables
+SQL_TYPES = {'>i2': 'smallint', '>i4': 'integer', '>i8': 'bigint', '>f8': 'double precision'}
+
+# staging columns that aren't plain numbers: the int32 days since 2000-01-01 already are the binary
+# date format, and there is no integer -> date cast for the move into stock_data
+STAGE_SQL_TYPES = {'date': 'date'}
+
+DEFAULT_BLOCK_ROWS = 100_000
+
+
+def encode_binary_rows(columns: list[tuple[np.ndarray, str]]) -> bytes:
+    """
+    Binary COPY records (without signature and trailer) of equally long columns.
+
+    Args:
+        columns: (values, big-endian numpy type such as '>f8') per field, in table order
+
+    Returns:
+        The records of all rows
+    """
+    n_rows = len(columns[0][0]) if columns else 0
+    layout = [('n_fields', '>i2')]
+    for i, (_, wire_type) in enumerate(columns):
+        layout += [(f'length_{i}', '>i4'), (f'value_{i}', wire_type)]
+    records = np.empty(n_rows, dtype=np.dtype(layout)) # packed, no padding between fields
+    records['n_fields'] = len(columns)
+    for i, (values, wire_type) in enumerate(columns):
+        records[f'length_{i}'] = np.dtype(wire_type).itemsize
+        records[f'value_{i}'] = values
+    return records.tobytes()
+
+
+def _column_values(df: pd.DataFrame, column: str) -> np.ndarray:
+    values = df[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        if values.cat.codes.min() < 0:
+            raise ValueError(f"Column {column} has missing values, which can't be loaded")
+        return values.cat.codes.to_numpy()
+    if column == 'date':
+        return (values.to_numpy().astype('datetime64[D]') - PG_EPOCH).astype(np.int32)
+    return values.to_numpy()
+
+
+def encode_frame(df: pd.DataFrame, stage: dict[str, tuple[str, str]]) -> bytes:
+    """
+    Binary COPY records of a canonical stock_data or simulation frame.
+
+    Args:
+        df: Frame with the canonical dtypes (categorical ticker, see schema.py)
+        stage: STOCK_DATA_STAGE
+
+    Returns:
+        The records in staging column order (without signature and trailer)
+    """
+    return encode_binary_rows([(_column_values(df, column), wire_type) for column, wire_type in stage.values()])
+
+
+def encode_table_rows(df: pd.DataFrame, columns: dict[str, str]) -> bytes:
+    """
+    Binary COPY records of a canonical stock_data or simulation frame in the column types
+    of the table itself, so they can be copied into it without a staging table or casts.
+
+    Args:
+        df: Frame with the canonical dtypes (categorical ticker, see schema.py)
+        columns: STOCK_DATA_COPY or SIMULATION_COPY
+
+    Returns:
+        The records in column order (without signature and trailer)
+    """
+    categories = ticker_categories(df)
+    codes = _column_values(df, 'ticker')
+    fields = {
+        column: encode_numeric_column(df[column].to_numpy()) if wire_type == NUMERIC else (_column_values(df, column), wire_type)
+        for column, wire_type in columns.items() if wire_type != TEXT
+    }
+    records = []
+    for start, stop in ticker_groups(codes):
+        records.append(encode_binary_rows([
+            encode_text_column(categories[codes[start]], stop - start) if wire_type == TEXT else (fields[column][0][start:stop], fields[column][1])
+            for column, wire_type in columns.items()
+        ]))
+    return b''.join(records)
+
+
+def ticker_groups(codes: np.ndarray) -> list[tuple[int, int]]:
+    """(start, stop) of every run of consecutive rows with the same ticker code."""
+    boundaries = [0, *(np.flatnonzero(np.diff(codes)) + 1), len(codes)]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def ticker_categories(df: pd.DataFrame) -> list[str]:
+    """Ticker of every category code, the lookup list for the encoded ticker_code column."""
+    if not isinstance(df['ticker'].dtype, pd.CategoricalDtype):
+        raise ValueError("The ticker column has to be categorical, see schema.py")
+    return [str(ticker) for ticker in df['ticker'].cat.categories]
+
+
+def staging_table_sql(name: str, stage: dict[str, tuple[str, str]]) -> str:
+    """CREATE statement of a temporary staging table for binary COPY, dropped at commit."""
+    columns = ', '.join(f'{column} {STAGE_SQL_TYPES.get(column, SQL_TYPES[wire_type])}' for column, (_, wire_type) in stage.items())
+    return f"CREATE TEMP TABLE {name} ({columns}) ON COMMIT DROP;"
+
+
+def iter_blocks(df: pd.DataFrame, block_rows: int = DEFAULT_BLOCK_ROWS) -> Iterator[pd.DataFrame]:
+    """Slices of at most block_rows rows (views, nothing is copied)."""
+    if block_rows < 1:
+        raise ValueError("block_rows must be at least 1")
+    for start in range(0, len(df), block_rows):
+        yield df.iloc[start:start + block_rows]
+
+
+# element type oids written in the binary array header
+# https://github.com/postgres/postgres/blob/master/src/include/catalog/pg_type.dat
+ARRAY_ELEMENT_OIDS = {'>f4': 700, '>f8': 701, '>i2': 21, '>i4': 23, '>i8': 20, '?': 16}
+
+
+def array_wire_type(element_type: str, length: int) -> np.dtype:
+    """
+    Binary layout of a one dimensional array of `length` elements without NULLs: a header
+    (dimensions, NULL flag, element type, then length and lower bound of the dimension)
+    followed by a byte length and value per element. With a fixed length it has a fixed
+    width, so arrays can be encoded as a field of encode_binary_rows too.
+    """
+    return np.dtype([
+        ('ndim', '>i4'), ('has_nulls', '>i4'), ('element_oid', '>i4'), ('length', '>i4'), ('lower_bound', '>i4'),
+        ('elements', [('size', '>i4'), ('value', element_type)], (length,))
+    ])
+
+
+def encode_array_column(values: np.ndarray, element_type: str) -> tuple[np.ndarray, np.dtype]:
+    """
+    One binary array field per row of a 2D array.
+
+    Args:
+        values: (rows, length) array
+        element_type: Big-endian numpy type of the elements, a key of ARRAY_ELEMENT_OIDS
+
+    Returns:
+        (fields, wire type) to pass to encode_binary_rows
+    """
+    n_rows, length = values.shape
+    wire_type = array_wire_type(element_type, length)
+    fields = np.empty(n_rows, dtype=wire_type)
+    fields['ndim'] = 1
+    fields['has_nulls'] = 0
+    fields['element_oid'] = ARRAY_ELEMENT_OIDS[element_type]
+    fields['length'] = length
+    fields['lower_bound'] = 1
+    fields['elements']['size'] = np.dtype(element_type).itemsize
+    fields['elements']['value'] = values
+    return fields, wire_type
+
+
+def encode_text_column(value: str, n_rows: int) -> tuple[np.ndarray, np.dtype]:
+    """The same text in every row (e.g. the ticker of a ticker group) as a fixed width field."""
+    encoded = value.encode()
+    wire_type = np.dtype(f'S{len(encoded)}')
+    return np.full(n_rows, encoded, dtype=wire_type), wire_type
+
+
+# NUMERIC sign field values, https://github.com/postgres/postgres/blob/master/src/backend/utils/adt/numeric.c
+NUMERIC_POS = 0x0000
+NUMERIC_NEG = 0x4000
+NUMERIC_NAN = 0xC000
+NUMERIC_PINF = 0xD000
+NUMERIC_NINF = 0xF000
+
+# significant decimal digits kept, as many as the server's float8 -> numeric cast keeps (DBL_DIG)
+NUMERIC_SIGNIFICANT_DIGITS = 15
+# base-10000 digit groups, enough for the significant digits shifted onto a group boundary
+NUMERIC_GROUPS = 5
+
+# binary NUMERIC: digit count, weight (base-10000 exponent of the first group), sign, display
+# scale and the groups; the server strips leading and trailing zero groups on receipt
+NUMERIC_WIRE_TYPE = np.dtype([
+    ('ndigits', '>i2'), ('weight', '>i2'), ('sign', '>u2'), ('dscale', '>i2'), ('digits', '>i2', (NUMERIC_GROUPS,))
+])
+
+
+# 10**power for every decimal exponent a double can need, in extended precision where the platform
+# has it (x86), so scaled values are rounded to the 15th digit the way the server's cast does
+_POWERS_OF_TEN_OFFSET = 350
+_POWERS_OF_TEN = np.power(np.longdouble(10), np.arange(-_POWERS_OF_TEN_OFFSET, _POWERS_OF_TEN_OFFSET))
+
+
+def _scale_by_power_of_ten(values: np.ndarray, powers: np.ndarray) -> np.ndarray:
+    return np.rint(values * _POWERS_OF_TEN[powers + _POWERS_OF_TEN_OFFSET])
+
+
+def encode_numeric_column(values: np.ndarray) -> tuple[np.ndarray, np.dtype]:
+    """
+    One binary NUMERIC field per value, rounded to 15 significant digits like the server's
+    float8 -> numeric cast; NUMERIC(p, s) columns round them to their scale on receipt.
+
+    Args:
+        values: Numbers of any numeric dtype (NaN and infinities included)
+
+    Returns:
+        (fields, wire type) to pass to encode_binary_rows
+    """
+    values = np.asarray(values, dtype=np.float64)
+    finite = np.isfinite(values)
+    magnitude = np.where(finite, np.abs(values), 0.0)
+    nonzero = magnitude > 0
+
+    # decimal exponent of the leading digit; log10 can be off by one next to a power of ten and
+    # rounding can carry into one digit more, both are corrected by rescaling those values
+    top = NUMERIC_SIGNIFICANT_DIGITS - 1
+    exponent = np.zeros(len(values), dtype=np.int64)
+    exponent[nonzero] = np.floor(np.log10(magnitude[nonzero]))
+    mantissa = _scale_by_power_of_ten(magnitude, top - exponent)
+    for step in (-1, 1):
+        off = nonzero & (mantissa < 10.0**top) if step < 0 else mantissa >= 10.0**(top + 1)
+        exponent[off] += step
+        mantissa[off] = _scale_by_power_of_ten(magnitude[off], top - exponent[off])
+
+    # shift the digits onto a base-10000 group boundary
+    lowest = exponent - top
+    group_lowest = lowest // 4
+    mantissa = mantissa.astype(np.int64) * np.power(10, lowest - 4 * group_lowest)
+
+    fields = np.empty(len(values), dtype=NUMERIC_WIRE_TYPE)
+    fields['ndigits'] = NUMERIC_GROUPS
+    weight = group_lowest + NUMERIC_GROUPS - 1
+    fields['weight'] = np.where(finite, weight, 0)
+    fields['sign'] = np.select(
+        [np.isnan(values), values == np.inf, values == -np.inf, values < 0],
+        [NUMERIC_NAN, NUMERIC_PINF, NUMERIC_NINF, NUMERIC_NEG], NUMERIC_POS
+    )
+    digits = np.empty((len(values), NUMERIC_GROUPS), dtype=np.int64)
+    for i in range(NUMERIC_GROUPS):
+        digits[:, i] = mantissa // 10000**(NUMERIC_GROUPS - 1 - i) % 10000
+    fields['digits'] = digits
+
+    # display scale of the cast: the decimals up to the last non zero digit
+    last = NUMERIC_GROUPS - 1 - np.argmax(digits[:, ::-1] != 0, axis=1)
+    last_group = digits[np.arange(len(values)), last]
+    trailing_zeros = (last_group % 10 == 0).astype(np.int64) + (last_group % 100 == 0) + (last_group % 1000 == 0)
+    fields['dscale'] = np.where(nonzero, np.maximum(-(4 * (weight - last) + trailing_zeros), 0), 0)
+    return fields, NUMERIC_WIRE_TYPE
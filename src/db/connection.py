@@ -1,29 +1,84 @@
 import psycopg #https://www.psycopg.org/psycopg3/docs/basic/usage.html
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import ConnectionPool, PoolTimeout #https://www.psycopg.org/psycopg3/docs/advanced/pool.html
 """
 TODO:
 - error handling
     -> timeout handling
 """
 
-def psql_connect_and_setup(db_host_addr: str, db_port: str, db_name: str, db_user: str, db_password: str, db_timeout: int) -> None: #cool thing to look into is how to make use of the *args and **kwargs in python functions
+DEFAULT_POOL_MIN_SIZE = 1
+DEFAULT_POOL_MAX_SIZE = 4
+
+
+def db_conninfo(db_credentials: dict[str], dbname: str = None) -> str:
     """
-    Connects to PostgreSQL database using credentials from config.
-    Creates the database and necessary tables if they do not exist.
+    Connection string of the credentials in config.db_credentials (`dbname` overrides the database).
+    make_conninfo quotes the values, so empty or spaced passwords work too.
     """
+    #for refrence on the param kwargs: https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-PARAMKEYWORDS
+    return make_conninfo(
+        hostaddr=db_credentials['host'],
+        port=db_credentials['port'],
+        dbname=dbname or db_credentials['database'],
+        user=db_credentials['user'],
+        password=db_credentials['password'],
+        connect_timeout=db_credentials['timeout']
+    )
+
+def create_database(db_credentials: dict[str]) -> None:
+    """Create the database by connecting to the default 'postgres' database."""
+    with psycopg.connect(db_conninfo(db_credentials, dbname='postgres'), autocommit=True) as conn: #autocommit since CREATE DATABASE can't run inside a transaction
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE DATABASE {db_credentials['database']};")
+
+def open_pool(db_credentials: dict[str], min_size: int = None, max_size: int = None) -> ConnectionPool:
+    """
+    Open the shared connection pool of the pipeline, built once from config.db_credentials and
+    used by the setup, the loaders and the reads, so every stage reuses the same already
+    authenticated connections instead of opening its own.
+
+    Every connection is health checked when it is handed out (a broken one is replaced), and
+    the database is created first if it does not exist yet.
+
+    Args:
+        db_credentials: config.db_credentials, 'pool_min_size' / 'pool_max_size' in it set the pool size
+        min_size: Connections kept open, overrides the credentials
+        max_size: Most connections open at once, i.e. how many loaders can run concurrently
+
+    Returns:
+        The open pool; close it (or use it as a context manager) when the run is done
+    """
+    if min_size is None:
+        min_size = int(db_credentials.get('pool_min_size') or DEFAULT_POOL_MIN_SIZE)
+    if max_size is None:
+        max_size = max(int(db_credentials.get('pool_max_size') or DEFAULT_POOL_MAX_SIZE), min_size)
+    if min_size < 1 or max_size < min_size:
+        raise ValueError(f"Invalid pool size: min_size={min_size}, max_size={max_size}")
+    timeout = float(db_credentials['timeout'])
+
+    def connect() -> ConnectionPool:
+        pool = ConnectionPool(
+            db_conninfo(db_credentials), min_size=min_size, max_size=max_size, open=False,
+            check=ConnectionPool.check_connection, timeout=timeout, name=db_credentials['database']
+        )
+        pool.open(wait=True, timeout=timeout) #the first connections double as the probe that the database is there
+        return pool
 
     try:
-        psycopg.connect(f"hostaddr={db_host_addr} port={db_port} dbname={db_name} user={db_user} password={db_password} connect_timeout={db_timeout}").close()
-    except psycopg.DatabaseError:
-        #creates the database if it does not exist by connecting to the default 'postgres' database
-        with psycopg.connect(f"hostaddr={db_host_addr} port={db_port} dbname=postgres user={db_user} password={db_password} connect_timeout={db_timeout}") as conn:
-            conn.autocommit = True #this helps as it automatically commits each statement without needing to call conn.commit()!!!
-            with conn.cursor() as cur:
-                cur.execute(f"CREATE DATABASE {db_name};")
-    finally:
-        print(f'Connected to database {db_name} successfully!')
+        return connect()
+    except PoolTimeout:
+        #the database probably does not exist yet, if the server itself is unreachable this raises the real error
+        create_database(db_credentials)
+        print(f"Created database {db_credentials['database']}")
+        return connect()
 
-    #for refrence on the param kwargs: https://www.postgresql.org/docs/current/libpq-connect.html#LIBPQ-PARAMKEYWORDS
-    with psycopg.connect(f"hostaddr={db_host_addr} port={db_port} dbname={db_name} user={db_user} password={db_password} connect_timeout={db_timeout}") as conn:
+def psql_connect_and_setup(pool: ConnectionPool) -> None: #cool thing to look into is how to make use of the *args and **kwargs in python functions
+    """
+    Creates the necessary tables if they do not exist, on a connection of the shared pool
+    (open_pool has already created the database if it was missing).
+    """
+    with pool.connection() as conn:
         with conn.cursor() as cur:
             #create the stock_data table if it does not exist...
             # Data Model: stock_data table with all OHLCV data + adj_close
@@ -40,13 +95,40 @@ def psql_connect_and_setup(db_host_addr: str, db_port: str, db_name: str, db_use
                     volume BIGINT,
                     UNIQUE (ticker, date));
             """)
-            
-            
+
+
+            #one row per loaded simulation run, its rows live in the run's partition of the simulation table (src/db/runs.py)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS simulation_run (
+                    run_id BIGSERIAL PRIMARY KEY,
+                    created_at timestamptz NOT NULL DEFAULT now(),
+                    tickers text[] NOT NULL,
+                    failed_tickers text[] NOT NULL DEFAULT '{}',
+                    num_simulations integer,
+                    years integer,
+                    parameters jsonb,
+                    row_count bigint,
+                    attached boolean NOT NULL DEFAULT false,
+                    storage text NOT NULL DEFAULT 'rows');
+            """)
+            cur.execute("ALTER TABLE simulation_run ADD COLUMN IF NOT EXISTS storage text NOT NULL DEFAULT 'rows';") #run tables from before the path layout
+            cur.execute("ALTER TABLE simulation_run ADD COLUMN IF NOT EXISTS failed_tickers text[] NOT NULL DEFAULT '{}';")
+
+            #simulation tables from before the run partitioning can't be turned into a partitioned one, keep them under another name
+            cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('simulation');")
+            existing = cur.fetchone()
+            if existing is not None and existing[0] == 'r':
+                cur.execute("ALTER TABLE simulation RENAME TO simulation_unpartitioned;")
+                cur.execute("ALTER TABLE simulation_unpartitioned RENAME CONSTRAINT simulation_pkey TO simulation_unpartitioned_pkey;")
+                print("Renamed the old unpartitioned simulation table to simulation_unpartitioned")
+
             #create the simulation table if it does not exist....
-            # Data Model: simulation table with year instead of date
+            # Data Model: simulation table with year instead of date, LIST partitioned by run so a run is attached
+            # when it is loaded and dropped as a whole for retention (the primary key has to include the partition key)
             cur.execute("""
                 CREATE TABLE IF NOT EXISTS simulation (
-                    id BIGSERIAL PRIMARY KEY,
+                    id BIGSERIAL,
+                    run_id bigint NOT NULL,
                     simulation_num integer,
                     ticker varchar(10) NOT NULL,
                     year integer NOT NULL,
@@ -55,9 +137,61 @@ def psql_connect_and_setup(db_host_addr: str, db_port: str, db_name: str, db_use
                     annual_return NUMERIC,
                     cumulative_return NUMERIC,
                     volatility NUMERIC,
-                    probability NUMERIC(5, 4));
+                    probability NUMERIC(5, 4),
+                    PRIMARY KEY (run_id, id))
+                PARTITION BY LIST (run_id);
+            """)
+            #per ticker/year reads within a run: the run picks the partition, the index the rows in it
+            cur.execute("CREATE INDEX IF NOT EXISTS simulation_ticker_year_idx ON simulation (ticker, year);")
+
+            #create the simulation_paths table if it does not exist....
+            # Data Model: the compact layout of a run, one row per simulated path with the yearly values as arrays
+            # (year = array position) instead of one row of NUMERIC columns per year; see src/db/simulation_paths.py
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS simulation_paths (
+                    run_id bigint NOT NULL,
+                    ticker varchar(10) NOT NULL,
+                    simulation_num integer NOT NULL,
+                    starting_value real NOT NULL,
+                    ending_values real[] NOT NULL,
+                    annual_returns real[] NOT NULL,
+                    cumulative_returns real[] NOT NULL,
+                    volatilities real[] NOT NULL,
+                    gains boolean[] NOT NULL,
+                    PRIMARY KEY (run_id, ticker, simulation_num))
+                PARTITION BY LIST (run_id);
+            """)
+
+            #run tables used to be called <simulation table>_run_<run_id>, which looked like the simulation_run table
+            cur.execute(r"""
+                DO $$
+                DECLARE run_table record;
+                BEGIN
+                    FOR run_table IN SELECT relname FROM pg_class WHERE relkind = 'r' AND relname ~ '^simulation(_paths)?_run_[0-9]+$' LOOP
+                        EXECUTE format('ALTER TABLE %I RENAME TO %I', run_table.relname, regexp_replace(run_table.relname, '_run_([0-9]+)$', '_p\1'));
+                    END LOOP;
+                END $$;
+            """)
+
+            #create the simulation_summary table if it does not exist....
+            # Data Model: one row per (ticker, year) with the summary-only simulation statistics
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS simulation_summary (
+                    id BIGSERIAL PRIMARY KEY,
+                    ticker varchar(10) NOT NULL,
+                    year integer NOT NULL,
+                    num_paths integer NOT NULL,
+                    mean_ending_value NUMERIC(14, 2),
+                    std_ending_value NUMERIC(14, 2),
+                    p5_ending_value NUMERIC(14, 2),
+                    p25_ending_value NUMERIC(14, 2),
+                    p50_ending_value NUMERIC(14, 2),
+                    p75_ending_value NUMERIC(14, 2),
+                    p95_ending_value NUMERIC(14, 2),
+                    probability_of_gain NUMERIC(5, 4),
+                    probability_of_loss NUMERIC(5, 4));
             """)
 
             #lets put insertion query here then we can print it with the code below
             conn.commit()
-        
+    print('Database tables are ready!')
@@ -1,9 +1,11 @@
 import psycopg #https://www.psycopg.org/psycopg3/docs/basic/usage.html
+import pandas as pd
+from psycopg_pool import ConnectionPool
+from typing import Iterable, Union
+from src.db.runs import attach_run, create_run, partition_name
+from src.db.binary_copy import COPY_SIGNATURE, COPY_TRAILER, DEFAULT_BLOCK_ROWS, SIMULATION_COPY, STOCK_DATA_COPY, STOCK_DATA_STAGE, encode_frame, encode_table_rows, iter_blocks, staging_table_sql, ticker_categories
 """
 TODO:
-- implement threading or async to speed up the connection and insertion process
- -> threading in psycopg3 would usually be done with connection pool!
- -> might not be
 - error handling
     -> timeout handling
     -> ticker error handling
@@ -14,13 +16,32 @@ Processing is as follows:
 -> Transformed and simulated data is ready 
     -> check if db & tables ready
         -> if not create them
-    -> connect to the db
+    -> borrow a connection from the shared pool (src/db/connection.py open_pool)
     -> insert the data into the appropriate tables
 """
 
+# 'upsert' merges stock_data on (ticker, date) so reruns are safe, 'append' only inserts
+LOAD_MODES = ['upsert', 'append']
 
-def insert_stock_data(db_host_addr: str, db_port: str, db_name: str, db_user: str, db_password: str, db_timeout: int, data: list[dict[str]]) -> None:
-    with psycopg.connect(f"hostaddr={db_host_addr} port={db_port} dbname={db_name} user={db_user} password={db_password} connect_timeout={db_timeout}") as conn:
+
+def fetch_stock_watermarks(pool: ConnectionPool, tickers: list[str]) -> dict[str, pd.Timestamp]:
+    """
+    High-water mark of every ticker: the latest date already stored in stock_data.
+    Tickers with no rows yet are left out.
+
+    The (ticker, date) unique index answers max(date) per ticker without scanning the table.
+    """
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT ticker, max(date) FROM stock_data
+                WHERE ticker = ANY(%s)
+                GROUP BY ticker;
+            """, (list(tickers),))
+            return {ticker: pd.Timestamp(last_date) for ticker, last_date in cur.fetchall()}
+
+def insert_stock_data(pool: ConnectionPool, data: list[dict[str]]) -> None:
+    with pool.connection() as conn:
         with conn.cursor() as cur:
             cur.executemany("""
                 INSERT INTO stock_data (ticker, date, open, high, low, close, adj_close, volume)
@@ -28,8 +49,8 @@ def insert_stock_data(db_host_addr: str, db_port: str, db_name: str, db_user: st
             """, data) #data needs to be a list of tuples [('ticker', 'date', 'open', 'high', 'low', 'close', 'adj_close', 'volume'), (...), ...]
             conn.commit()
 
-def insert_sim_data(db_host_addr: str, db_port: str, db_name: str, db_user: str, db_password: str, db_timeout: int, data: list[dict[str]]) -> None:
-    with psycopg.connect(f"hostaddr={db_host_addr} port={db_port} dbname={db_name} user={db_user} password={db_password} connect_timeout={db_timeout}") as conn:
+def insert_sim_data(pool: ConnectionPool, data: list[dict[str]]) -> None:
+    with pool.connection() as conn:
         with conn.cursor() as cur:
             cur.executemany("""
                 INSERT INTO simulation (simulation_num, ticker, year, starting_value, ending_value, annual_return, cumulative_return, volatility, probability)
@@ -37,5 +58,151 @@ def insert_sim_data(db_host_addr: str, db_port: str, db_name: str, db_user: str,
             """, data)
             conn.commit()
 
+def insert_sim_summary(pool: ConnectionPool, data: list[tuple]) -> None:
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.executemany("""
+                INSERT INTO simulation_summary (ticker, year, num_paths, mean_ending_value, std_ending_value, p5_ending_value, p25_ending_value, p50_ending_value, p75_ending_value, p95_ending_value, probability_of_gain, probability_of_loss)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+            """, data) #data needs to be a list of tuples in the SUMMARY_COLUMNS order
+            conn.commit()
+
+def _move_staged_sql(table: str, stage: dict[str, tuple[str, str]], stage_table: str, conflict_columns: list[str]) -> str:
+    """
+    Statement merging a staged block into `table` in one set based upsert: the float8 values
+    are cast to the NUMERIC columns and the tickers are looked up from their category codes
+    (the ticker list is its only parameter).
+
+    New keys are inserted, existing ones are only updated when a value actually changed, and the
+    statement returns the (inserted, updated) counts. Rows are told apart by xmax, which is 0 for
+    a freshly inserted row and the updating transaction for an updated one.
+    https://www.postgresql.org/docs/current/sql-insert.html#SQL-ON-CONFLICT
+    """
+    target_columns = [column for column, _ in stage.values()]
+    select_columns = ', '.join('(%s::text[])[ticker_code + 1]' if name == 'ticker_code' else name for name in stage)
+    stage_names = {column: name for name, (column, _) in stage.items()}
+    staged_keys = ', '.join(stage_names[column] for column in conflict_columns)
+    value_columns = [column for column in target_columns if column not in conflict_columns]
+    return f"""
+        WITH merged AS (
+            INSERT INTO {table} ({', '.join(target_columns)})
+            SELECT DISTINCT ON ({staged_keys}) {select_columns} FROM {stage_table} ORDER BY {staged_keys}
+            ON CONFLICT ({', '.join(conflict_columns)}) DO UPDATE
+            SET {', '.join(f'{column} = EXCLUDED.{column}' for column in value_columns)}
+            WHERE ROW({', '.join(f'{table}.{column}' for column in value_columns)}) IS DISTINCT FROM ROW({', '.join(f'EXCLUDED.{column}' for column in value_columns)})
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged;
+    """
+
+def _copy_frames(cur: psycopg.Cursor, frames: Iterable[pd.DataFrame], table: str, columns: dict[str, str], block_rows: int) -> int:
+    """
+    Binary COPY the frames straight into `table`, block by block in one COPY. The rows are
+    encoded in the table's own column types (see encode_table_rows), so they are written once
+    and nothing is cast on the server.
+
+    Returns:
+        Number of rows copied
+    """
+    n_rows = 0
+    #https://www.psycopg.org/psycopg3/docs/basic/copy.html#binary-copy, blocks are already encoded so they are written as is
+    with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN (FORMAT BINARY)") as copy:
+        copy.write(COPY_SIGNATURE)
+        for frame in frames:
+            for block in iter_blocks(frame, block_rows):
+                copy.write(encode_table_rows(block, columns))
+                n_rows += len(block)
+        copy.write(COPY_TRAILER)
+    return n_rows
+
+def _upsert_frames(cur: psycopg.Cursor, frames: Iterable[pd.DataFrame], table: str, stage: dict[str, tuple[str, str]], block_rows: int, conflict_columns: list[str]) -> dict[str, int]:
+    """
+    Binary COPY the frames into a temporary staging table block by block and merge every
+    block into `table` with one set based statement (see _move_staged_sql). COPY can't
+    resolve conflicts itself, so this is only worth its second write of every row when rows
+    may already be there.
 
-            
\ No newline at end of file
+    Temporary tables are never written to the WAL (like UNLOGGED ones) and are private to
+    the connection, so concurrent loaders don't see each other's staged rows.
+
+    Returns:
+        {'inserted', 'updated', 'unchanged'} row counts
+    """
+    stage_table = f'{table}_stage'
+    move_sql = _move_staged_sql(table, stage, stage_table, conflict_columns)
+    cur.execute(staging_table_sql(stage_table, stage))
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    for frame in frames:
+        for block in iter_blocks(frame, block_rows):
+            if block.empty:
+                continue
+            #https://www.psycopg.org/psycopg3/docs/basic/copy.html#binary-copy, the block is already encoded so it is written as is
+            with cur.copy(f"COPY {stage_table} FROM STDIN (FORMAT BINARY)") as copy:
+                copy.write(COPY_SIGNATURE)
+                copy.write(encode_frame(block, stage))
+                copy.write(COPY_TRAILER)
+            cur.execute(move_sql, (ticker_categories(block),))
+            inserted, updated = cur.fetchone()
+            counts['inserted'] += inserted
+            counts['updated'] += updated
+            counts['unchanged'] += len(block) - inserted - updated
+            cur.execute(f"TRUNCATE {stage_table};")
+    return counts
+
+def copy_stock_data(pool: ConnectionPool, data: pd.DataFrame, block_rows: int = DEFAULT_BLOCK_ROWS, mode: str = 'upsert') -> dict[str, int]:
+    """
+    Bulk load a canonical stock_data frame with binary COPY instead of row by row INSERTs.
+
+    The frame is encoded straight from its columns `block_rows` rows at a time, no list
+    of row tuples is built. Everything is committed once at the end.
+
+    Args:
+        mode: 'upsert' merges on (ticker, date) through a staging table, so rows that are already
+            loaded are updated if their prices changed and skipped otherwise and reruns are safe;
+            'append' copies straight into stock_data and fails on the UNIQUE (ticker, date)
+            constraint if a row is already there
+
+    Returns:
+        {'inserted', 'updated', 'unchanged'} row counts
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown load mode: {mode}. Supported modes: {LOAD_MODES}")
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            if mode == 'upsert':
+                counts = _upsert_frames(cur, [data], 'stock_data', STOCK_DATA_STAGE, block_rows, conflict_columns=['ticker', 'date'])
+            else:
+                counts = {'inserted': _copy_frames(cur, [data], 'stock_data', STOCK_DATA_COPY, block_rows), 'updated': 0, 'unchanged': 0}
+        conn.commit()
+    return counts
+
+def copy_sim_data(pool: ConnectionPool, data: Union[pd.DataFrame, Iterable[pd.DataFrame]], tickers: list[str], parameters: dict = None, block_rows: int = DEFAULT_BLOCK_ROWS, failed_tickers: list[str] = None) -> dict[str, int]:
+    """
+    Bulk load the rows of one simulation run with binary COPY.
+
+    The run is recorded in simulation_run, its rows are copied straight into the run's own
+    new table (nothing to conflict with, so no staging table) and the table is attached as a
+    partition of simulation at the end (see src/db/runs.py), all in one transaction, so a
+    failed load leaves neither rows nor a run behind.
+
+    Args:
+        data: Canonical simulation frame, or an iterable of them (e.g. the streamed blocks of
+            iter_transform_monte_carlo_data); blocks are loaded as they are produced, so only one
+            is in memory at a time
+        tickers: Simulated tickers, stored with the run
+        parameters: Simulation parameters stored with the run (JSON serializable)
+        block_rows: Rows encoded and sent per COPY
+        failed_tickers: Requested tickers that could not be downloaded, stored with the run
+
+    Returns:
+        {'run_id', 'rows'}
+    """
+    frames = [data] if isinstance(data, pd.DataFrame) else data
+    parameters = parameters or {}
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            run_id = create_run(cur, tickers, parameters, failed_tickers=failed_tickers)
+            n_rows = _copy_frames(cur, frames, partition_name(run_id), SIMULATION_COPY, block_rows)
+            attach_run(cur, run_id, n_rows)
+        conn.commit()
+    return {'run_id': run_id, 'rows': n_rows}
@@ -0,0 +1,103 @@
+"""
+Simulation runs and their partitions.
+
+Every load of simulation rows is a run: a row in `simulation_run` (run_id, time, tickers and
+the simulation parameters) plus one partition of the `simulation` table, which is
+LIST partitioned by run_id (or of `simulation_paths` for runs stored one row per path, see
+simulation_paths.py). A run's rows are copied into a standalone table first and
+the table is attached as the partition once it is complete, so readers never see half a
+run and the (ticker, year) index is built once instead of being updated row by row.
+Retention detaches and drops whole partitions instead of DELETEing rows.
+https://www.postgresql.org/docs/current/ddl-partitioning.html
+"""
+
+import psycopg
+from psycopg.types.json import Jsonb
+from psycopg_pool import ConnectionPool
+
+# storage layout of a run -> its partitioned table
+SIMULATION_STORAGES = {'rows': 'simulation', 'paths': 'simulation_paths'}
+
+
+def _parent_table(storage: str) -> str:
+    if storage not in SIMULATION_STORAGES:
+        raise ValueError(f"Unknown simulation storage: {storage}. Supported layouts: {list(SIMULATION_STORAGES)}")
+    return SIMULATION_STORAGES[storage]
+
+def partition_name(run_id: int, storage: str = 'rows') -> str:
+    """Table holding the simulation rows of one run, e.g. simulation_p7 (not simulation_run_..., which reads like the metadata table)."""
+    return f'{_parent_table(storage)}_p{int(run_id)}'
+
+
+def create_run(cur: psycopg.Cursor, tickers: list[str], parameters: dict, storage: str = 'rows', failed_tickers: list[str] = None) -> int:
+    """
+    Record a new run and create the empty table for its rows. The table gets the run_id
+    as default, so the loader doesn't have to send it, and a CHECK constraint matching the
+    partition bound so attaching it skips the validation scan.
+
+    `failed_tickers` are the requested tickers whose download failed, so they are not in the run.
+
+    Returns:
+        The run_id
+    """
+    cur.execute("""
+        INSERT INTO simulation_run (tickers, failed_tickers, num_simulations, years, parameters, storage)
+        VALUES (%s, %s, %s, %s, %s, %s) RETURNING run_id;
+    """, (list(tickers), list(failed_tickers or []), parameters.get('num_simulations'), parameters.get('years'), Jsonb(parameters), storage))
+    run_id = cur.fetchone()[0]
+    table = partition_name(run_id, storage)
+    cur.execute(f"CREATE TABLE {table} (LIKE {_parent_table(storage)} INCLUDING DEFAULTS);")
+    cur.execute(f"ALTER TABLE {table} ALTER COLUMN run_id SET DEFAULT {int(run_id)};")
+    cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {table}_run CHECK (run_id = {int(run_id)});")
+    return run_id
+
+def attach_run(cur: psycopg.Cursor, run_id: int, row_count: int, storage: str = 'rows') -> None:
+    """Attach a loaded run table as its partition (this builds its indexes) and record its size."""
+    cur.execute(f"ALTER TABLE {_parent_table(storage)} ATTACH PARTITION {partition_name(run_id, storage)} FOR VALUES IN ({int(run_id)});")
+    cur.execute("UPDATE simulation_run SET row_count = %s, attached = true WHERE run_id = %s;", (row_count, run_id))
+
+def detach_run(pool: ConnectionPool, run_id: int, drop: bool = True) -> None:
+    """
+    Take a run out of its simulation table.
+
+    Args:
+        run_id: Run to remove
+        drop: Drop its rows and metadata; False only detaches the partition, which stays around
+            as the standalone table <simulation table>_p<run_id> (e.g. to archive it)
+    """
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT storage FROM simulation_run WHERE run_id = %s;", (run_id,))
+            found = cur.fetchone()
+            if found is None:
+                raise ValueError(f"Unknown simulation run: {run_id}")
+            storage = found[0]
+            table = partition_name(run_id, storage)
+            cur.execute(f"ALTER TABLE {_parent_table(storage)} DETACH PARTITION {table};")
+            if drop:
+                cur.execute(f"DROP TABLE {table};")
+                cur.execute("DELETE FROM simulation_run WHERE run_id = %s;", (run_id,))
+            else:
+                cur.execute("UPDATE simulation_run SET attached = false WHERE run_id = %s;", (run_id,))
+        conn.commit()
+
+def apply_retention(pool: ConnectionPool, keep_runs: int) -> list[int]:
+    """
+    Drop every attached run except the latest `keep_runs`.
+
+    Returns:
+        The dropped run_ids
+    """
+    if keep_runs < 1:
+        raise ValueError("keep_runs must be at least 1")
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT run_id FROM simulation_run
+                WHERE attached
+                ORDER BY run_id DESC OFFSET %s;
+            """, (keep_runs,))
+            old_runs = [run_id for (run_id,) in cur.fetchall()]
+    for run_id in old_runs:
+        detach_run(pool, run_id)
+    return old_runs
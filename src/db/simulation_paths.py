@@ -0,0 +1,211 @@
+"""
+Path layout of simulation results.
+
+The simulation table stores one row of NUMERIC columns per path and year, so every year
+of a path pays a tuple header, its own copy of the run, ticker and simulation number and
+the decoding of variable length NUMERICs. The `simulation_paths` table stores one row per
+(run, ticker, simulation_num) instead, with the yearly values as real[] arrays (year =
+array position) and the profit flags as boolean[]. The starting value of every year but
+the first is the ending value of the year before, so only the first one is kept.
+
+The values are stored exactly as the engine produces them (float32), without the
+rounding of the NUMERIC columns. paths_to_frame turns them back into the same frame
+transform_monte_carlo_data returns.
+"""
+
+import numpy as np
+import pandas as pd
+from psycopg_pool import ConnectionPool
+from typing import Iterable, Iterator, Union
+from src.Transform.schema import SIMULATION_COLUMNS, SIMULATION_DTYPES, empty_simulation_data
+from src.db.binary_copy import COPY_SIGNATURE, COPY_TRAILER, DEFAULT_BLOCK_ROWS, encode_array_column, encode_binary_rows, encode_text_column, ticker_groups
+from src.db.runs import attach_run, create_run, partition_name
+
+# array column -> (frame column, big-endian element type)
+PATH_ARRAYS = {
+    'ending_values': ('ending_value', '>f4'),
+    'annual_returns': ('annual_return', '>f4'),
+    'cumulative_returns': ('cumulative_return', '>f4'),
+    'volatilities': ('volatility', '>f4'),
+    'gains': ('probability', '?')
+}
+
+PATH_COLUMNS = ['ticker', 'simulation_num', 'starting_value', *PATH_ARRAYS]
+
+
+def _empty_paths(categories: list[str] = ()) -> dict[str, np.ndarray]:
+    paths = {
+        'ticker': pd.Categorical.from_codes(np.array([], dtype=np.int8), categories=list(categories)),
+        'simulation_num': np.array([], dtype=np.int32),
+        'starting_value': np.array([], dtype=np.float32)
+    }
+    for name, (_, element_type) in PATH_ARRAYS.items():
+        paths[name] = np.empty((0, 0), dtype=np.bool_ if element_type == '?' else np.float32)
+    return paths
+
+
+def frame_to_paths(df: pd.DataFrame) -> dict[str, np.ndarray]:
+    """
+    Reshape a simulation frame (transform_monte_carlo_data layout) into one entry per path.
+
+    Every path has to cover the same years 1..N and every year has to start at the ending
+    value of the year before, which holds for all frames of the simulation engine.
+
+    Returns:
+        {'ticker': categorical ticker per path, 'simulation_num', 'starting_value': first year's
+        starting value per path, and a (paths, years) array per PATH_ARRAYS column}
+    """
+    if not isinstance(df['ticker'].dtype, pd.CategoricalDtype):
+        raise ValueError("The ticker column has to be categorical, see schema.py")
+    if df.empty:
+        return _empty_paths(df['ticker'].cat.categories)
+
+    codes = df['ticker'].cat.codes.to_numpy()
+    sims = df['simulation_num'].to_numpy()
+    year = df['year'].to_numpy()
+    # engine frames are already in ticker, simulation, year order, anything else is sorted first
+    path_key = codes.astype(np.int64) * (int(sims.max()) + 1) + sims
+    in_order = (path_key[1:] > path_key[:-1]) | ((path_key[1:] == path_key[:-1]) & (year[1:] > year[:-1]))
+    if not in_order.all():
+        order = np.lexsort((year, sims, codes))
+        df, codes, sims, year = df.iloc[order], codes[order], sims[order], year[order]
+
+    years = int(year.max())
+    if len(df) % years or not (year.reshape(-1, years) == np.arange(1, years + 1)).all():
+        raise ValueError("Every simulated path needs one row for each year 1..N")
+    path_codes = codes.reshape(-1, years)
+    path_sims = sims.reshape(-1, years)
+    if not ((path_codes == path_codes[:, :1]).all() and (path_sims == path_sims[:, :1]).all()):
+        raise ValueError("Every simulated path needs one row for each year 1..N")
+
+    starting = df['starting_value'].to_numpy(dtype=np.float32).reshape(-1, years)
+    paths = {
+        'ticker': pd.Categorical.from_codes(path_codes[:, 0], categories=df['ticker'].cat.categories),
+        'simulation_num': path_sims[:, 0].astype(np.int32),
+        'starting_value': starting[:, 0]
+    }
+    for name, (column, element_type) in PATH_ARRAYS.items():
+        paths[name] = df[column].to_numpy(dtype=np.bool_ if element_type == '?' else np.float32).reshape(-1, years)
+    if not np.array_equal(starting[:, 1:], paths['ending_values'][:, :-1]):
+        raise ValueError("Every year of a path has to start at the previous year's ending value")
+    return paths
+
+
+def paths_to_frame(paths: dict[str, np.ndarray]) -> pd.DataFrame:
+    """Inverse of frame_to_paths: the simulation frame with one row per path and year."""
+    ending = paths['ending_values']
+    n_paths, years = ending.shape
+    if n_paths == 0:
+        return empty_simulation_data()
+    starting = np.empty_like(ending, dtype=np.float32)
+    starting[:, 0] = paths['starting_value']
+    starting[:, 1:] = ending[:, :-1]
+    ticker = paths['ticker']
+    df = pd.DataFrame({
+        'simulation_num': np.repeat(paths['simulation_num'], years),
+        'ticker': pd.Categorical.from_codes(np.repeat(ticker.codes, years), categories=ticker.categories),
+        'year': np.tile(np.arange(1, years + 1), n_paths),
+        'starting_value': starting.ravel(),
+        **{column: paths[name].ravel() for name, (column, _) in PATH_ARRAYS.items()}
+    })
+    return df[SIMULATION_COLUMNS].astype(SIMULATION_DTYPES)
+
+
+def encode_paths(paths: dict[str, np.ndarray], start: int = 0, stop: int = None) -> bytes:
+    """
+    Binary COPY records (PATH_COLUMNS order) of the paths start..stop. Paths of one ticker
+    are consecutive, so each ticker's run of paths is encoded with the ticker as a fixed
+    width field.
+    """
+    stop = len(paths['simulation_num']) if stop is None else stop
+    codes = np.asarray(paths['ticker'].codes[start:stop])
+    if (codes < 0).any():
+        raise ValueError("Column ticker has missing values, which can't be loaded")
+    categories = paths['ticker'].categories
+    records = []
+    for group_start, group_stop in ticker_groups(codes):
+        rows = slice(start + group_start, start + group_stop)
+        records.append(encode_binary_rows([
+            encode_text_column(str(categories[codes[group_start]]), group_stop - group_start),
+            (paths['simulation_num'][rows], '>i4'),
+            (paths['starting_value'][rows], '>f4'),
+            *(encode_array_column(paths[name][rows], element_type) for name, (_, element_type) in PATH_ARRAYS.items())
+        ]))
+    return b''.join(records)
+
+
+def _iter_path_blocks(frames: Iterable[pd.DataFrame], block_rows: int) -> Iterator[tuple[dict, int, int]]:
+    """(paths, start, stop) blocks of about block_rows frame rows, never splitting a path."""
+    for frame in frames:
+        if frame.empty:
+            continue
+        paths = frame_to_paths(frame)
+        n_paths, years = paths['ending_values'].shape
+        block_paths = max(block_rows // years, 1)
+        for start in range(0, n_paths, block_paths):
+            yield paths, start, min(start + block_paths, n_paths)
+
+
+def copy_sim_paths(pool: ConnectionPool, data: Union[pd.DataFrame, Iterable[pd.DataFrame]], tickers: list[str], parameters: dict = None, block_rows: int = DEFAULT_BLOCK_ROWS, failed_tickers: list[str] = None) -> dict[str, int]:
+    """
+    Bulk load one simulation run into simulation_paths with binary COPY.
+
+    The run is created, copied straight into its own table (the column types match the
+    frame, so no staging table or cast is needed) and attached as a partition in one
+    transaction, like copy_sim_data.
+
+    Args:
+        data: Canonical simulation frame or an iterable of them (streamed blocks have to hold whole paths)
+        tickers: Simulated tickers, stored with the run
+        parameters: Simulation parameters stored with the run (JSON serializable)
+        block_rows: Frame rows encoded per write
+        failed_tickers: Requested tickers that could not be downloaded, stored with the run
+
+    Returns:
+        {'run_id', 'rows'}, rows being the number of paths
+    """
+    frames = [data] if isinstance(data, pd.DataFrame) else data
+    n_paths = 0
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            run_id = create_run(cur, tickers, parameters or {}, storage='paths', failed_tickers=failed_tickers)
+            table = partition_name(run_id, 'paths')
+            #https://www.psycopg.org/psycopg3/docs/basic/copy.html#binary-copy, blocks are already encoded so they are written as is
+            with cur.copy(f"COPY {table} ({', '.join(PATH_COLUMNS)}) FROM STDIN (FORMAT BINARY)") as copy:
+                copy.write(COPY_SIGNATURE)
+                for paths, start, stop in _iter_path_blocks(frames, block_rows):
+                    copy.write(encode_paths(paths, start, stop))
+                    n_paths += stop - start
+                copy.write(COPY_TRAILER)
+            attach_run(cur, run_id, n_paths, storage='paths')
+        conn.commit()
+    return {'run_id': run_id, 'rows': n_paths}
+
+
+def read_sim_paths(pool: ConnectionPool, run_id: int, tickers: list[str] = None) -> pd.DataFrame:
+    """
+    Read a run stored in simulation_paths back as a transform_monte_carlo_data frame.
+
+    Args:
+        run_id: Run to read
+        tickers: Only these tickers (None reads all of them)
+    """
+    with pool.connection() as conn:
+        with conn.cursor(binary=True) as cur:
+            cur.execute(f"""
+                SELECT {', '.join(PATH_COLUMNS)} FROM simulation_paths
+                WHERE run_id = %s AND (%s::text[] IS NULL OR ticker = ANY(%s))
+                ORDER BY ticker COLLATE "C", simulation_num;
+            """, (run_id, tickers, tickers))
+            rows = cur.fetchall()
+    if not rows:
+        return empty_simulation_data()
+    columns = dict(zip(PATH_COLUMNS, zip(*rows)))
+    paths = {
+        'ticker': pd.Categorical(columns['ticker'], categories=sorted(set(columns['ticker']))),
+        'simulation_num': np.array(columns['simulation_num'], dtype=np.int32),
+        'starting_value': np.array(columns['starting_value'], dtype=np.float32)
+    }
+    for name, (_, element_type) in PATH_ARRAYS.items():
+        paths[name] = np.array(columns[name], dtype=np.bool_ if element_type == '?' else np.float32)
+    return paths_to_frame(paths)
@@ -1,10 +1,16 @@
 from src.Extract.main import compile_extracted_data
-from src.Transform.main import transform_extracted_data
-from src.Transform.monte_carlo import run_monte_carlo, transform_monte_carlo_data
-from src.db.insertion import insert_stock_data, insert_sim_data
-from src.db.connection import psql_connect_and_setup
+from src.Extract.recording import DEFAULT_RECORDING_DIR, split_source
+from src.Transform.main import transform_extracted_data, filter_new_rows, concat_stock_data
+from src.Transform.monte_carlo import run_monte_carlo, transform_monte_carlo_data, iter_monte_carlo, iter_transform_monte_carlo_data, summarize_monte_carlo
+from src.Transform.return_stats import ReturnStatsStore
+from src.Transform.schema import empty_stock_data
+from src.db.insertion import LOAD_MODES, fetch_stock_watermarks, copy_stock_data, copy_sim_data, insert_sim_summary
+from src.db.connection import open_pool, psql_connect_and_setup
+from src.db.runs import SIMULATION_STORAGES, apply_retention
+from src.db.simulation_paths import copy_sim_paths
 import pandas as pd
 import psycopg
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Union
 
 """
@@ -24,8 +30,38 @@ TODO:
 
 
 
+def _transform(extracted_data: Union[Dict, pd.DataFrame], api: str, price_float_dtype: str, since: pd.Timestamp, portfolio: bool) -> pd.DataFrame:
+    """Transform whatever the extract returned into one stock_data frame (rows after `since` only, if given)."""
+    transformed_data = None
+
+    #more info on the isinstance built-in method can be found at https://docs.python.org/3/library/functions.html#isinstance
+    if isinstance(extracted_data, dict) and 'yfinance_batches' in extracted_data:
+        #batches are downloaded lazily, each one is cleaned while the next ones are still downloading.
+        #a failed ticker changes the joint (portfolio) return statistics, which then have to be rebuilt from
+        #the full history, and which tickers fail is only known once every batch is in, so those aren't trimmed
+        batch_since = None if portfolio else since
+        transformed_data = concat_stock_data([
+            transform_extracted_data(batch, source=api, float_dtype=price_float_dtype, since=batch_since)
+            for batch in extracted_data['yfinance_batches']
+        ], price_float_dtype)
+    elif isinstance(extracted_data, dict):#this checks if extracted_data is a dictionary
+        # Check if we have actual data to transform
+        for _, value in extracted_data.items():
+            if isinstance(value, pd.DataFrame):
+                transformed_data = transform_extracted_data(value, source=api, float_dtype=price_float_dtype, since=since)
+                break
+        # If no DataFrame found, return empty transformed structure
+        if transformed_data is None:
+            transformed_data = empty_stock_data(price_float_dtype)
+    elif isinstance(extracted_data, pd.DataFrame): #checks if instead the extracted_data is already a dataframe
+        transformed_data = transform_extracted_data(extracted_data, source=api, float_dtype=price_float_dtype, since=since)
+    else: #otherwise create the DF with the appropriate structure
+        transformed_data = empty_stock_data(price_float_dtype)
+    return transformed_data
+
+
 #this file will need to recieve the API keys and the db credentials from the config file which will be passed down from the root main.py file
-def compile_ETL_data(api_1: str='api_1', db_credentials: dict[str]=None, source: str = 'yfinance', tickers: list[str]=['AAPL', 'MSFT', 'GOOGL'], time_period: str='ytd') -> Dict[str, pd.DataFrame]:
+def compile_ETL_data(api_1: str='api_1', db_credentials: dict[str]=None, source: str = 'yfinance', tickers: list[str]=['AAPL', 'MSFT', 'GOOGL'], time_period: str='ytd', n_workers: int=1, num_simulations: int=10000, stream_simulations: bool=False, summary_only: bool=False, portfolio: bool=False, sampling: str='pseudo', step: str='daily', simulation_model: str='gbm', block_size: int=1, target_se: float=None, seed: int=None, cache_dir: str=None, return_stats_path: str=None, price_float_dtype: str=None, incremental: bool=True, yfinance_cache_dir: str=None, offline: bool=False, yfinance_batch_size: int=None, yfinance_workers: int=4, recording_dir: str=DEFAULT_RECORDING_DIR, load_mode: str='upsert', keep_runs: int=None, simulation_storage: str='rows') -> Dict[str, pd.DataFrame]:
     """
     Main ETL orchestrator function.
     
@@ -35,73 +71,179 @@ def compile_ETL_data(api_1: str='api_1', db_credentials: dict[str]=None, source:
     3. Load: (To be implemented) Insert into database
     
     Args:
-        api_1: API key (unused, kept for compatibility)
-        source: Data source identifier ('yfinance')
+        api_1: Finnhub API key (only used with source='finnhub')
+        db_credentials: config.db_credentials; one connection pool is opened from them and shared by the
+            watermark read, the table setup and the loaders (None or empty skips the database)
+        source: Data source identifier ('yfinance' or 'finnhub'); 'record:yfinance' also saves the raw response
+            to `recording_dir` and 'replay:yfinance' runs from a saved one without network access
         tickers: List of stock ticker symbols to fetch data for
         time_period: Time period for which to fetch data (e.g., '5d', '1mo', 'ytd') default is 'ytd'
+        n_workers: Number of worker processes for the Monte Carlo simulation
+        num_simulations: Number of Monte Carlo paths per ticker
+        stream_simulations: Stream simulation blocks straight into the database instead of
+            building the whole simulation table in memory ('simulated' is then None)
+        summary_only: Only keep per-(ticker, year) statistics of the simulation and load them into
+            the simulation_summary table instead of one row per path ('simulated' is the summary)
+        portfolio: Simulate the tickers jointly with correlated returns and add a 'PORTFOLIO' total row
+        sampling: Random sampling method for the simulation ('pseudo', 'antithetic' or 'sobol')
+        step: 'daily' simulates every trading day, 'yearly' samples each year's growth and volatility directly
+        simulation_model: 'gbm' for normal daily returns, 'bootstrap' to resample historical daily returns
+        block_size: Number of consecutive days resampled together by the bootstrap model
+        target_se: Relative standard error at which each ticker stops simulating; num_simulations is
+            then the upper limit (in-memory simulation only)
+        seed: Seed for the simulation, None draws fresh random paths every run
+        cache_dir: Directory for cached simulation results; with a seed set, a rerun on unchanged
+            prices and parameters loads the previous result instead of simulating (in-memory simulation only)
+        return_stats_path: File of the persistent return statistics store; new prices are folded into it
+            and the GBM parameters are read from it instead of the full price history
+        price_float_dtype: Float type of the stock_data price columns, 'float64' (default) or 'float32' to halve their memory
+        incremental: Read each ticker's latest stored date from stock_data and only load newer rows. The
+            transform is trimmed to those rows too when the simulation reads its parameters from
+            up to date return statistics (GBM with return_stats_path), otherwise it needs the full history
+        yfinance_cache_dir: Local parquet cache of yfinance bars; only the days it is missing are downloaded
+        offline: Extract from the yfinance cache only, without any network access
+        yfinance_batch_size: Download the tickers in batches of this size, `yfinance_workers` at a time. Failed
+            tickers are reported and left out of the simulation (and recorded with the run), and every batch is
+            transformed as soon as it arrives
+        recording_dir: Directory of the recorded raw responses for the record/replay sources
+        load_mode: 'upsert' merges stock_data on (ticker, date) through a staging table, so a rerun updates
+            changed rows and skips unchanged ones; 'append' only inserts and fails on rows that are already loaded
+        keep_runs: Keep only the latest this many simulation runs (partitions) after loading, None keeps all
+        simulation_storage: 'rows' loads one simulation row per path and year, 'paths' one simulation_paths row
+            per path with the yearly values as arrays (read it back with read_sim_paths)
         
     Returns:
         Dictionary with 'extracted' and 'transformed' DataFrames
     """
+    if load_mode not in LOAD_MODES:
+        raise ValueError(f"Unknown load mode: {load_mode}. Supported modes: {LOAD_MODES}")
+    if simulation_storage not in SIMULATION_STORAGES:
+        raise ValueError(f"Unknown simulation storage: {simulation_storage}. Supported layouts: {list(SIMULATION_STORAGES)}")
+
     # Step 1: Extract - Get raw data from APIs
-    extracted_data = compile_extracted_data(api_1, tickers, time_period)
+    extracted_data = compile_extracted_data(api_1, tickers, time_period, cache_dir=yfinance_cache_dir, offline=offline, source=source, batch_size=yfinance_batch_size, max_workers=yfinance_workers, recording_dir=recording_dir)
+    _, api = split_source(source) #recorded responses are transformed like live ones
     
+    #one pool of connections for every database step of the run (watermarks, table setup and the loaders)
+    pool = None
+    if db_credentials:
+        try:
+            pool = open_pool(db_credentials)
+        except psycopg.DatabaseError as de:
+            print("Could not connect to the database, skipping the database steps:", de)
+
+    #high-water mark per ticker: the latest date already in stock_data, so reruns only add the newer rows
+    watermarks = {}
+    if incremental and pool is not None:
+        try:
+            watermarks = fetch_stock_watermarks(pool, tickers=tickers)
+        except psycopg.errors.UndefinedTable:
+            pass #first run, nothing is loaded yet
+        except psycopg.DatabaseError as de:
+            print("Could not read the stock_data watermarks, loading the full history:", de)
+
+    return_stats = None
+    if return_stats_path is not None:
+        return_stats = ReturnStatsStore.load(return_stats_path)
+
+    #only transform the rows after the earliest mark if nothing downstream needs the older ones:
+    #the simulation reads the full history unless its GBM parameters come from the return statistics
+    since = None
+    if watermarks and all(ticker in watermarks for ticker in tickers) and return_stats is not None and simulation_model == 'gbm':
+        covered = return_stats.covered_until(tickers, portfolio=portfolio)
+        if covered is not None:
+            #the day before, so the last bar the statistics saw is kept to check it wasn't re-adjusted
+            since = min(covered, *(watermarks[ticker] for ticker in tickers)) - pd.Timedelta(days=1)
+
     # Step 2: Transform - Clean and standardize data
-    transformed_data = None
-    
-    #more info on the isinstance built-in method can be found at https://docs.python.org/3/library/functions.html#isinstance
-    if isinstance(extracted_data, dict):#this checks if extracted_data is a dictionary
-        # Check if we have actual data to transform
-        for _, value in extracted_data.items():
-            if isinstance(value, pd.DataFrame):
-                transformed_data = transform_extracted_data(value, source=source)
-                break
-        # If no DataFrame found, return empty transformed structure
-        if transformed_data is None:
-            transformed_data = pd.DataFrame(columns=['ticker', 'date', 'open', 'high', 'low', 'close', 'adj_close', 'volume'])
-    elif isinstance(extracted_data, pd.DataFrame): #checks if instead the extracted_data is already a dataframe
-        transformed_data = transform_extracted_data(extracted_data, source=source)
-    else: #otherwise create the DF with the appropriate structure
-        transformed_data = pd.DataFrame(columns=['ticker', 'date', 'open', 'high', 'low', 'close', 'adj_close', 'volume'])
+    transformed_data = _transform(extracted_data, api, price_float_dtype, since, portfolio)
+
+    #a split or dividend re-adjusts the whole price history, the statistics of those tickers then need all of it
+    readjusted = return_stats.readjusted(transformed_data) if since is not None else []
+    if readjusted:
+        print(f"Prices of {readjusted} were re-adjusted (split or dividend) since the return statistics were updated, transforming the full history")
+        if load_mode == 'upsert':
+            #their stored stock_data rows are on the old scale too, the upsert rewrites the changed ones
+            watermarks = {ticker: mark for ticker, mark in watermarks.items() if ticker not in readjusted}
+        if isinstance(extracted_data, dict) and 'yfinance_batches' in extracted_data:
+            #the batches are consumed, download them again (from the cache if there is one)
+            extracted_data = compile_extracted_data(api_1, tickers, time_period, cache_dir=yfinance_cache_dir, offline=offline, source=source, batch_size=yfinance_batch_size, max_workers=yfinance_workers, recording_dir=recording_dir)
+        transformed_data = _transform(extracted_data, api, price_float_dtype, None, portfolio)
+
+    #tickers that could not be downloaded are left out of everything downstream and recorded with the run
+    failed_tickers = sorted(extracted_data.get('yfinance_failed', {})) if isinstance(extracted_data, dict) else []
+    if failed_tickers:
+        tickers = [ticker for ticker in tickers if ticker not in failed_tickers]
+        print(f"Simulating without the tickers that failed to download: {failed_tickers}")
+
+    #only the rows after each ticker's watermark are inserted, the rest are already in stock_data
+    new_stock_data = filter_new_rows(transformed_data, watermarks)
+    print(f"{len(new_stock_data)} new stock_data rows to load")
+
+    #fold the new prices into the running return statistics so the simulation doesn't rescan the whole history
+    if return_stats is not None:
+        return_stats.update(transformed_data, joint_tickers=tickers if portfolio else None)
+        return_stats.save()
 
     #now that we have the cleaned data we pass it to the monte carlo to run and then store that table as well!
-    monte_carlo_results = run_monte_carlo(df=transformed_data, tickers=tickers, portfolio_value=250000, years=10, num_simulations=10000, seed=None)
-    transformed_monte_carlo_data = transform_monte_carlo_data(monte_carlo_results)
-    #assume that at this point the data was extracted and transformed successfully!
-    #itertuples needs to have the exact order for insertion otherwise it will break the code!!!
-    try:
-        psql_connect_and_setup(
-            db_host_addr=db_credentials['host'], 
-            db_port=db_credentials['port'], 
-            db_name=db_credentials['database'], 
-            db_user=db_credentials['user'], 
-            db_password=db_credentials['password'], 
-            db_timeout=db_credentials['timeout'])
-        insert_stock_data( #populate the db with the stock data
-            db_host_addr=db_credentials['host'], 
-            db_port=db_credentials['port'], 
-            db_name=db_credentials['database'], 
-            db_user=db_credentials['user'], 
-            db_password=db_credentials['password'], 
-            db_timeout=db_credentials['timeout'],
-            data=list(transformed_data.itertuples(index=False, name=None)) #https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.itertuples.html, https://stackoverflow.com/questions/9758450/pandas-convert-dataframe-to-array-of-tuples 
-        )    
-        insert_sim_data(#populate the db with the monte sim data
-            db_host_addr=db_credentials['host'], 
-            db_port=db_credentials['port'], 
-            db_name=db_credentials['database'], 
-            db_user=db_credentials['user'], 
-            db_password=db_credentials['password'], 
-            db_timeout=db_credentials['timeout'],
-            data=list(transformed_monte_carlo_data.itertuples(index=False, name=None)) #https://pandas.pydata.org/docs/reference/api/pandas.DataFrame.itertuples.html, https://stackoverflow.com/questions/9758450/pandas-convert-dataframe-to-array-of-tuples 
-        )
-    except psycopg.IntegrityError as ie:
-        print("Data insertion failed due to integrity error (there is probably duplicate data being entered):", ie)
-    except psycopg.DatabaseError as de:
-        print("Database setup failed:", de)
+    simulation_args = dict(df=transformed_data, tickers=tickers, portfolio_value=250000, years=10, num_simulations=num_simulations, seed=seed, n_workers=n_workers, portfolio=portfolio, sampling=sampling, step=step, simulation_model=simulation_model, block_size=block_size, return_stats=return_stats)
+    if summary_only:
+        #paths are reduced to per ticker/year statistics while they are simulated, no path rows are kept
+        transformed_monte_carlo_data = summarize_monte_carlo(**simulation_args)
+    elif stream_simulations:
+        #blocks are only simulated when the loader asks for them, so memory stays flat
+        monte_carlo_chunks = iter_transform_monte_carlo_data(iter_monte_carlo(**simulation_args))
+        transformed_monte_carlo_data = None
     else:
-        #the data is converted to a list of tuples for each row for insertion with psycopg3
-        print('Database setup and data insertion completed successfully!')
+        monte_carlo_results = run_monte_carlo(**simulation_args, target_se=target_se, cache_dir=cache_dir)
+        if 'paths_per_ticker' in monte_carlo_results.attrs:
+            print(f"Adaptive Monte Carlo paths per ticker: {monte_carlo_results.attrs['paths_per_ticker']}")
+        transformed_monte_carlo_data = transform_monte_carlo_data(monte_carlo_results)
+    #assume that at this point the data was extracted and transformed successfully!
+    #stock and simulation rows are bulk loaded with binary COPY straight from the frames' columns (see src/db/binary_copy.py)
+    if not db_credentials:
+        #nothing to load into (e.g. offline replay runs), the results are only returned
+        print("No database credentials given, skipping the database load")
+    elif pool is not None:
+        try:
+            psql_connect_and_setup(pool)
+            #the simulation is stored as a new run with the parameters it was made with
+            run_parameters = {key: value for key, value in simulation_args.items() if key not in ('df', 'tickers', 'n_workers', 'return_stats')}
+            if not stream_simulations:
+                run_parameters['target_se'] = target_se
+            copy_simulation = copy_sim_paths if simulation_storage == 'paths' else copy_sim_data
+            #stock and simulation rows go to different tables, so both loads run at once on their own pooled connection
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                loads = [executor.submit(copy_stock_data, pool, data=new_stock_data, mode=load_mode)] #populate the db with the stock data
+                if summary_only:
+                    #populate the db with the simulation summary
+                    loads.append(executor.submit(insert_sim_summary, pool, data=list(transformed_monte_carlo_data.itertuples(index=False, name=None))))
+                elif stream_simulations:
+                    #populate the db with the monte sim data one block at a time
+                    loads.append(executor.submit(copy_simulation, pool, data=monte_carlo_chunks, tickers=tickers, parameters=run_parameters, failed_tickers=failed_tickers))
+                else:
+                    #populate the db with the monte sim data
+                    loads.append(executor.submit(copy_simulation, pool, data=transformed_monte_carlo_data, tickers=tickers, parameters=run_parameters, failed_tickers=failed_tickers))
+                for load in loads:
+                    load.result() #re-raises the error of a failed load
+            stock_counts = loads[0].result()
+            print(f"stock_data: {stock_counts['inserted']} inserted, {stock_counts['updated']} updated, {stock_counts['unchanged']} unchanged")
+            if not summary_only:
+                run = loads[1].result()
+                print(f"simulation: run {run['run_id']} loaded with {run['rows']} rows")
+                if keep_runs is not None:
+                    #old runs are dropped a partition at a time instead of a DELETE over the whole table
+                    dropped = apply_retention(pool, keep_runs)
+                    if dropped:
+                        print(f"Dropped simulation runs {dropped}")
+        except psycopg.IntegrityError as ie:
+            print("Data insertion failed due to integrity error (there is probably duplicate data being entered):", ie)
+        except psycopg.DatabaseError as de:
+            print("Database setup failed:", de)
+        else:
+            print('Database setup and data insertion completed successfully!')
+        finally:
+            pool.close()
     
     return {
         'extracted': extracted_data,
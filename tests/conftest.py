@@ -5,6 +5,7 @@ import pytest
 import pandas as pd
 import numpy as np
 from config import api_keys
+from src.Extract.recording import save_recording
 
 
 @pytest.fixture
@@ -76,3 +77,37 @@ def sample_yfinance_data():
     df.columns = pd.MultiIndex.from_tuples(df.columns)
     return df
 
+
+
+@pytest.fixture
+def sample_price_history():
+    """Fixture providing a few years of synthetic adjusted close prices for simulation tests"""
+    rng = np.random.default_rng(42)
+    dates = pd.bdate_range('2020-01-01', periods=500)
+    frames = []
+    for ticker, daily_vol in [('AAPL', 0.02), ('SPY', 0.01), ('TSLA', 0.035)]:
+        prices = 100 * np.exp(np.cumsum(rng.normal(0.0004, daily_vol, len(dates))))
+        frames.append(pd.DataFrame({'ticker': ticker, 'date': dates, 'adj_close': prices}))
+    return pd.concat(frames, ignore_index=True)
+
+
+@pytest.fixture(scope='session')
+def replay_recordings(tmp_path_factory):
+    """Fixture recording synthetic yfinance and Finnhub responses for the default ETL tickers
+    ('ytd'), so pipeline tests replay them instead of calling the live APIs"""
+    recording_dir = str(tmp_path_factory.mktemp('recordings'))
+    tickers = ['AAPL', 'MSFT', 'GOOGL']
+    rng = np.random.default_rng(7)
+    dates = pd.bdate_range('2024-01-02', periods=120, name='Date')
+    yf_frames, finnhub_frames = {}, []
+    for ticker in tickers:
+        close = 100 * np.exp(np.cumsum(rng.normal(0.0005, 0.015, len(dates))))
+        bars = pd.DataFrame({'Open': close * 0.995, 'High': close * 1.01, 'Low': close * 0.99, 'Close': close,
+                             'Adj Close': close, 'Volume': rng.integers(1_000_000, 5_000_000, len(dates))}, index=dates)
+        yf_frames[ticker] = bars
+        finnhub_frames.append(pd.DataFrame({'symbol': ticker, 'datetime': dates, 'open': bars['Open'].to_numpy(),
+                                            'high': bars['High'].to_numpy(), 'low': bars['Low'].to_numpy(),
+                                            'close': close, 'volume': bars['Volume'].to_numpy()}))
+    save_recording(pd.concat(yf_frames, axis=1), recording_dir, 'yfinance', tickers, 'ytd')
+    save_recording(pd.concat(finnhub_frames, ignore_index=True), recording_dir, 'finnhub', tickers, 'ytd')
+    return recording_dir
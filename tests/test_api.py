@@ -1,11 +1,20 @@
 """
 Tests for API extraction
 """
+import json
+import threading
+import time
 import pytest
 import pandas as pd
 import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
 import yfinance as yf
 from config import api_keys
+from src.Extract.yfinance_cache import YFinanceCache, missing_ranges, period_start
+from src.Extract.finnhub_fetch_data import CANDLE_COLUMNS, FinnhubClient, TokenBucket
+from src.Extract.yfinance_fetch_data import YFinanceBatchDownloader
+from src.Transform.main import transform_finnhub_data, transform_yfinance_data, concat_stock_data
 
 
 class TestYahooFinanceAPI:
@@ -93,3 +102,239 @@ class TestFinnhubAPI:
                 assert 'c' in data, "Should have close prices"
                 assert 't' in data, "Should have timestamps"
 
+
+@pytest.fixture
+def fake_download(monkeypatch):
+    """yf.download stand-in returning bars for every business day in the range, records its calls.
+    Ticker 'BAD' comes back without prices, like a delisted symbol."""
+    calls = []
+
+    def download(tickers, period=None, start=None, end=None, **kwargs):
+        calls.append((tuple(tickers), period, start, end))
+        first = pd.Timestamp(start) if start is not None else pd.Timestamp('2020-01-01' if period == 'max' else '2023-12-01')
+        # end is exclusive like yfinance's
+        dates = pd.bdate_range(first, pd.Timestamp(end or '2024-01-11') - pd.Timedelta(days=1), name='Date')
+        frames = {}
+        for i, ticker in enumerate(tickers):
+            price = sum(map(ord, ticker)) + dates.dayofyear.astype(float)
+            if ticker == 'BAD':
+                price = price * float('nan')
+            frames[ticker] = pd.DataFrame({'Open': price, 'High': price + 1, 'Low': price - 1, 'Close': price,
+                                           'Adj Close': price, 'Volume': 1000}, index=dates)
+        return pd.concat(frames, axis=1)
+
+    monkeypatch.setattr('src.Extract.yfinance_cache.yf.download', download)
+    return calls
+
+
+class TestYFinanceCache:
+    """Test the local yfinance cache (no network, yf.download is replaced by a fake)"""
+
+    def test_missing_ranges(self):
+        """Test the gap computation against covered ranges"""
+        covered = [['2024-01-03', '2024-01-05'], ['2024-01-08', '2024-01-09']]
+        gaps = missing_ranges(covered, pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-10'))
+
+        assert gaps == [
+            (pd.Timestamp('2024-01-01'), pd.Timestamp('2024-01-02')),
+            (pd.Timestamp('2024-01-06'), pd.Timestamp('2024-01-07')),
+            (pd.Timestamp('2024-01-10'), pd.Timestamp('2024-01-10'))
+        ]
+        assert missing_ranges([[None, '2024-01-09']], None, pd.Timestamp('2024-01-09')) == []
+        assert period_start('ytd', pd.Timestamp('2024-05-06')) == pd.Timestamp('2024-01-01')
+        assert period_start('1mo', pd.Timestamp('2024-05-06')) == pd.Timestamp('2024-04-06')
+
+    def test_refetches_only_the_tail(self, fake_download, tmp_path):
+        """Test that a later run only downloads the days after the cached range"""
+        cache = YFinanceCache(str(tmp_path))
+        first = cache.fetch(['AAPL', 'MSFT'], '1mo', today=pd.Timestamp('2024-01-05'))
+        later = YFinanceCache(str(tmp_path)).fetch(['AAPL', 'MSFT'], '1mo', today=pd.Timestamp('2024-01-10'))
+
+        assert len(fake_download) == 2
+        # from the last settled cached day, which is checked against the cache for split adjustments
+        assert fake_download[1] == (('AAPL', 'MSFT'), None, '2024-01-04', '2024-01-11')
+        # the cached rows are returned together with the new ones
+        pd.testing.assert_frame_equal(later.loc[:'2024-01-04'], first.loc['2023-12-10':'2024-01-04'], check_freq=False)
+        assert later.index[-1] == pd.Timestamp('2024-01-10')
+        assert list(later.columns.get_level_values(0).unique()) == ['AAPL', 'MSFT']
+
+    def test_split_between_fetches_refreshes_the_cache(self, fake_download, tmp_path, monkeypatch):
+        """Test that bars cached before a split are replaced by the retroactively adjusted ones"""
+        cache = YFinanceCache(str(tmp_path))
+        cache.fetch(['AAPL', 'MSFT'], '1mo', today=pd.Timestamp('2024-01-05'))
+
+        unsplit = yf.download
+
+        def split_download(tickers, **kwargs):
+            #4:1 split of AAPL after the first fetch, yfinance divides every earlier AAPL price by 4
+            data = unsplit(tickers, **kwargs)
+            if 'AAPL' in tickers:
+                data[[('AAPL', field) for field in ['Open', 'High', 'Low', 'Close', 'Adj Close']]] /= 4
+            return data
+
+        monkeypatch.setattr('src.Extract.yfinance_cache.yf.download', split_download)
+        later = YFinanceCache(str(tmp_path)).fetch(['AAPL', 'MSFT'], '1mo', today=pd.Timestamp('2024-01-10'))
+
+        #the overlapping bar gave the split away, only AAPL is downloaded again over the whole period
+        assert len(fake_download) == 3
+        assert fake_download[-1] == (('AAPL',), None, '2023-12-10', '2024-01-11')
+        adjusted = split_download(['AAPL'], start='2023-12-10', end='2024-01-11')['AAPL']
+        pd.testing.assert_series_equal(later['AAPL']['Close'], adjusted['Close'], check_freq=False, check_names=False)
+
+    def test_offline_mode_never_downloads(self, fake_download, tmp_path, monkeypatch):
+        """Test that offline mode serves the cache and skips tickers it does not hold"""
+        YFinanceCache(str(tmp_path)).fetch(['AAPL'], 'max', today=pd.Timestamp('2024-01-10'))
+        monkeypatch.setattr('src.Extract.yfinance_cache.yf.download', lambda *args, **kwargs: pytest.fail("network access"))
+
+        offline = YFinanceCache(str(tmp_path), offline=True).fetch(['AAPL', 'NVDA'], 'max', today=pd.Timestamp('2024-01-20'))
+
+        assert list(offline.columns.get_level_values(0).unique()) == ['AAPL']
+        assert offline.index[-1] == pd.Timestamp('2024-01-10')
+
+
+class TestYFinanceBatchDownloader:
+    """Test batched yfinance downloads (yf.download is replaced by a fake)"""
+
+    def test_failed_tickers_are_isolated(self, fake_download):
+        """Test that a symbol without data is retried, reported and does not stop the other batches"""
+        downloader = YFinanceBatchDownloader(batch_size=2, max_workers=1, max_retries=2, backoff=0)
+        batches = list(downloader.iter_batches(['MSFT', 'BAD', 'AAPL', 'MSFT'], '5d'))
+
+        assert [list(batch.columns.get_level_values(0).unique()) for batch in batches] == [['AAPL'], ['MSFT']]
+        assert downloader.failed == {'BAD': 'no data returned'}
+        # batch ['AAPL', 'BAD'] once, then BAD alone for both retries, then ['MSFT']
+        assert [call[0] for call in fake_download] == [('AAPL', 'BAD'), ('BAD',), ('BAD',), ('MSFT',)]
+
+    def test_hung_batch_is_abandoned(self, fake_download, monkeypatch):
+        """Test that a download that never returns fails its batch at the deadline instead of blocking the extract"""
+        unhung = yf.download
+
+        def download(tickers, **kwargs):
+            if 'HANG' in tickers:
+                time.sleep(600)
+            return unhung(tickers, **kwargs)
+
+        monkeypatch.setattr('src.Extract.yfinance_fetch_data.yf.download', download)
+        downloader = YFinanceBatchDownloader(batch_size=1, max_workers=3, timeout=1, max_retries=0)
+        started = time.monotonic()
+        batches = list(downloader.iter_batches(['AAPL', 'HANG', 'MSFT'], '5d'))
+
+        assert time.monotonic() - started < 10
+        assert sorted(batch.columns.get_level_values(0)[0] for batch in batches) == ['AAPL', 'MSFT']
+        assert list(downloader.failed) == ['HANG'] and 'did not finish' in downloader.failed['HANG']
+
+    def test_batches_transform_like_one_download(self, fake_download):
+        """Test that transforming the batches from the process pool one by one gives the single download result"""
+        tickers = ['SPY', 'AAPL', 'QQQ', 'MSFT', 'NVDA']
+        downloader = YFinanceBatchDownloader(batch_size=2, max_workers=2)
+        batched = concat_stock_data([transform_yfinance_data(batch) for batch in downloader.iter_batches(tickers, '1mo')])
+
+        whole = transform_yfinance_data(yf.download(tickers, period='1mo', group_by='ticker'))
+        pd.testing.assert_frame_equal(batched, whole)
+        assert downloader.failed == {}
+
+
+class TestFinnhubExtractor:
+    """Test the Finnhub extractor against a local stub server"""
+
+    @pytest.fixture
+    def stub_server(self):
+        """Local Finnhub stand-in: candles for every symbol, the first call for 'SLOW' is throttled,
+        'free-key' is a free tier key without candle access"""
+        requests_seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                requests_seen.append((url.path, params.get('symbol'), self.client_address[1]))
+                if params.get('token') not in ('test-key', 'free-key'):
+                    return self.reply(401, {'error': 'Invalid API key'})
+                if params.get('token') == 'free-key' and url.path == '/api/v1/stock/candle':
+                    return self.reply(403, {'error': "You don't have access to this resource."})
+                if params.get('symbol') == 'SLOW' and sum(symbol == 'SLOW' for _, symbol, _ in requests_seen) == 1:
+                    return self.reply(429, {'error': 'API limit reached'})
+                if url.path == '/api/v1/quote':
+                    return self.reply(200, {'c': 151.0, 'h': 152.0, 'l': 149.0, 'o': 150.0, 'pc': 150.0, 'd': 1.0, 'dp': 0.67, 't': 1704153600})
+                if params.get('symbol') == 'NONE':
+                    return self.reply(200, {'s': 'no_data'})
+                start = int(params['from'])
+                return self.reply(200, {
+                    's': 'ok', 't': [start, start + 86400], 'o': [150.0, 151.0], 'h': [152.0, 153.0],
+                    'l': [149.0, 150.0], 'c': [151.0, 152.0], 'v': [1000000, 1100000]
+                })
+
+            def reply(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield f'http://127.0.0.1:{server.server_address[1]}/api/v1', requests_seen
+        server.shutdown()
+        server.server_close()
+
+    def test_candles_feed_transform(self, stub_server):
+        """Test that concurrent candle requests come back in the shape transform_finnhub_data reads"""
+        base_url, requests_seen = stub_server
+        with FinnhubClient('test-key', base_url=base_url, calls_per_minute=6000, max_workers=2) as client:
+            candles = client.fetch_candles(['AAPL', 'NVDA', 'NONE'], pd.Timestamp('2024-01-02'), pd.Timestamp('2024-01-05'))
+
+        result = transform_finnhub_data(candles)
+        assert sorted(result['ticker'].unique()) == ['AAPL', 'NVDA']
+        assert len(result) == 4
+        assert list(result['date'].dt.day.unique()) == [2, 3]
+        # connections are reused: fewer client ports than requests
+        assert len({port for _, _, port in requests_seen}) <= 2
+
+    def test_throttled_call_is_retried(self, stub_server):
+        """Test that a 429 response is retried after a backoff"""
+        base_url, requests_seen = stub_server
+        with FinnhubClient('test-key', base_url=base_url, calls_per_minute=6000, backoff=0.01) as client:
+            quotes = client.fetch_quotes(['SLOW', 'AAPL'])
+
+        assert list(quotes['symbol']) == ['SLOW', 'AAPL']
+        assert quotes['c'].tolist() == [151.0, 151.0]
+        assert sum(symbol == 'SLOW' for _, symbol, _ in requests_seen) == 2
+
+    def test_bad_key_fails_without_retry(self, stub_server):
+        """Test that a rejected API key raises right away"""
+        base_url, requests_seen = stub_server
+        with FinnhubClient('wrong-key', base_url=base_url, calls_per_minute=6000) as client:
+            with pytest.raises(requests.HTTPError):
+                client.quote('AAPL')
+        assert len(requests_seen) == 1
+
+    def test_candles_without_plan_access_are_skipped(self, stub_server):
+        """Test that a free tier key (403 on candles) gives an empty frame instead of failing the extract"""
+        base_url, requests_seen = stub_server
+        with FinnhubClient('free-key', base_url=base_url, calls_per_minute=6000) as client:
+            candles = client.fetch_candles(['AAPL', 'NVDA'], pd.Timestamp('2024-01-02'), pd.Timestamp('2024-01-05'))
+            quote = client.quote('AAPL')
+
+        assert candles.empty
+        assert list(candles.columns) == CANDLE_COLUMNS
+        assert quote['c'] == 151.0
+        # a 403 is not retried
+        assert len(requests_seen) == 3
+
+    def test_token_bucket_limits_rate(self):
+        """Test that calls beyond the burst are spaced out at the configured rate"""
+        bucket = TokenBucket(rate=50, capacity=2)
+        started = time.monotonic()
+        for _ in range(7):
+            bucket.acquire()
+        # 2 calls from the burst, the other 5 wait 1/50 s each
+        assert time.monotonic() - started >= 5 / 50 * 0.9
@@ -1,9 +1,19 @@
 """
 Tests for database connection and schema
 """
+import struct
+from decimal import Decimal
 import pytest
+import numpy as np
+import pandas as pd
 import psycopg
 from config import db_credentials
+from src.db.connection import db_conninfo, open_pool, psql_connect_and_setup
+from src.db.insertion import _move_staged_sql, copy_stock_data, copy_sim_data
+from src.db.runs import apply_retention, detach_run, partition_name
+from src.db.simulation_paths import copy_sim_paths, encode_paths, frame_to_paths, paths_to_frame, read_sim_paths
+from src.db.binary_copy import COPY_SIGNATURE, COPY_TRAILER, SIMULATION_COPY, STOCK_DATA_COPY, STOCK_DATA_STAGE, encode_frame, encode_numeric_column, encode_table_rows, iter_blocks, ticker_categories
+from src.Transform.schema import enforce_stock_data_schema, SIMULATION_DTYPES
 
 
 class TestDatabaseConnection:
@@ -107,3 +117,302 @@ class TestDatabaseConnection:
         except psycopg.DatabaseError as e:
             pytest.skip(f"Cannot connect to database: {e}")
 
+
+def _decode_binary_rows(data: bytes) -> list[list[bytes]]:
+    """Split binary COPY records into the raw bytes of every field."""
+    rows, pos = [], 0
+    while pos < len(data):
+        (n_fields,) = struct.unpack_from('>h', data, pos)
+        pos += 2
+        fields = []
+        for _ in range(n_fields):
+            (length,) = struct.unpack_from('>i', data, pos)
+            fields.append(data[pos + 4:pos + 4 + length])
+            pos += 4 + length
+        rows.append(fields)
+    return rows
+
+
+@pytest.fixture
+def simulation_frame():
+    """2 tickers x 3 paths x 3 years where every year starts at the previous ending value"""
+    rng = np.random.default_rng(0)
+    rows = []
+    for ticker in ['SPY', 'AAPL']:
+        for sim in range(3):
+            value = 250000.0
+            for year in range(1, 4):
+                ending = value * float(np.exp(rng.normal(0.05, 0.2)))
+                rows.append({'simulation_num': sim, 'ticker': ticker, 'year': year, 'starting_value': value,
+                             'ending_value': ending, 'annual_return': ending / value - 1, 'cumulative_return': ending / 250000 - 1,
+                             'volatility': 0.2, 'probability': int(ending > 250000)})
+                value = float(np.float32(ending))
+    df = pd.DataFrame(rows)
+    df['ticker'] = df['ticker'].astype('category')
+    return df.astype(SIMULATION_DTYPES)
+
+
+class TestBinaryCopy:
+    """Test the binary COPY encoding of the bulk loader"""
+
+    def test_stock_data_encoding(self, sample_stock_data):
+        """Every field is encoded as the documented big-endian binary value"""
+        df = enforce_stock_data_schema(sample_stock_data.copy())
+        df.loc[1, 'open'] = np.nan
+        rows = _decode_binary_rows(encode_frame(df, STOCK_DATA_STAGE))
+
+        assert len(rows) == 4
+        assert all(len(row) == len(STOCK_DATA_STAGE) for row in rows)
+        assert ticker_categories(df) == ['AAPL', 'NVDA']
+        assert struct.unpack('>h', rows[2][0])[0] == 1  # NVDA
+        # 2024-01-01 is 8766 days after the PostgreSQL epoch 2000-01-01
+        assert struct.unpack('>i', rows[0][1])[0] == 8766
+        assert struct.unpack('>d', rows[0][2])[0] == 150.0
+        assert np.isnan(struct.unpack('>d', rows[1][2])[0])
+        assert struct.unpack('>q', rows[3][7])[0] == 2100000
+
+    def test_float32_values_are_widened(self):
+        """float32 stock prices are staged as exact float8 values"""
+        df = pd.DataFrame({
+            'ticker': ['SPY'], 'date': ['2024-01-02'], 'open': [1234567.89], 'high': [1.0], 'low': [1.0],
+            'close': [1.0], 'adj_close': [1.0], 'volume': [1]
+        })
+        (row,) = _decode_binary_rows(encode_frame(enforce_stock_data_schema(df, float_dtype='float32'), STOCK_DATA_STAGE))
+
+        assert struct.unpack('>d', row[2])[0] == float(np.float32(1234567.89))
+
+    def test_numeric_encoding(self):
+        """Numbers become base-10000 NUMERIC digits, rounded to the 15 significant digits of the server's float8 cast"""
+        fields, _ = encode_numeric_column(np.array([1234.5678, -0.000125, 0.0, 1 / 3, 1e20, np.nan]))
+
+        def decode(field):
+            value = sum(Decimal(int(digit)) * Decimal(10000) ** (int(field['weight']) - i) for i, digit in enumerate(field['digits']))
+            return (-value if field['sign'] == 0x4000 else value), int(field['dscale'])
+
+        assert decode(fields[0]) == (Decimal('1234.5678'), 4)
+        assert decode(fields[1]) == (Decimal('-0.000125'), 6)
+        assert decode(fields[2]) == (0, 0)
+        assert decode(fields[3]) == (Decimal('0.333333333333333'), 15)
+        assert decode(fields[4]) == (Decimal('1e20'), 0)
+        assert fields['sign'][5] == 0xC000
+        assert (fields['ndigits'] == 5).all()
+
+    def test_table_rows_encoding(self, sample_stock_data, simulation_frame):
+        """Rows for the tables themselves carry the ticker text and are split into runs of one ticker"""
+        df = enforce_stock_data_schema(sample_stock_data.copy())
+        rows = _decode_binary_rows(encode_table_rows(df, STOCK_DATA_COPY))
+
+        assert [row[0] for row in rows] == [b'AAPL', b'AAPL', b'NVDA', b'NVDA']
+        assert struct.unpack('>i', rows[0][1])[0] == 8766
+        assert struct.unpack('>q', rows[3][7])[0] == 2100000
+        assert all(len(row[2]) == 18 for row in rows)  # NUMERIC header and 5 digit groups
+
+        rows = _decode_binary_rows(encode_table_rows(simulation_frame.iloc[::-1], SIMULATION_COPY))
+        assert len(rows) == 18 and all(len(row) == len(SIMULATION_COPY) for row in rows)
+        assert rows[0][1] == b'AAPL' and rows[-1][1] == b'SPY'
+
+    def test_stream_framing(self, sample_stock_data):
+        """Blocks are slices of the frame and the stream is framed by the signature and trailer"""
+        df = enforce_stock_data_schema(sample_stock_data.copy())
+        blocks = list(iter_blocks(df, block_rows=3))
+
+        assert [len(block) for block in blocks] == [3, 1]
+        assert COPY_SIGNATURE.startswith(b'PGCOPY\n\xff\r\n\x00') and len(COPY_SIGNATURE) == 19
+        assert struct.unpack('>h', COPY_TRAILER)[0] == -1
+        with pytest.raises(ValueError):
+            list(iter_blocks(df, block_rows=0))
+
+    def test_ticker_must_be_categorical(self, sample_stock_data):
+        """Object tickers are rejected instead of encoded"""
+        with pytest.raises(ValueError):
+            ticker_categories(sample_stock_data)
+
+
+class TestUpsertLoad:
+    """Test the staged merge statement of the loader"""
+
+    def test_upsert_merges_on_the_key(self):
+        """Upsert mode merges on (ticker, date), only rewrites changed rows and counts both cases"""
+        sql = _move_staged_sql('stock_data', STOCK_DATA_STAGE, 'stock_data_stage', ['ticker', 'date'])
+
+        assert 'DISTINCT ON (ticker_code, date)' in sql
+        assert 'ON CONFLICT (ticker, date) DO UPDATE' in sql
+        assert 'adj_close = EXCLUDED.adj_close' in sql and 'ticker = EXCLUDED' not in sql
+        assert 'IS DISTINCT FROM' in sql
+        assert 'RETURNING (xmax = 0) AS inserted' in sql
+        assert sql.count('%s') == 1
+
+    def test_unknown_mode(self, sample_stock_data):
+        """An unknown mode is rejected before a connection is taken"""
+        with pytest.raises(ValueError):
+            copy_stock_data(None, enforce_stock_data_schema(sample_stock_data.copy()), mode='merge')
+
+class TestConnectionPool:
+    """Test the shared connection pool setup"""
+
+    @pytest.fixture
+    def credentials(self):
+        return {'host': '127.0.0.1', 'port': '1', 'database': 'monte_sim_stock_data', 'user': 'postgres', 'password': 'two words', 'timeout': '1'}
+
+    def test_conninfo_quotes_values(self, credentials):
+        """The DSN is built in one place and quotes passwords with spaces"""
+        conninfo = db_conninfo(credentials)
+        assert "password='two words'" in conninfo
+        assert 'dbname=monte_sim_stock_data' in conninfo
+        assert 'dbname=postgres' in db_conninfo(credentials, dbname='postgres')
+
+    def test_invalid_pool_size(self, credentials):
+        """Pool sizes are validated before connecting"""
+        with pytest.raises(ValueError):
+            open_pool(credentials, min_size=0)
+        with pytest.raises(ValueError):
+            open_pool(credentials, min_size=4, max_size=2)
+
+    def test_unreachable_server(self, credentials):
+        """An unreachable server surfaces as a database error instead of hanging"""
+        with pytest.raises(psycopg.DatabaseError):
+            open_pool(credentials)
+
+
+class TestSimulationRuns:
+    """Test the run partition helpers"""
+
+    def test_partition_name(self):
+        """Every run gets its own table name, built from an integer only"""
+        assert partition_name(7) == 'simulation_p7'
+        assert partition_name(7, 'paths') == 'simulation_paths_p7'
+        with pytest.raises(ValueError):
+            partition_name('7; DROP TABLE simulation')
+
+    def test_retention_keeps_at_least_one_run(self):
+        """Retention can't be asked to drop every run"""
+        with pytest.raises(ValueError):
+            apply_retention(None, keep_runs=0)
+
+
+class TestSimulationPaths:
+    """Test the one row per path storage layout"""
+
+    def test_round_trip(self, simulation_frame):
+        """A frame converted to paths and back comes out identical, in ticker, simulation, year order"""
+        paths = frame_to_paths(simulation_frame)
+
+        assert paths['ending_values'].shape == (6, 3)
+        assert list(paths['ticker']) == ['AAPL'] * 3 + ['SPY'] * 3
+        expected = simulation_frame.sort_values(['ticker', 'simulation_num', 'year']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(paths_to_frame(paths), expected)
+
+    def test_incomplete_paths_are_rejected(self, simulation_frame):
+        """Paths with a missing year or a gap between years can't be stored as arrays"""
+        with pytest.raises(ValueError):
+            frame_to_paths(simulation_frame.iloc[1:])
+        broken = simulation_frame.copy()
+        broken.loc[1, 'starting_value'] += 1
+        with pytest.raises(ValueError):
+            frame_to_paths(broken)
+
+    def test_encoding(self, simulation_frame):
+        """Each path is one record with the ticker text, the first starting value and one array per yearly column"""
+        paths = frame_to_paths(simulation_frame)
+        rows = _decode_binary_rows(encode_paths(paths))
+
+        assert len(rows) == 6
+        assert rows[0][0] == b'AAPL' and rows[3][0] == b'SPY'
+        assert struct.unpack('>f', rows[0][2])[0] == 250000.0
+        # ending_values: 1 dimension, no NULLs, float4 elements, 3 of them starting at index 1
+        assert struct.unpack('>5i', rows[0][3][:20]) == (1, 0, 700, 3, 1)
+        first_ending = struct.unpack('>if', rows[0][3][20:28])
+        assert first_ending == (4, paths['ending_values'][0, 0])
+        assert struct.unpack('>3i', rows[0][7][:12]) == (1, 0, 16)
+
+
+@pytest.fixture(scope='module')
+def db_pool():
+    """Pool on a scratch database next to the configured one (opened once, so a missing server is only waited for once)"""
+    credentials = {**db_credentials, 'database': f"{db_credentials.get('database') or 'monte_sim_stock_data'}_test"}
+    try:
+        pool = open_pool(credentials)
+    except (psycopg.DatabaseError, ValueError) as e:
+        pytest.skip(f"Cannot connect to database: {e}")
+    yield pool
+    pool.close()
+
+
+@pytest.mark.db
+class TestDatabaseLoads:
+    """Run the loaders against a PostgreSQL server (skipped without one), on the <DB_NAME>_test database"""
+
+    @pytest.fixture
+    def pool(self, db_pool):
+        """The scratch database with freshly created tables"""
+        with db_pool.connection() as conn:
+            #scratch database: start from an empty schema, detached run tables included
+            conn.execute("DROP SCHEMA public CASCADE;")
+            conn.execute("CREATE SCHEMA public;")
+        psql_connect_and_setup(db_pool)
+        return db_pool
+
+    def _query(self, pool, sql, params=None):
+        with pool.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def test_stock_data_append_then_upsert(self, pool, sample_stock_data):
+        """Rows are staged, cast and merged: reruns count as unchanged and only changed prices are rewritten"""
+        df = enforce_stock_data_schema(sample_stock_data.copy())
+        assert copy_stock_data(pool, df, mode='append') == {'inserted': 4, 'updated': 0, 'unchanged': 0}
+
+        changed = sample_stock_data.copy()
+        changed.loc[1, 'close'] = 155.5
+        new_row = changed.iloc[[1]].assign(date='2024-01-03')
+        changed = enforce_stock_data_schema(pd.concat([changed, new_row], ignore_index=True))
+        assert copy_stock_data(pool, changed, block_rows=2) == {'inserted': 1, 'updated': 1, 'unchanged': 3}
+        assert copy_stock_data(pool, changed) == {'inserted': 0, 'updated': 0, 'unchanged': 5}
+
+        rows = self._query(pool, "SELECT date, close, volume FROM stock_data WHERE ticker = 'AAPL' ORDER BY date;")
+        assert [(str(day), float(close), volume) for day, close, volume in rows] == [
+            ('2024-01-01', 151.0, 1000000), ('2024-01-02', 155.5, 1100000), ('2024-01-03', 155.5, 1100000)
+        ]
+        with pytest.raises(psycopg.errors.UniqueViolation):
+            copy_stock_data(pool, df, mode='append')
+
+    def test_simulation_runs_and_retention(self, pool, simulation_frame):
+        """Every load is an attached run partition, retention drops the oldest ones whole"""
+        runs = [
+            copy_sim_data(pool, [simulation_frame.iloc[:9], simulation_frame.iloc[9:]], tickers=['SPY', 'AAPL'],
+                          parameters={'num_simulations': 3, 'years': 3}, block_rows=4, failed_tickers=['BAD'])
+            for _ in range(3)
+        ]
+        assert [run['rows'] for run in runs] == [18, 18, 18]
+
+        stored = self._query(pool, "SELECT ending_value FROM simulation WHERE run_id = %s ORDER BY ticker, simulation_num, year;", (runs[0]['run_id'],))
+        expected = simulation_frame.sort_values(['ticker', 'simulation_num', 'year'])['ending_value'].astype(float).round(2)
+        assert [float(value) for (value,) in stored] == expected.tolist()
+        assert self._query(pool, "SELECT tickers, failed_tickers, num_simulations, row_count, attached FROM simulation_run WHERE run_id = %s;", (runs[0]['run_id'],)) == [
+            (['SPY', 'AAPL'], ['BAD'], 3, 18, True)
+        ]
+
+        assert apply_retention(pool, keep_runs=2) == [runs[0]['run_id']]
+        assert self._query(pool, "SELECT count(*) FROM simulation;") == [(36,)]
+        assert self._query(pool, "SELECT to_regclass(%s);", (partition_name(runs[0]['run_id']),)) == [(None,)]
+
+        detach_run(pool, runs[1]['run_id'], drop=False)
+        assert self._query(pool, "SELECT count(*) FROM simulation;") == [(18,)]
+        assert self._query(pool, f"SELECT count(*) FROM {partition_name(runs[1]['run_id'])};") == [(18,)]
+
+    def test_simulation_paths_round_trip(self, pool, simulation_frame):
+        """Paths are copied as arrays and read back as the transform_monte_carlo_data frame"""
+        run = copy_sim_paths(pool, [simulation_frame.iloc[:9], simulation_frame.iloc[9:]], tickers=['SPY', 'AAPL'],
+                             parameters={'num_simulations': 3, 'years': 3}, block_rows=4)
+        assert run['rows'] == 6
+
+        expected = simulation_frame.sort_values(['ticker', 'simulation_num', 'year']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(read_sim_paths(pool, run['run_id']), expected)
+        spy = read_sim_paths(pool, run['run_id'], tickers=['SPY'])
+        assert set(spy['ticker']) == {'SPY'} and len(spy) == 9
+
+        #retention covers both layouts
+        rows_run = copy_sim_data(pool, simulation_frame, tickers=['SPY', 'AAPL'])
+        assert apply_retention(pool, keep_runs=1) == [run['run_id']]
+        assert self._query(pool, "SELECT run_id, storage FROM simulation_run;") == [(rows_run['run_id'], 'rows')]
+        assert self._query(pool, "SELECT count(*) FROM simulation_paths;") == [(0,)]
+
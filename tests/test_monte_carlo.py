@@ -0,0 +1,595 @@
+"""
+Tests for Monte Carlo simulation
+"""
+import os
+import pytest
+import pandas as pd
+import numpy as np
+from src.Transform.monte_carlo import (
+    run_monte_carlo,
+    iter_monte_carlo,
+    transform_monte_carlo_data,
+    iter_transform_monte_carlo_data,
+    summarize_monte_carlo,
+    SIMULATION_COLUMNS,
+    PORTFOLIO_TICKER,
+    _ticker_return_params,
+    _portfolio_return_params
+)
+from src.Transform.sim_summary import QuantileSketch, SimulationSummary, SUMMARY_COLUMNS
+from src.Transform.sim_cache import SimulationCache, simulation_cache_key
+from src.Transform.return_stats import ReturnStatsStore
+
+
+class TestRunMonteCarlo:
+    """Test the vectorized Monte Carlo engine"""
+
+    def test_run_monte_carlo_columns_and_shape(self, sample_price_history):
+        """Test that the output keeps the simulation table columns and one row per sim/ticker/year"""
+        result = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], years=3, num_simulations=20, seed=1)
+
+        assert list(result.columns) == SIMULATION_COLUMNS
+        assert len(result) == 20 * 2 * 3
+        assert set(result['ticker']) == {'AAPL', 'SPY'}
+        assert sorted(result['year'].unique()) == [1, 2, 3]
+
+    def test_run_monte_carlo_is_reproducible(self, sample_price_history):
+        """Test that the same seed gives the same paths"""
+        first = run_monte_carlo(sample_price_history, ['AAPL'], years=2, num_simulations=10, seed=5)
+        second = run_monte_carlo(sample_price_history, ['AAPL'], years=2, num_simulations=10, seed=5)
+
+        pd.testing.assert_frame_equal(first, second)
+
+    def test_run_monte_carlo_worker_count_does_not_change_results(self, sample_price_history):
+        """Test that a seeded run gives identical paths for any number of worker processes"""
+        serial = run_monte_carlo(sample_price_history, ['AAPL', 'TSLA'], years=2, num_simulations=25, seed=3, batch_size=4)
+        parallel = run_monte_carlo(sample_price_history, ['AAPL', 'TSLA'], years=2, num_simulations=25, seed=3, batch_size=4, n_workers=3)
+
+        pd.testing.assert_frame_equal(serial, parallel)
+        assert list(parallel['simulation_num'].unique()) == list(range(25))
+
+    def test_run_monte_carlo_does_not_touch_global_random_state(self, sample_price_history):
+        """Test that seeding a run leaves numpy's global random state alone"""
+        np.random.seed(123)
+        expected = np.random.random()
+        np.random.seed(123)
+        run_monte_carlo(sample_price_history, ['AAPL'], years=1, num_simulations=5, seed=9)
+
+        assert np.random.random() == expected
+
+    def test_run_monte_carlo_yearly_values_chain(self, sample_price_history):
+        """Test that each year starts where the previous one ended and returns are consistent"""
+        result = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], portfolio_value=1000, years=4, num_simulations=5, seed=2)
+
+        for _, path in result.groupby(['simulation_num', 'ticker']):
+            path = path.sort_values('year')
+            assert path['starting_value'].iloc[0] == pytest.approx(500)
+            np.testing.assert_allclose(path['starting_value'].values[1:], path['ending_value'].values[:-1])
+            # values are stored as float32
+            np.testing.assert_allclose(path['ending_value'] / path['starting_value'] - 1, path['annual_return'], atol=1e-6)
+            np.testing.assert_allclose(path['ending_value'] / 500 - 1, path['cumulative_return'], atol=1e-6)
+        assert set(result['probability'].unique()) <= {0, 1}
+
+    def test_run_monte_carlo_skips_missing_tickers(self, sample_price_history):
+        """Test that tickers without price history are skipped"""
+        result = run_monte_carlo(sample_price_history, ['AAPL', 'MISSING'], years=1, num_simulations=3, seed=0)
+
+        assert set(result['ticker']) == {'AAPL'}
+        # the portfolio is still split across every requested ticker
+        assert result['starting_value'].iloc[0] == pytest.approx(250000 / 2)
+
+    def test_run_monte_carlo_requires_columns(self):
+        """Test that a DataFrame without price columns is rejected"""
+        with pytest.raises(ValueError, match="adj_close"):
+            run_monte_carlo(pd.DataFrame({'ticker': [], 'date': []}), ['AAPL'])
+
+
+class TestPortfolioMonteCarlo:
+    """Test correlated multi-asset portfolio simulation"""
+
+    @pytest.fixture
+    def correlated_price_history(self):
+        """Two strongly correlated tickers and one independent ticker"""
+        rng = np.random.default_rng(7)
+        dates = pd.bdate_range('2018-01-01', periods=1500)
+        cov_factor = np.linalg.cholesky(np.array([[1.0, 0.9, 0.0], [0.9, 1.0, 0.0], [0.0, 0.0, 1.0]])) * 0.015
+        returns = rng.standard_normal((len(dates), 3)) @ cov_factor.T + 0.0003
+        return pd.concat([
+            pd.DataFrame({'ticker': ticker, 'date': dates, 'adj_close': 100 * np.exp(np.cumsum(returns[:, i]))})
+            for i, ticker in enumerate(['AAA', 'BBB', 'CCC'])
+        ], ignore_index=True)
+
+    def test_portfolio_rows_are_added(self, correlated_price_history):
+        """Test that each simulation and year gets a portfolio row equal to the sum of the holdings"""
+        result = run_monte_carlo(correlated_price_history, ['AAA', 'BBB', 'CCC'], portfolio_value=3000, years=2, num_simulations=10, seed=0, portfolio=True)
+
+        assert list(result.columns) == SIMULATION_COLUMNS
+        assert len(result) == 10 * 4 * 2
+        totals = result[result['ticker'] != PORTFOLIO_TICKER].groupby(['simulation_num', 'year'])['ending_value'].sum()
+        portfolio_rows = result[result['ticker'] == PORTFOLIO_TICKER].set_index(['simulation_num', 'year'])['ending_value']
+        np.testing.assert_allclose(portfolio_rows.sort_index(), totals.sort_index())
+        first_year = result[(result['ticker'] == PORTFOLIO_TICKER) & (result['year'] == 1)]
+        np.testing.assert_allclose(first_year['starting_value'], 3000)
+
+    def test_portfolio_returns_are_correlated(self, correlated_price_history):
+        """Test that simulated returns keep the historical correlation between tickers"""
+        result = run_monte_carlo(correlated_price_history, ['AAA', 'BBB', 'CCC'], years=1, num_simulations=2000, seed=1, portfolio=True)
+        returns = result.pivot(index='simulation_num', columns='ticker', values='annual_return')
+        corr = returns.corr()
+
+        assert corr.loc['AAA', 'BBB'] > 0.8
+        assert abs(corr.loc['AAA', 'CCC']) < 0.15
+
+    def test_portfolio_summary_includes_portfolio(self, correlated_price_history):
+        """Test that summary mode also reports the portfolio total"""
+        summary = summarize_monte_carlo(correlated_price_history, ['AAA', 'BBB'], years=2, num_simulations=100, seed=1, portfolio=True)
+
+        assert list(summary['ticker'].unique()) == ['AAA', 'BBB', PORTFOLIO_TICKER]
+
+
+class TestSamplingMethods:
+    """Test variance-reduction sampling modes"""
+
+    def test_antithetic_pairs_mirror_each_other(self, sample_price_history):
+        """Test that antithetic paths come in pairs whose log growth mirrors around the drift"""
+        result = run_monte_carlo(sample_price_history, ['AAPL'], years=1, num_simulations=8, seed=0, batch_size=8, sampling='antithetic')
+        log_growth = np.log1p(result['annual_return'].to_numpy())
+
+        np.testing.assert_allclose(log_growth[:4] + log_growth[4:], 2 * log_growth.mean(), rtol=1e-5)
+
+    def test_sobol_is_reproducible_across_workers(self, sample_price_history):
+        """Test that quasi-random shards give the same result for any worker count"""
+        serial = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], years=2, num_simulations=64, seed=4, batch_size=16, sampling='sobol')
+        parallel = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], years=2, num_simulations=64, seed=4, batch_size=16, sampling='sobol', n_workers=2)
+
+        pd.testing.assert_frame_equal(serial, parallel)
+        assert serial['ending_value'].nunique() == len(serial)
+
+    def test_sobol_keeps_return_distribution(self, sample_price_history):
+        """Test that quasi-random sampling keeps the mean and spread of yearly log growth"""
+        pseudo = run_monte_carlo(sample_price_history, ['TSLA'], years=1, num_simulations=4096, seed=1, batch_size=1024)
+        sobol = run_monte_carlo(sample_price_history, ['TSLA'], years=1, num_simulations=4096, seed=1, batch_size=1024, sampling='sobol')
+
+        assert np.log1p(sobol['annual_return']).mean() == pytest.approx(np.log1p(pseudo['annual_return']).mean(), abs=0.02)
+        assert np.log1p(sobol['annual_return']).std() == pytest.approx(np.log1p(pseudo['annual_return']).std(), rel=0.05)
+        assert sobol['volatility'].mean() == pytest.approx(pseudo['volatility'].mean(), rel=0.01)
+
+    def test_unknown_sampling_method(self, sample_price_history):
+        """Test that an unsupported sampling method is rejected"""
+        with pytest.raises(ValueError, match="Unknown sampling method"):
+            run_monte_carlo(sample_price_history, ['AAPL'], num_simulations=2, sampling='halton')
+
+
+class TestYearlyStep:
+    """Test exact aggregated-horizon (yearly-step) sampling"""
+
+    @pytest.mark.parametrize('portfolio', [False, True])
+    def test_yearly_step_matches_daily_step_distribution(self, sample_price_history, portfolio):
+        """Test that yearly-step paths have the same distribution as daily-step paths"""
+        kwargs = dict(years=2, num_simulations=4000, batch_size=1000, portfolio=portfolio)
+        daily = run_monte_carlo(sample_price_history, ['AAPL', 'TSLA'], seed=1, **kwargs)
+        yearly = run_monte_carlo(sample_price_history, ['AAPL', 'TSLA'], seed=2, step='yearly', **kwargs)
+
+        assert list(yearly.columns) == SIMULATION_COLUMNS
+        assert len(yearly) == len(daily)
+        for col in ['annual_return', 'volatility']:
+            daily_log = daily.groupby('ticker')[col].apply(lambda x: np.log1p(x).mean())
+            yearly_log = yearly.groupby('ticker')[col].apply(lambda x: np.log1p(x).mean())
+            np.testing.assert_allclose(yearly_log, daily_log, atol=0.02)
+        # the spread of realized volatility is exact for tickers (portfolio volatility is approximated)
+        holdings = ['AAPL', 'TSLA']
+        np.testing.assert_allclose(
+            yearly.groupby('ticker')['volatility'].std()[holdings], daily.groupby('ticker')['volatility'].std()[holdings], rtol=0.1
+        )
+
+    def test_yearly_step_with_sobol(self, sample_price_history):
+        """Test that quasi-random sampling drives the yearly draws directly"""
+        result = run_monte_carlo(sample_price_history, ['SPY'], years=3, num_simulations=256, seed=0, batch_size=128, step='yearly', sampling='sobol')
+
+        assert len(result) == 256 * 3
+        np.testing.assert_allclose(result.groupby('simulation_num')['starting_value'].first(), 250000)
+
+    def test_unknown_step_mode(self, sample_price_history):
+        """Test that an unsupported step mode is rejected"""
+        with pytest.raises(ValueError, match="Unknown step mode"):
+            run_monte_carlo(sample_price_history, ['AAPL'], num_simulations=2, step='monthly')
+
+
+class TestBootstrapMonteCarlo:
+    """Test the historical bootstrap return model"""
+
+    @pytest.fixture
+    def two_state_price_history(self):
+        """Daily log returns are always +1% or -1%, and BBB moves exactly twice as much as AAA"""
+        rng = np.random.default_rng(3)
+        dates = pd.bdate_range('2020-01-01', periods=400)
+        returns = rng.choice([0.01, -0.01], size=len(dates) - 1)
+        log_prices = np.concatenate([[0.0], np.cumsum(returns)])
+        return pd.concat([
+            pd.DataFrame({'ticker': 'AAA', 'date': dates, 'adj_close': 100 * np.exp(log_prices)}),
+            pd.DataFrame({'ticker': 'BBB', 'date': dates, 'adj_close': 100 * np.exp(2 * log_prices)})
+        ], ignore_index=True)
+
+    def test_bootstrap_only_uses_historical_returns(self, two_state_price_history):
+        """Test that every simulated day is one of the historical daily returns"""
+        result = run_monte_carlo(two_state_price_history, ['AAA'], years=2, num_simulations=200, seed=0, simulation_model='bootstrap')
+
+        # 252 days of +-1% always sum to an even number of percent
+        log_growth = np.log1p(result['annual_return']) * 100
+        np.testing.assert_allclose(log_growth, np.round(log_growth / 2) * 2, atol=1e-6)
+
+    @pytest.mark.parametrize('portfolio', [False, True])
+    def test_bootstrap_portfolio_keeps_dates_aligned(self, two_state_price_history, portfolio):
+        """Test that portfolio mode resamples the same dates for every ticker"""
+        result = run_monte_carlo(
+            two_state_price_history, ['AAA', 'BBB'], years=1, num_simulations=200, seed=0,
+            simulation_model='bootstrap', portfolio=portfolio
+        )
+        aaa = np.log1p(result[result['ticker'] == 'AAA']['annual_return'].to_numpy())
+        bbb = np.log1p(result[result['ticker'] == 'BBB']['annual_return'].to_numpy())
+
+        assert np.allclose(bbb, 2 * aaa) == portfolio
+
+    def test_bootstrap_blocks_are_reproducible(self, sample_price_history):
+        """Test that block bootstrap results only depend on the seed"""
+        kwargs = dict(years=2, num_simulations=50, seed=4, batch_size=20, simulation_model='bootstrap', block_size=21)
+        serial = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], **kwargs)
+        parallel = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], n_workers=2, **kwargs)
+
+        pd.testing.assert_frame_equal(serial, parallel)
+        assert (serial['volatility'] > 0).all()
+
+    def test_bootstrap_rejects_other_options(self, sample_price_history):
+        """Test that the bootstrap needs daily steps, pseudo-random draws and a positive block size"""
+        with pytest.raises(ValueError, match="bootstrap"):
+            run_monte_carlo(sample_price_history, ['AAPL'], num_simulations=2, simulation_model='bootstrap', step='yearly')
+        with pytest.raises(ValueError, match="block_size"):
+            run_monte_carlo(sample_price_history, ['AAPL'], num_simulations=2, simulation_model='bootstrap', block_size=0)
+        with pytest.raises(ValueError, match="Unknown simulation model"):
+            run_monte_carlo(sample_price_history, ['AAPL'], num_simulations=2, simulation_model='garch')
+
+
+class TestAdaptiveMonteCarlo:
+    """Test convergence-based adaptive simulation counts"""
+
+    def test_low_volatility_ticker_needs_fewer_paths(self, sample_price_history):
+        """Test that each ticker stops on its own and volatile tickers get more paths"""
+        result = run_monte_carlo(sample_price_history, ['SPY', 'TSLA'], years=2, num_simulations=4000, seed=0, batch_size=100, target_se=0.01)
+        paths = result.attrs['paths_per_ticker']
+
+        assert paths['SPY'] < paths['TSLA'] <= 4000
+        assert result.groupby('ticker')['simulation_num'].nunique().to_dict() == paths
+        assert list(result.columns) == SIMULATION_COLUMNS
+
+    def test_adaptive_stops_at_num_simulations(self, sample_price_history):
+        """Test that num_simulations caps the path count when the target is not reached"""
+        result = run_monte_carlo(sample_price_history, ['TSLA'], years=1, num_simulations=300, seed=0, batch_size=100, target_ci_width=1e-6)
+
+        assert result.attrs['paths_per_ticker'] == {'TSLA': 300}
+
+    def test_adaptive_is_independent_of_workers(self, sample_price_history):
+        """Test that the per-ticker streams give the same result for any worker count"""
+        kwargs = dict(years=1, num_simulations=2000, seed=3, batch_size=100, target_ci_width=0.05)
+        serial = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], **kwargs)
+        parallel = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], n_workers=2, **kwargs)
+
+        pd.testing.assert_frame_equal(serial, parallel)
+
+    def test_adaptive_rejects_portfolio_mode(self, sample_price_history):
+        """Test that adaptive counts cannot be combined with joint portfolio simulation"""
+        with pytest.raises(ValueError, match="portfolio"):
+            run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], num_simulations=10, portfolio=True, target_se=0.01)
+
+
+class TestSimulationCache:
+    """Test disk memoization of simulation results"""
+
+    def test_rerun_reads_cached_result(self, sample_price_history, tmp_path, monkeypatch):
+        """Test that a rerun with unchanged inputs skips the simulation"""
+        kwargs = dict(years=2, num_simulations=20, seed=0, batch_size=10, cache_dir=str(tmp_path))
+        first = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], **kwargs)
+        assert len(list(tmp_path.glob('*.parquet'))) == 1
+
+        def fail(*args, **kwargs):
+            raise AssertionError("simulation should not run")
+        monkeypatch.setattr('src.Transform.monte_carlo._run_shards', fail)
+        second = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], **kwargs)
+
+        pd.testing.assert_frame_equal(first, second)
+
+    def test_changed_inputs_miss_the_cache(self, sample_price_history, tmp_path):
+        """Test that new prices or parameters produce a new cache entry"""
+        kwargs = dict(years=2, num_simulations=20, seed=0, batch_size=10, cache_dir=str(tmp_path))
+        run_monte_carlo(sample_price_history, ['AAPL'], **kwargs)
+        run_monte_carlo(sample_price_history, ['AAPL'], **{**kwargs, 'seed': 1})
+        new_day = pd.DataFrame({'ticker': ['AAPL'], 'date': [pd.Timestamp('2030-01-01')], 'adj_close': [150.0]})
+        run_monte_carlo(pd.concat([sample_price_history, new_day], ignore_index=True), ['AAPL'], **kwargs)
+
+        assert len(list(tmp_path.glob('*.parquet'))) == 3
+
+    def test_unseeded_runs_are_not_cached(self, sample_price_history, tmp_path):
+        """Test that seed=None always simulates fresh paths"""
+        run_monte_carlo(sample_price_history, ['AAPL'], years=1, num_simulations=5, cache_dir=str(tmp_path))
+
+        assert not list(tmp_path.glob('*.parquet'))
+
+    def test_cache_key_ignores_unrelated_tickers(self, sample_price_history):
+        """Test that only the simulated tickers' history is part of the key"""
+        params = dict(years=2, seed=0)
+        key = simulation_cache_key(sample_price_history, ['AAPL'], params)
+        without_tsla = sample_price_history[sample_price_history['ticker'] != 'TSLA']
+
+        assert simulation_cache_key(without_tsla, ['AAPL'], params) == key
+        assert simulation_cache_key(sample_price_history, ['SPY'], params) != key
+
+    def test_least_recently_used_entries_are_evicted(self, tmp_path):
+        """Test that the cache drops the oldest unused entries when it is over its size limit"""
+        frame = pd.DataFrame({'value': np.arange(1000, dtype=float)})
+        cache = SimulationCache(str(tmp_path))
+        cache.put('a', frame)
+        entry_size = (tmp_path / 'a.parquet').stat().st_size
+        cache.max_bytes = 2 * entry_size
+        cache.put('b', frame)
+        os.utime(tmp_path / 'a.parquet', (0, 0))
+        os.utime(tmp_path / 'b.parquet', (1, 1))
+        assert cache.get('a') is not None  # 'a' is now the most recently used
+        cache.put('c', frame)
+
+        assert cache.get('b') is None
+        assert cache.get('a') is not None and cache.get('c') is not None
+
+
+class TestReturnStatsStore:
+    """Test the incrementally maintained return statistics"""
+
+    def test_incremental_updates_match_full_history(self, sample_price_history, tmp_path):
+        """Test that absorbing the history in chunks gives the same moments as one pass"""
+        dates = sorted(sample_price_history['date'].unique())
+        store = ReturnStatsStore(str(tmp_path / 'stats.json'))
+        for start, end in [(0, 200), (200, 201), (201, 500)]:
+            chunk = sample_price_history[sample_price_history['date'].isin(dates[start:end])]
+            store.update(chunk, joint_tickers=['AAPL', 'SPY', 'TSLA'])
+
+        _, means, stds, _ = _ticker_return_params(sample_price_history, ['AAPL', 'SPY', 'TSLA'])
+        sim_tickers, store_means, store_stds = store.ticker_params(['AAPL', 'SPY', 'TSLA'])
+        assert sim_tickers == ['AAPL', 'SPY', 'TSLA']
+        np.testing.assert_allclose(store_means, means, rtol=1e-10)
+        np.testing.assert_allclose(store_stds, stds, rtol=1e-10)
+
+        _, mean, cov_factor, _ = _portfolio_return_params(sample_price_history, ['TSLA', 'AAPL'])
+        with pytest.raises(ValueError, match="not tracked"):
+            store.portfolio_params(['TSLA', 'AAPL'])
+        store.update(sample_price_history, joint_tickers=['TSLA', 'AAPL'])
+        _, store_mean, store_cov = store.portfolio_params(['TSLA', 'AAPL'])
+        np.testing.assert_allclose(store_mean, mean, rtol=1e-10)
+        np.testing.assert_allclose(store_cov, cov_factor @ cov_factor.T, rtol=1e-10)
+
+    def test_old_rows_are_ignored_after_reload(self, sample_price_history, tmp_path):
+        """Test that a saved store only absorbs rows newer than what it has seen"""
+        path = str(tmp_path / 'stats.json')
+        store = ReturnStatsStore.load(path)
+        store.update(sample_price_history)
+        store.save()
+
+        reloaded = ReturnStatsStore.load(path)
+        reloaded.update(sample_price_history)
+        assert reloaded.tickers == store.tickers
+        assert reloaded.tickers['AAPL']['count'] == 499
+
+    def test_missing_ticker_keeps_joint_statistics(self, sample_price_history, tmp_path):
+        """Test that a batch without one of the joint tickers doesn't reset the joint statistics"""
+        dates = sorted(sample_price_history['date'].unique())
+        store = ReturnStatsStore(str(tmp_path / 'stats.json'))
+        store.update(sample_price_history[sample_price_history['date'] <= dates[249]], joint_tickers=['AAPL', 'SPY'])
+        joint_count = store.joint['count']
+        later = sample_price_history[sample_price_history['date'] > dates[249]]
+        store.update(later[later['ticker'] == 'AAPL'], joint_tickers=['AAPL', 'SPY'])
+
+        assert store.joint['tickers'] == ['AAPL', 'SPY']
+        assert store.joint['count'] == joint_count
+        results = run_monte_carlo(None, ['AAPL', 'SPY'], years=2, num_simulations=4, seed=0, portfolio=True, return_stats=store)
+        assert set(results['ticker']) == {'AAPL', 'SPY', 'PORTFOLIO'}
+
+        #the next run reads from the last shared date (covered_until), which catches the joint statistics up
+        assert store.covered_until(['AAPL', 'SPY'], portfolio=True) == pd.Timestamp(dates[249])
+        store.update(later, joint_tickers=['AAPL', 'SPY'])
+        assert store.joint['count'] == joint_count + len(dates) - 250
+
+    def test_readjusted_history_is_rebuilt(self, sample_price_history, tmp_path):
+        """Test that a split between two updates rebuilds the statistics instead of adding a fake return"""
+        dates = sorted(sample_price_history['date'].unique())
+        store = ReturnStatsStore(str(tmp_path / 'stats.json'))
+        store.update(sample_price_history[sample_price_history['date'] <= dates[249]], joint_tickers=['AAPL', 'SPY'])
+
+        #4:1 AAPL split, yfinance divides every earlier AAPL price by 4
+        adjusted = sample_price_history.copy()
+        adjusted.loc[adjusted['ticker'] == 'AAPL', 'adj_close'] /= 4
+        assert store.readjusted(adjusted) == ['AAPL']
+        store.update(adjusted, joint_tickers=['AAPL', 'SPY'])
+
+        _, means, stds, _ = _ticker_return_params(adjusted, ['AAPL', 'SPY'])
+        _, store_means, store_stds = store.ticker_params(['AAPL', 'SPY'])
+        np.testing.assert_allclose(store_means, means, rtol=1e-10)
+        np.testing.assert_allclose(store_stds, stds, rtol=1e-10)
+        _, mean, cov_factor, _ = _portfolio_return_params(adjusted, ['AAPL', 'SPY'])
+        _, store_mean, store_cov = store.portfolio_params(['AAPL', 'SPY'])
+        np.testing.assert_allclose(store_mean, mean, rtol=1e-10)
+        np.testing.assert_allclose(store_cov, cov_factor @ cov_factor.T, rtol=1e-10)
+        assert store.readjusted(adjusted) == []
+
+    def test_covered_until(self, sample_price_history, tmp_path):
+        """Test the date up to which the store is complete for a set of tickers"""
+        store = ReturnStatsStore(str(tmp_path / 'stats.json'))
+        assert store.covered_until(['AAPL']) is None
+
+        dates = sorted(sample_price_history['date'].unique())
+        store.update(sample_price_history[sample_price_history['date'] <= dates[99]], joint_tickers=['AAPL', 'SPY'])
+        store.update(sample_price_history[(sample_price_history['ticker'] == 'AAPL') & (sample_price_history['date'] <= dates[199])])
+
+        assert store.covered_until(['AAPL']) == pd.Timestamp(dates[199])
+        assert store.covered_until(['AAPL', 'SPY']) == pd.Timestamp(dates[99])
+        assert store.covered_until(['AAPL', 'SPY'], portfolio=True) == pd.Timestamp(dates[99])
+        assert store.covered_until(['AAPL', 'TSLA'], portfolio=True) is None
+        assert store.covered_until(['AAPL', 'MISSING']) is None
+
+    def test_simulation_reads_parameters_from_store(self, sample_price_history, tmp_path):
+        """Test that a run driven by the store matches a run on the price history"""
+        store = ReturnStatsStore(str(tmp_path / 'stats.json'))
+        store.update(sample_price_history, joint_tickers=['AAPL', 'SPY'])
+
+        for portfolio in [False, True]:
+            kwargs = dict(years=2, num_simulations=20, seed=0, portfolio=portfolio)
+            from_history = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], **kwargs)
+            from_store = run_monte_carlo(None, ['AAPL', 'SPY'], return_stats=store, **kwargs)
+            pd.testing.assert_frame_equal(from_store, from_history, rtol=1e-8)
+
+    def test_bootstrap_still_needs_history(self, sample_price_history, tmp_path):
+        """Test that the bootstrap model cannot run on moments alone"""
+        store = ReturnStatsStore(str(tmp_path / 'stats.json'))
+        store.update(sample_price_history)
+
+        with pytest.raises(ValueError, match="price history"):
+            run_monte_carlo(None, ['AAPL'], num_simulations=2, return_stats=store, simulation_model='bootstrap')
+
+
+class TestIterMonteCarlo:
+    """Test streaming simulation output"""
+
+    def test_iter_monte_carlo_yields_fixed_size_blocks(self, sample_price_history):
+        """Test that every block holds batch_size simulations except possibly the last"""
+        chunks = list(iter_monte_carlo(sample_price_history, ['AAPL', 'SPY'], years=2, num_simulations=10, seed=4, batch_size=4))
+
+        assert [len(chunk) for chunk in chunks] == [4 * 2 * 2, 4 * 2 * 2, 2 * 2 * 2]
+        assert chunks[1]['simulation_num'].min() == 4
+
+    def test_iter_monte_carlo_matches_run_monte_carlo(self, sample_price_history):
+        """Test that the concatenated stream equals the in-memory result, also with worker processes"""
+        expected = run_monte_carlo(sample_price_history, ['AAPL', 'TSLA'], years=2, num_simulations=30, seed=8, batch_size=7)
+        streamed = pd.concat(
+            iter_monte_carlo(sample_price_history, ['AAPL', 'TSLA'], years=2, num_simulations=30, seed=8, batch_size=7, n_workers=2),
+            ignore_index=True
+        )
+        # each streamed block is ticker-major on its own, so compare in one common order
+        streamed = streamed.sort_values(['ticker', 'simulation_num', 'year']).reset_index(drop=True)
+
+        pd.testing.assert_frame_equal(expected, streamed)
+
+    def test_iter_transform_monte_carlo_data(self, sample_price_history):
+        """Test that streamed blocks are transformed one at a time"""
+        chunks = iter_monte_carlo(sample_price_history, ['SPY', 'AAPL'], years=1, num_simulations=6, seed=0, batch_size=3)
+        transformed = list(iter_transform_monte_carlo_data(chunks))
+
+        assert len(transformed) == 2
+        for chunk in transformed:
+            assert list(chunk.columns) == SIMULATION_COLUMNS
+            assert list(chunk['ticker'].iloc[:3]) == ['AAPL'] * 3
+
+
+class TestSummarizeMonteCarlo:
+    """Test summary-only simulation mode"""
+
+    def test_summarize_monte_carlo_matches_raw_paths(self, sample_price_history):
+        """Test that the streaming statistics agree with statistics of the raw path rows"""
+        kwargs = dict(years=2, num_simulations=2000, seed=11, batch_size=300)
+        summary = summarize_monte_carlo(sample_price_history, ['AAPL', 'SPY'], **kwargs)
+        paths = run_monte_carlo(sample_price_history, ['AAPL', 'SPY'], **kwargs)
+        grouped = paths.groupby(['ticker', 'year'])
+
+        assert list(summary.columns) == SUMMARY_COLUMNS
+        assert len(summary) == 2 * 2
+        assert (summary['num_paths'] == 2000).all()
+        np.testing.assert_allclose(summary['mean_ending_value'], grouped['ending_value'].mean().values)
+        np.testing.assert_allclose(summary['std_ending_value'], grouped['ending_value'].std(ddof=0).values)
+        np.testing.assert_allclose(summary['probability_of_gain'], grouped['probability'].mean().values)
+        # sketch quantiles stay within a few percent of the exact ones
+        np.testing.assert_allclose(summary['p50_ending_value'], grouped['ending_value'].median().values, rtol=0.03)
+        np.testing.assert_allclose(summary['p5_ending_value'], grouped['ending_value'].quantile(0.05).values, rtol=0.03)
+
+    def test_summarize_monte_carlo_worker_count_does_not_change_results(self, sample_price_history):
+        """Test that merging shard summaries from worker processes gives the serial result"""
+        serial = summarize_monte_carlo(sample_price_history, ['TSLA'], years=2, num_simulations=500, seed=2, batch_size=100)
+        parallel = summarize_monte_carlo(sample_price_history, ['TSLA'], years=2, num_simulations=500, seed=2, batch_size=100, n_workers=2)
+
+        pd.testing.assert_frame_equal(serial, parallel)
+
+    def test_simulation_summary_merge(self):
+        """Test that merging two summaries equals summarizing all values at once"""
+        rng = np.random.default_rng(0)
+        values = rng.lognormal(11, 0.3, size=(400, 1, 3))
+        merged = SimulationSummary(['AAPL'], 3)
+        merged.update(values[:150], 60000)
+        other = SimulationSummary(['AAPL'], 3)
+        other.update(values[150:], 60000)
+        merged.merge(other)
+        whole = SimulationSummary(['AAPL'], 3)
+        whole.update(values, 60000)
+
+        pd.testing.assert_frame_equal(merged.to_frame(), whole.to_frame())
+
+    def test_quantile_sketch_relative_accuracy(self):
+        """Test that sketch quantiles are within the configured relative error"""
+        values = np.random.default_rng(1).lognormal(0, 1, size=(10000, 1))
+        sketch = QuantileSketch(1, alpha=0.01)
+        sketch.update(values)
+
+        for q in [0.05, 0.5, 0.95]:
+            exact = np.quantile(values, q, method='lower')
+            assert sketch.quantile(q)[0] == pytest.approx(exact, rel=0.02)
+
+    def test_quantile_sketch_rejects_mismatched_merge(self):
+        """Test that sketches with different accuracy cannot be merged"""
+        with pytest.raises(ValueError, match="same parameters"):
+            QuantileSketch(1, alpha=0.01).merge(QuantileSketch(1, alpha=0.02))
+
+
+class TestTransformMonteCarlo:
+    """Test Monte Carlo result transformation"""
+
+    def test_transform_monte_carlo_sorts_rows(self, sample_price_history):
+        """Test that results are sorted by ticker, simulation and year"""
+        result = transform_monte_carlo_data(
+            run_monte_carlo(sample_price_history, ['SPY', 'AAPL'], years=2, num_simulations=4, seed=0)
+        )
+
+        expected = result.sort_values(['ticker', 'simulation_num', 'year']).reset_index(drop=True)
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_simulation_frame_is_compact(self, sample_price_history):
+        """Test that the engine builds typed columns at least 4x smaller than an object/float64 frame"""
+        result = run_monte_carlo(sample_price_history, ['TSLA', 'AAPL', 'SPY'], years=3, num_simulations=200, seed=0)
+
+        assert list(result['ticker'].cat.categories) == ['AAPL', 'SPY', 'TSLA']
+        assert result['simulation_num'].dtype == np.int32 and result['year'].dtype == np.int32
+        assert result['ending_value'].dtype == np.float32
+        assert result['probability'].dtype == np.uint8
+        wide = result.astype({'ticker': object, 'simulation_num': np.int64, 'year': np.int64}).astype(
+            {col: np.float64 for col in SIMULATION_COLUMNS[3:]}
+        )
+        assert wide.memory_usage(deep=True).sum() >= 4 * result.memory_usage(deep=True).sum()
+
+    def test_transform_monte_carlo_keeps_engine_frame(self, sample_price_history):
+        """Test that an already typed and ordered frame is not copied or re-sorted"""
+        result = run_monte_carlo(sample_price_history, ['SPY', 'AAPL'], years=2, num_simulations=4, seed=0, batch_size=3)
+
+        assert transform_monte_carlo_data(result) is result
+
+    def test_transform_monte_carlo_converts_other_frames(self):
+        """Test that frames from elsewhere get the compact types, filled values and row order"""
+        df = pd.DataFrame({
+            'simulation_num': [1, 0, 0], 'ticker': ['spy', 'spy', 'aapl'], 'year': [1, 1, 1],
+            'starting_value': [1.0, 1.0, 1.0], 'ending_value': [2.0, None, 3.0], 'annual_return': [1.0, 0.0, 2.0],
+            'cumulative_return': [1.0, 0.0, 2.0], 'volatility': [0.1, 0.1, 0.1], 'probability': [1.0, 0.0, 1.0]
+        })
+        result = transform_monte_carlo_data(df)
+
+        assert list(result['ticker']) == ['AAPL', 'SPY', 'SPY']
+        assert list(result['simulation_num']) == [0, 0, 1]
+        assert list(result['ending_value']) == [3.0, 0.0, 2.0]
+        assert result['probability'].dtype == np.uint8
+
+    def test_transform_monte_carlo_empty_data(self):
+        """Test transforming empty simulation results"""
+        result = transform_monte_carlo_data(pd.DataFrame())
+
+        assert result.empty
+        assert list(result.columns) == SIMULATION_COLUMNS
@@ -3,12 +3,15 @@ Tests for Transform module
 """
 import pytest
 import pandas as pd
+import numpy as np
 from src.Transform.main import (
     transform_yfinance_data,
     transform_finnhub_data,
     clean_stock_data,
-    transform_extracted_data
+    transform_extracted_data,
+    filter_new_rows
 )
+from src.Transform.schema import STOCK_DATA_COLUMNS, empty_stock_data, enforce_stock_data_schema
 
 
 class TestTransformYFinance:
@@ -54,6 +57,32 @@ class TestTransformYFinance:
             # When auto_adjust=True, adj_close should equal close
             assert all(result['adj_close'] == result['close'])
     
+    def test_transform_yfinance_level_order(self, sample_yfinance_data):
+        """Test that tickers on either MultiIndex level give the same rows"""
+        msft = sample_yfinance_data['AAPL'] * 2
+        msft.columns = pd.MultiIndex.from_product([['MSFT'], msft.columns])
+        ticker_first = pd.concat([sample_yfinance_data, msft], axis=1)
+        price_first = ticker_first.swaplevel(axis=1)
+
+        result = transform_yfinance_data(ticker_first)
+
+        pd.testing.assert_frame_equal(result, transform_yfinance_data(price_first))
+        assert list(result['ticker']) == ['AAPL'] * 5 + ['MSFT'] * 5
+        assert list(result.loc[result['ticker'] == 'MSFT', 'open']) == [300.0, 302.0, 304.0, 306.0, 308.0]
+
+    def test_transform_yfinance_skips_incomplete_tickers(self, sample_yfinance_data):
+        """Test that tickers missing a price column are skipped and missing days are dropped"""
+        partial = sample_yfinance_data.copy()
+        partial[('NEW', 'Close')] = [None, None, 10.0, 11.0, 12.0]
+        listed_late = sample_yfinance_data['AAPL'].copy()
+        listed_late.iloc[:2] = None
+        listed_late.columns = pd.MultiIndex.from_product([['IPO'], listed_late.columns])
+
+        result = transform_yfinance_data(pd.concat([partial, listed_late], axis=1))
+
+        assert sorted(result['ticker'].unique()) == ['AAPL', 'IPO']
+        assert (result['ticker'] == 'IPO').sum() == 3
+
     def test_transform_yfinance_empty_data(self):
         """Test transforming empty DataFrame"""
         empty_df = pd.DataFrame()
@@ -138,6 +167,36 @@ class TestCleanStockData:
         assert len(cleaned) == 1, "Row with missing data should be removed"
         assert cleaned.iloc[0]['ticker'] == 'AAPL'
 
+    def test_clean_stock_data_reports_rejected_rows(self, dirty_stock_data):
+        """Test that each validation rule reports how many rows it removed"""
+        extra = pd.DataFrame({
+            'ticker': ['aapl', 'NVDA', 'AAPL'],
+            'date': ['2024-01-01', '2024-01-03', '2024-01-03'],
+            'open': [1.0, 200.0, None],
+            'high': [1.0, 199.0, 1.0],
+            'low': [1.0, 198.0, 1.0],
+            'close': [1.0, 198.0, 1.0],
+            'adj_close': [1.0, 198.0, 1.0],
+            'volume': [5, 10, 10]
+        })
+        cleaned = clean_stock_data(pd.concat([dirty_stock_data, extra], ignore_index=True))
+
+        assert cleaned.attrs['rejected_rows'] == {
+            'missing_price': 1, 'non_positive_price': 1, 'inconsistent_ohlc': 1, 'negative_volume': 0, 'duplicate': 1
+        }
+        assert list(cleaned['ticker']) == ['AAPL', 'AAPL', 'NVDA']
+        # the first of the duplicate AAPL rows is kept
+        assert cleaned.iloc[0]['open'] == 150.0
+
+    def test_clean_stock_data_keeps_datetime_dates(self, sample_stock_data):
+        """Test that dates stay datetime64 without a time of day and rows are sorted"""
+        shuffled = sample_stock_data.iloc[::-1].assign(date=lambda df: pd.to_datetime(df['date']) + pd.Timedelta(hours=9))
+        cleaned = clean_stock_data(shuffled)
+
+        assert pd.api.types.is_datetime64_any_dtype(cleaned['date'])
+        assert list(cleaned['date']) == list(pd.to_datetime(['2024-01-01', '2024-01-02'] * 2))
+        assert list(cleaned['ticker']) == ['AAPL', 'AAPL', 'NVDA', 'NVDA']
+
 
 class TestTransformExtractedData:
     """Test main transform function"""
@@ -161,3 +220,67 @@ class TestTransformExtractedData:
         with pytest.raises(ValueError, match="Unknown data source"):
             transform_extracted_data(sample_stock_data, source='invalid_source')
 
+
+class TestStockDataSchema:
+    """Test the canonical stock_data dtypes"""
+
+    @staticmethod
+    def assert_canonical(df, price_dtype='float64'):
+        assert list(df.columns) == STOCK_DATA_COLUMNS
+        assert isinstance(df['ticker'].dtype, pd.CategoricalDtype)
+        assert list(df['ticker'].cat.categories) == sorted(df['ticker'].cat.categories)
+        assert df['date'].dtype == 'datetime64[s]'
+        assert all(df[col].dtype == price_dtype for col in ['open', 'high', 'low', 'close', 'adj_close'])
+        assert df['volume'].dtype == np.int64
+
+    def test_transforms_enforce_schema(self, sample_yfinance_data, sample_finnhub_data, sample_stock_data):
+        """Test that every transform returns the canonical dtypes, empty or not"""
+        self.assert_canonical(transform_yfinance_data(sample_yfinance_data))
+        self.assert_canonical(transform_finnhub_data(sample_finnhub_data))
+        self.assert_canonical(clean_stock_data(sample_stock_data))
+        self.assert_canonical(transform_yfinance_data(pd.DataFrame()))
+        self.assert_canonical(transform_finnhub_data(pd.DataFrame()))
+        self.assert_canonical(empty_stock_data())
+
+    def test_float32_prices(self, sample_yfinance_data):
+        """Test that float_dtype='float32' narrows only the price columns"""
+        wide = transform_yfinance_data(sample_yfinance_data)
+        narrow = transform_yfinance_data(sample_yfinance_data, float_dtype='float32')
+
+        self.assert_canonical(narrow, 'float32')
+        np.testing.assert_allclose(narrow['close'], wide['close'], rtol=1e-6)
+        assert narrow.memory_usage(deep=True).sum() < wide.memory_usage(deep=True).sum()
+
+    def test_unsupported_float_dtype(self, sample_stock_data):
+        """Test that an unknown price float type is rejected"""
+        with pytest.raises(ValueError, match="Unsupported price float type"):
+            clean_stock_data(sample_stock_data, float_dtype='float16')
+
+    def test_enforce_schema_on_plain_frame(self, sample_stock_data):
+        """Test that plain string/object columns are converted"""
+        df = enforce_stock_data_schema(sample_stock_data.copy(), 'float32')
+
+        self.assert_canonical(df, 'float32')
+        assert list(df['ticker']) == list(sample_stock_data['ticker'])
+
+
+class TestIncrementalTransform:
+    """Test watermark based incremental transforms"""
+
+    def test_filter_new_rows(self, sample_stock_data):
+        """Test that only rows after each ticker's watermark are kept"""
+        cleaned = clean_stock_data(sample_stock_data)
+        new_rows = filter_new_rows(cleaned, {'AAPL': pd.Timestamp('2024-01-01'), 'MSFT': pd.Timestamp('2030-01-01')})
+
+        assert list(zip(new_rows['ticker'], new_rows['date'].dt.day)) == [('AAPL', 2), ('NVDA', 1), ('NVDA', 2)]
+        assert filter_new_rows(cleaned, {}) is cleaned
+        assert filter_new_rows(cleaned, {'AAPL': pd.Timestamp('2024-01-02'), 'NVDA': pd.Timestamp('2024-01-02')}).empty
+
+    def test_transform_since_trims_raw_rows(self, sample_yfinance_data, sample_finnhub_data):
+        """Test that rows on or before `since` are dropped before the transform"""
+        yf_result = transform_extracted_data(sample_yfinance_data, source='yfinance', since=pd.Timestamp('2024-01-03'))
+        fh_result = transform_extracted_data(sample_finnhub_data, source='finnhub', since=pd.Timestamp('2024-01-02'))
+
+        assert list(yf_result['date'].dt.day) == [4, 5]
+        assert list(fh_result['date'].dt.day) == [3]
+        assert transform_extracted_data(sample_yfinance_data, source='yfinance', since=pd.Timestamp('2024-01-05')).empty